@@ -8,16 +8,22 @@ export default class KlineFeed extends EventEmitter {
    * @param {'spot'|'futures'} [opts.market='spot']
    * @param {string} [opts.interval='1m'] e.g. '1m','5m','15m','1h'
    * @param {number(ms)} [opts.pingInterval=15000]
+   * @param {number} [opts.idleMin=UNIVERSE_IDLE_MIN] отписка от символа, если addSymbol не звали столько минут
+   *   (то же окно, что и у вытеснения в трейдере, pyAI/src/universe.py); 0 — не отписываться
    */
-  constructor({ market = 'spot', interval = '1m', pingInterval = 15000 } = {}) {
+  constructor({ market = 'spot', interval = '1m', pingInterval = 15000,
+                idleMin = Number(process.env.UNIVERSE_IDLE_MIN || 0) } = {}) {
     super();
     this.market = market;
     this.interval = interval;
     this.pingInterval = pingInterval;
+    this.idleMs = idleMin * 60000;
 
     this.ws = null;
     this.connected = false;
     this.symbols = new Set();    // хранит символы в нижнем регистре
+    this._lastAdd = new Map();   // символ → время последнего addSymbol (ms)
+    this._pruneTimer = null;
     this._pingTimer = null;
     this._reconnectTimer = null;
     this._reconnectAttempts = 0;
@@ -49,9 +55,13 @@ export default class KlineFeed extends EventEmitter {
       }
       // пинги
       this._startPing();
+      if (this.idleMs > 0 && !this._pruneTimer) {
+        this._pruneTimer = setInterval(() => this.pruneIdle(), Math.min(this.idleMs, 60000));
+      }
     });
 
     this.ws.on('message', (buf) => {
+      const recvTime = Date.now(); // ingest timestamp для трассировки close → decision
       const msg = JSON.parse(buf.toString());
       // ответы на SUB/UNSUB игнорим
       if (msg?.result === null) return;
@@ -61,7 +71,7 @@ export default class KlineFeed extends EventEmitter {
         const k = msg.k;
         // берём событие только при закрытии свечи
         if (k.x === true) {
-          const payload = mapKlineTokenClose(msg.s, k);
+          const payload = mapKlineTokenClose(msg.s, k, msg.E, recvTime);
           this.emit('kline', payload);
         }
       }
@@ -82,6 +92,7 @@ export default class KlineFeed extends EventEmitter {
   /** Добавить символ в пул и подписаться */
   addSymbol(symbol) {
     const s = String(symbol).toLowerCase();
+    this._lastAdd.set(s, Date.now());
     if (this.symbols.has(s)) return;
     this.symbols.add(s);
     console.log("Kline --> Подписываемся на символ:", s);
@@ -100,6 +111,7 @@ export default class KlineFeed extends EventEmitter {
     const s = String(symbol).toLowerCase();
     if (!this.symbols.has(s)) return;
     this.symbols.delete(s);
+    this._lastAdd.delete(s);
     if (this.connected) {
       this._send({
         method: 'UNSUBSCRIBE',
@@ -109,6 +121,14 @@ export default class KlineFeed extends EventEmitter {
     }
   }
 
+  /** Отписаться от символов, которые не добавляли дольше idleMin; возвращает их число */
+  pruneIdle(now = Date.now()) {
+    if (!(this.idleMs > 0)) return 0;
+    const idle = [...this._lastAdd].filter(([, t]) => now - t >= this.idleMs).map(([s]) => s);
+    for (const s of idle) this.removeSymbol(s);
+    return idle.length;
+  }
+
   /** Сменить интервал на лету (переподписка) */
   setInterval(interval) {
     if (interval === this.interval) return;
@@ -134,6 +154,8 @@ export default class KlineFeed extends EventEmitter {
   /** Закрыть соединение */
   close() {
     this._stopPing();
+    clearInterval(this._pruneTimer);
+    this._pruneTimer = null;
     clearTimeout(this._reconnectTimer);
     this._reconnectTimer = null;
     if (this.ws) {
@@ -173,7 +195,7 @@ export default class KlineFeed extends EventEmitter {
 }
 
 /** Приводим kline от Binance к твоему формату */
-function mapKlineTokenClose(symbol, k) {
+function mapKlineTokenClose(symbol, k, eventTime, recvTime) {
   // k: { t: openTime, T: closeTime, s: symbol, i: interval, f, L, o,h,l,c, v, n, x, q, V, Q, B }
   const open = Number(k.o);
   const high = Number(k.h);
@@ -185,10 +207,12 @@ function mapKlineTokenClose(symbol, k) {
     interval: k.i,
     // твой прежний формат:
     openTime: new Date(k.t).toISOString().slice(11, 16), // HH:MM
+    closeTime: k.T, // ms, нужен для бинарного формата (ts_close)
     open,
     high,
     low,
     close,
+    volume: Number(k.v),
     quoteVolume: Math.trunc(Number(k.q)),
     trades: k.n,
     takerBuyQuote: Math.trunc(Number(k.Q)),
@@ -196,5 +220,8 @@ function mapKlineTokenClose(symbol, k) {
     typicalPrice: (high + low + close) / 3,
     range: (high - low),
     isFinal: k.x === true,
+    // ingest timestamps (ms): событие Binance и приём по WS
+    eventTime,
+    recvTime,
   };
 }
\ No newline at end of file
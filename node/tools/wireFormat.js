@@ -0,0 +1,61 @@
+// Packed binary kline / tick records for the Node → Python ZMQ feed.
+// Layouts must match KLINE_DTYPE / TICK_DTYPE in pyAI/src/wire_format.py (little-endian,
+// 104 / 56 bytes/record). Message = [TOPIC, N records back to back]; Python reads it with np.frombuffer.
+
+const KLINE_BIN_TOPIC = 'kline.bin';
+const KLINE_RECORD_SIZE = 104;
+const TICK_BIN_TOPIC = 'tick.bin';
+const TICK_RECORD_SIZE = 56;
+const TICK_TRADE = 0;
+const TICK_LIQUIDATION = 1;
+
+function writeAscii(buf, offset, str, width) {
+  // NUL-padded, truncated to width
+  buf.write(String(str ?? '').slice(0, width), offset, width, 'ascii');
+}
+
+/** candles: объекты из KlineFeed (mapKlineTokenClose) → один Buffer */
+function encodeKlines(candles, exchange = 'Binance') {
+  const buf = Buffer.alloc(candles.length * KLINE_RECORD_SIZE);
+  candles.forEach((c, i) => {
+    let o = i * KLINE_RECORD_SIZE;
+    writeAscii(buf, o, c.symbol, 16); o += 16;
+    writeAscii(buf, o, c.exchange ?? exchange, 8); o += 8;
+    buf.writeDoubleLE(Number(c.closeTime) / 1000, o); o += 8; // ms → s
+    buf.writeDoubleLE(c.open, o); o += 8;
+    buf.writeDoubleLE(c.high, o); o += 8;
+    buf.writeDoubleLE(c.low, o); o += 8;
+    buf.writeDoubleLE(c.close, o); o += 8;
+    buf.writeDoubleLE(c.volume ?? 0, o); o += 8;
+    buf.writeDoubleLE(c.quoteVolume ?? 0, o); o += 8;
+    buf.writeDoubleLE(c.takerBuyQuote ?? 0, o); o += 8;
+    buf.writeDoubleLE(c.vwapApprox ?? 0, o); o += 8;
+    buf.writeUInt32LE(c.trades ?? 0, o); o += 4;
+    buf.writeUInt8(c.isFinal === false ? 0 : 1, o); // + 3 байта паддинга
+  });
+  return buf;
+}
+
+/**
+ * ticks: сделки @aggTrade ({s, p, q, T, m}) и ликвидации в формате BinanceLiquidationIndicator
+ * ({symbol, side, averagePrice, quantity, T}) → один Buffer. Копите их и шлите пачкой (десятки мс).
+ */
+function encodeTicks(ticks, exchange = 'Binance') {
+  const buf = Buffer.alloc(ticks.length * TICK_RECORD_SIZE);
+  ticks.forEach((t, i) => {
+    let o = i * TICK_RECORD_SIZE;
+    const liquidation = t.kind === 'liquidation' || t.averagePrice !== undefined;
+    writeAscii(buf, o, t.symbol ?? t.s, 16); o += 16;
+    writeAscii(buf, o, t.exchange ?? exchange, 8); o += 8;
+    buf.writeDoubleLE(Number(t.T ?? t.time ?? Date.now()) / 1000, o); o += 8; // ms → s
+    buf.writeDoubleLE(Number(liquidation ? t.averagePrice : t.price ?? t.p), o); o += 8;
+    buf.writeDoubleLE(Number(t.quantity ?? t.qty ?? t.q), o); o += 8;
+    // trade: агрессор (m = покупатель мейкер → продажа), ликвидация: сторона принудительного ордера
+    const buy = liquidation || t.side !== undefined ? String(t.side).toUpperCase() === 'BUY' : !t.m;
+    buf.writeInt8(buy ? 1 : -1, o); o += 1;
+    buf.writeUInt8(liquidation ? TICK_LIQUIDATION : TICK_TRADE, o); // + 6 байт паддинга
+  });
+  return buf;
+}
+
+export { KLINE_BIN_TOPIC, KLINE_RECORD_SIZE, TICK_BIN_TOPIC, TICK_RECORD_SIZE, encodeKlines, encodeTicks };
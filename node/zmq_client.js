@@ -1,32 +1,67 @@
 import 'dotenv/config';
 import zmq from 'zeromq';
+import { KLINE_BIN_TOPIC, encodeKlines } from './tools/wireFormat.js';
 
 class ZMQClient {
-  constructor(addr) {
+  // mode (env AI_ZMQ_CLIENT_MODE; AI_ZMQ_MODE — режим сервера, ai_server_zmq.py):
+  // mode 'req'    — один REQ сокет, запросы строго по очереди (_chain)
+  // mode 'dealer' — DEALER сокет, много запросов в полёте, ответы сопоставляются по request id
+  //                 (нужен сервер в режиме AI_ZMQ_MODE=router или batch)
+  constructor(addr, mode) {
     this.addr = addr || process.env.AI_ZMQ_ADDR || "tcp://127.0.0.1:5555";
-    this.sock = new zmq.Request();
+    this.mode = (mode || process.env.AI_ZMQ_CLIENT_MODE || 'req').toLowerCase() === 'dealer' ? 'dealer' : 'req';
+    this.sock = this.mode === 'dealer' ? new zmq.Dealer() : new zmq.Request();
     this.connected = false;
-    this._chain = Promise.resolve(); // очередь
+    this._chain = Promise.resolve(); // очередь (req)
+    this._pending = new Map();       // rid → { resolve, reject } (dealer)
+    this._rid = 0;
   }
 
   async connect() {
     if (this.connected) return;
     await this.sock.connect(this.addr);
     this.connected = true;
-    console.log("🔗 ZMQ connected:", this.addr);
+    if (this.mode === 'dealer') this._recvLoop();
+    console.log("🔗 ZMQ connected:", this.addr, `(${this.mode})`);
   }
 
   async send(payload) {
+    // sentTime (ms) — момент отправки, Python считает по нему задержку Node → приём
+    return this._request(JSON.stringify({ ...payload, sentTime: Date.now() }));
+  }
+
+  // frames: string | Buffer | массив фреймов (multipart)
+  async _request(frames) {
     if (!this.connected) await this.connect();
+    if (this.mode === 'dealer') {
+      // envelope [rid, '', ...frames]: REP-воркер на сервере вернёт rid обратно вместе с ответом
+      const rid = String(++this._rid);
+      const reply = new Promise((resolve, reject) => this._pending.set(rid, { resolve, reject }));
+      await this.sock.send([rid, '', ...[].concat(frames)]);
+      return reply;
+    }
     this._chain = this._chain.then(async () => {
-      await this.sock.send(JSON.stringify(payload));
+      await this.sock.send(frames);
       const [reply] = await this.sock.receive();
-      const text =  Buffer.from(reply).toString();
-      try { return JSON.parse(text); } catch { return { error: "Invalid JSON from server", raw: text }; }
+      return decodeReply(reply);
     });
     return this._chain;
   }
 
+  async _recvLoop() {
+    try {
+      for await (const [rid, , reply] of this.sock) {
+        const waiter = this._pending.get(rid.toString());
+        if (!waiter) continue;
+        this._pending.delete(rid.toString());
+        waiter.resolve(decodeReply(reply));
+      }
+    } catch (e) {
+      for (const { reject } of this._pending.values()) reject(e);
+      this._pending.clear();
+    }
+  }
+
   //   const data = {
   //     token: token,
   //     exchange: exchange,
@@ -45,6 +80,16 @@ class ZMQClient {
   async sendMarket(data) {
     return this.send({ type: 'bnn_market', ...data });
   }
+
+  // пачка свечей одним бинарным сообщением [KLINE_BIN_TOPIC, records] → массив ответов
+  async sendMarketBinary(candles) {
+    return this._request([KLINE_BIN_TOPIC, encodeKlines(candles)]);
+  }
+}
+
+function decodeReply(reply) {
+  const text = Buffer.from(reply).toString();
+  try { return JSON.parse(text); } catch { return { error: "Invalid JSON from server", raw: text }; }
 }
 
 export default new ZMQClient();
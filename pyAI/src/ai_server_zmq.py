@@ -1,48 +1,419 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
 import zmq
 import json
 import pandas as pd
 import numpy as np
+from wire_format import KLINE_BIN_TOPIC, KLINE_DTYPE, TG_FIELDS, decode_klines
+from model_registry import REGISTRY
+from logsink import LOG
 
-ADDR = "tcp://*:5555" 
+ADDR = os.getenv("AI_ZMQ_BIND", "tcp://*:5555")
+# "rep"    — one REP socket, strictly one request at a time (old behaviour)
+# "router" — ROUTER frontend + pool of REP worker threads, replies routed back by identity
+# "batch"  — ROUTER frontend + micro-batcher: same-type requests are stacked into one handler call
+# The Node client (node/zmq_client.js) has its own AI_ZMQ_CLIENT_MODE: "req" (default) works with
+# every server mode, "dealer" (many requests in flight) needs "router" or "batch".
+MODE = os.getenv("AI_ZMQ_MODE", "rep").lower()
+WORKERS = int(os.getenv("AI_ZMQ_WORKERS", 4))
+STATS_EVERY_SEC = float(os.getenv("AI_ZMQ_STATS_SEC", 30))
+BACKEND_ADDR = "inproc://ai-workers"
+# micro-batching: flush a type's queue at BATCH_MAX requests or BATCH_WAIT_MS after its oldest request
+BATCH_MAX = int(os.getenv("AI_BATCH_MAX", 64))
+BATCH_WAIT_MS = float(os.getenv("AI_BATCH_WAIT_MS", 2.0))
+REPLY_ADDR = "inproc://ai-replies"
+# market score model (model_registry.py: .onnx / TorchScript / SB3), loaded + warmed at startup,
+# hot-swapped when the file changes; empty → constant 0.7 stub
+MARKET_MODEL = os.getenv("AI_MARKET_MODEL", "")
+# input width of the market model; needed for warm-up when the file doesn't declare it
+# (TorchScript). 0 → from the model (ONNX / SB3), else warm-up is skipped
+MARKET_MODEL_DIM = int(os.getenv("AI_MARKET_MODEL_DIM", 0))
+# numeric record fields fed to the market model for packed binary batches
+RECORD_FEATURES = [n for n in KLINE_DTYPE.names if n not in ("symbol", "exchange", "_pad")]
+# reply cache for JSON tg / bnn_market requests: key = type + token + features rounded to
+# AI_CACHE_DIGITS significant digits, entries live AI_CACHE_TTL_SEC, at most AI_CACHE_SIZE (LRU).
+# AI_CACHE=0 bypasses it for everything, "no_cache": true in a request for that request.
+CACHE_ON = os.getenv("AI_CACHE", "1").lower() in ("1", "true", "yes")
+CACHE_TTL_SEC = float(os.getenv("AI_CACHE_TTL_SEC", 60.0))
+CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", 10000))
+CACHE_DIGITS = int(os.getenv("AI_CACHE_DIGITS", 3))
+
+class LatencyStats:
+    """Per-request handler latency (ms) over the last `maxlen` requests, shared by all workers."""
+    def __init__(self, maxlen=10000):
+        self._lat = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+
+    def record(self, ms, error=False):
+        with self._lock:
+            self._lat.append(ms)
+            self.count += 1
+            self.errors += int(error)
+
+    def summary(self):
+        with self._lock:
+            lat = np.fromiter(self._lat, dtype=np.float64, count=len(self._lat))
+            count, errors = self.count, self.errors
+        if not len(lat):
+            return {"count": count, "errors": errors}
+        p50, p99 = np.percentile(lat, [50, 99])
+        return {"count": count, "errors": errors, "p50_ms": round(float(p50), 3),
+                "p99_ms": round(float(p99), 3), "max_ms": round(float(lat.max()), 3)}
+
+class Histogram:
+    """Fixed-bucket histogram: counts[i] = values in (edges[i-1], edges[i]], last bucket = overflow."""
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        i = int(np.searchsorted(self.edges, value, side="left"))
+        with self._lock:
+            self.counts[i] += 1
+
+    def summary(self):
+        with self._lock:
+            counts = self.counts.copy()
+        labels = [f"<={e:g}" for e in self.edges] + [f">{self.edges[-1]:g}"]
+        return {lab: int(c) for lab, c in zip(labels, counts) if c}
+
+class ScoreCache:
+    """
+    TTL + LRU reply cache shared by all workers. The OI bot repeats near-identical snapshots of a
+    token within minutes; rounding the features to a few significant digits makes those one key,
+    so the model runs once per snapshot instead of once per notification.
+    """
+    def __init__(self, ttl_sec=CACHE_TTL_SEC, max_size=CACHE_SIZE, digits=CACHE_DIGITS, enabled=CACHE_ON):
+        self.ttl = ttl_sec
+        self.max_size = max(1, int(max_size))
+        self.digits = digits
+        self.enabled = enabled and ttl_sec > 0
+        self._items = OrderedDict()  # key → (expires_at, reply), oldest use first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = self.bypassed = 0
+
+    def _q(self, v):
+        try:
+            v = float(v)
+        except (TypeError, ValueError):
+            return None
+        return None if v != v else "%.*g" % (self.digits, v)
+
+    def key(self, mtype, msg):
+        """Cache key for a request, None → not cacheable (bypass flag, cache off)."""
+        if not self.enabled or msg.get("no_cache"):
+            return None
+        if mtype == "tg":
+            return mtype, msg.get("exchange"), msg.get("token"), tuple(self._q(msg.get(f)) for f in TG_FIELDS)
+        if mtype == "bnn_market":
+            return mtype, msg.get("symbol"), tuple(self._q(v) for v in msg.get("features") or ())
+        return None
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, reply):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, reply)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def call(self, mtype, msg, handler):
+        """handler(msg) through the cache."""
+        key = self.key(mtype, msg)
+        if key is None:
+            with self._lock:
+                self.bypassed += 1
+            return handler(msg)
+        reply = self.get(key)
+        if reply is None:
+            reply = handler(msg)
+            if "error" not in reply:
+                self.put(key, reply)
+        return reply
+
+    def call_batch(self, mtype, msgs, handler):
+        """Vectorized handler(msgs) on the misses only (same key twice in a batch → computed once)."""
+        replies = [None] * len(msgs)
+        todo = {}  # key → indices waiting for it
+        for i, m in enumerate(msgs):
+            key = self.key(mtype, m)
+            if key is None:
+                with self._lock:
+                    self.bypassed += 1
+                key = ("nocache", i)
+            else:
+                replies[i] = self.get(key)
+            if replies[i] is None:
+                todo.setdefault(key, []).append(i)
+        if todo:
+            keys = list(todo)
+            for key, reply in zip(keys, handler([msgs[todo[k][0]] for k in keys])):
+                for i in todo[key]:
+                    replies[i] = reply
+                if key[0] != "nocache" and "error" not in reply:
+                    self.put(key, reply)
+        return replies
+
+    def summary(self):
+        with self._lock:
+            size = len(self._items)
+        lookups = self.hits + self.misses
+        return {"size": size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "expired": self.expired, "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+STATS = LatencyStats()
+CACHE = ScoreCache()
+BATCH_SIZE_HIST = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+QUEUE_WAIT_HIST = Histogram([0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50])  # ms
 
 def handle_tg_message(msg):
     token = msg.get("token")
-    print('received ' + token )
-    print(msg)
+    LOG.emit("tg", token=token)
+    LOG.emit("tg_msg", level="debug", msg=msg)
     #features = msg.get("features", [])
     # TODO: вызов твоей модели для триггера
     return {"handle_tg_message принял": token}
 
+def market_scores(X):
+    """(N × features) → N scores from the market model; N × k outputs → last column (e.g. P(up))."""
+    model = REGISTRY.get("market")
+    if model is None:
+        return np.full(len(X), 0.7)  # заглушка: AI_MARKET_MODEL не задан
+    if model.dim is not None and X.shape[1] != model.dim:  # pad / cut to the model's input width
+        X2 = np.zeros((len(X), model.dim), dtype=np.float32)
+        m = min(model.dim, X.shape[1])
+        X2[:, :m] = X[:, :m]
+        X = X2
+    return model(X).reshape(len(X), -1)[:, -1]
+
 def handle_bnn_market_data(msg):
     symbol = msg.get("symbol")
-    features = msg.get("features", [])
-    # TODO: вызов твоей модели для рынка (PPO/FinRL и т.п.)
-    score = 0.7  # заглушка
+    features = np.asarray(msg.get("features") or [], dtype=np.float32)
+    score = market_scores(features[None])[0]
     return {"symbol": symbol, "score": float(score), "type": "market"}
 
-def main():
-    ctx = zmq.Context()
-    sock = ctx.socket(zmq.REP)
-    sock.bind(ADDR)
-    print(f"✅ AI ZMQ server listening on {ADDR}")
+def handle_bnn_market_batch(msgs):
+    # stacked features → один вызов модели → ответ на каждый запрос (тот же формат, что и handle_bnn_market_data)
+    feats = [np.asarray(m.get("features") or [], dtype=np.float32) for m in msgs]
+    width = max((len(f) for f in feats), default=0)
+    X = np.zeros((len(msgs), width), dtype=np.float32)
+    for i, f in enumerate(feats):
+        X[i, :len(f)] = f
+    scores = market_scores(X)
+    return [{"symbol": m.get("symbol"), "score": float(sc), "type": "market"} for m, sc in zip(msgs, scores)]
+
+# request type → vectorized handler (list of msgs → list of replies, same order), through CACHE.
+# tg has no model call to batch: it is answered inline like unknown types.
+BATCH_HANDLERS = {
+    "bnn_market": lambda msgs: CACHE.call_batch("bnn_market", msgs, handle_bnn_market_batch),
+}
 
+def handle_bnn_market_records(recs):
+    # packed binary batch (wire_format.KLINE_DTYPE) → one reply per record
+    symbols = [s.decode("ascii") for s in recs["symbol"].tolist()]
+    X = np.stack([recs[f].astype(np.float32) for f in RECORD_FEATURES], axis=1)
+    scores = market_scores(X)
+    return [{"symbol": sym, "score": float(sc), "type": "market"} for sym, sc in zip(symbols, scores)]
+
+def handle_frames(frames):
+    """One request (REP body frames) → reply dict/list. Shared by REP mode and router workers."""
+    if len(frames) >= 2 and frames[0].bytes == KLINE_BIN_TOPIC:
+        return handle_bnn_market_records(decode_klines(frames[1].buffer))
+    msg = json.loads(frames[-1].bytes)
+    mtype = (msg.get("type") or "").lower()
+
+    if mtype == "tg":
+        return CACHE.call(mtype, msg, handle_tg_message)
+    elif mtype == "bnn_market":
+        return CACHE.call(mtype, msg, handle_bnn_market_data)
+    return {"error": f"unknown type '{mtype}'"}
+
+def serve(sock):
+    """REP loop: recv → handle → reply, latency recorded per request."""
     while True:
+        frames = sock.recv_multipart(copy=False)
+        t0 = time.perf_counter()
+        error = False
         try:
-            raw = sock.recv_string()
-            msg = json.loads(raw)
-            mtype = (msg.get("type") or "").lower()
-
-            if mtype == "tg":
-                resp = handle_tg_message(msg)
-            elif mtype == "bnn_market":
-                resp = handle_bnn_market_data(msg)
-            else:
-                resp = {"error": f"unknown type '{mtype}'"}
-
-            sock.send_string(json.dumps(resp))
+            resp = handle_frames(frames)
         except Exception as e:
             print("Error:", e)
-            sock.send_string(json.dumps({"error": str(e)}))
+            resp = {"error": str(e)}
+            error = True
+        sock.send_string(json.dumps(resp))
+        STATS.record((time.perf_counter() - t0) * 1000.0, error)
+
+def _worker(ctx):
+    sock = ctx.socket(zmq.REP)
+    sock.connect(BACKEND_ADDR)
+    try:
+        serve(sock)
+    except zmq.ContextTerminated:
+        sock.close()
+
+def _report_stats():
+    while True:
+        time.sleep(STATS_EVERY_SEC)
+        print("[ai_server] latency", json.dumps(STATS.summary()))
+        if CACHE.enabled:
+            print("[ai_server] cache", json.dumps(CACHE.summary()))
+        if MARKET_MODEL:
+            print("[ai_server] models", json.dumps(REGISTRY.stats()))
+        if MODE == "batch":
+            print("[ai_server] batch_size", json.dumps(BATCH_SIZE_HIST.summary()),
+                  "queue_wait_ms", json.dumps(QUEUE_WAIT_HIST.summary()))
+
+class MicroBatcher(threading.Thread):
+    """
+    Collects requests per type and calls BATCH_HANDLERS[type] once per batch.
+    Replies go back to the socket thread over an inproc PUSH socket (zmq sockets are not thread-safe).
+    """
+    def __init__(self, ctx, handlers=BATCH_HANDLERS, max_batch=BATCH_MAX, max_wait_ms=BATCH_WAIT_MS):
+        super().__init__(daemon=True, name="ai-batcher")
+        self.ctx = ctx
+        self.handlers = handlers
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = {t: [] for t in handlers}  # type → [(t_enqueued, envelope, msg)]
+        self._cv = threading.Condition()
+
+    def submit(self, mtype, envelope, msg):
+        with self._cv:
+            q = self._pending[mtype]
+            q.append((time.perf_counter(), envelope, msg))
+            if len(q) == 1 or len(q) >= self.max_batch:
+                self._cv.notify()
+
+    def _take_due(self):
+        # called under self._cv; blocks until at least one type is full or timed out
+        while True:
+            now = time.perf_counter()
+            due = [t for t, q in self._pending.items()
+                   if q and (len(q) >= self.max_batch or now - q[0][0] >= self.max_wait)]
+            if due:
+                out = []
+                for t in due:
+                    q = self._pending[t]
+                    out.append((t, q[:self.max_batch]))
+                    del q[:self.max_batch]
+                return out
+            oldest = [q[0][0] for q in self._pending.values() if q]
+            self._cv.wait(None if not oldest else max(0.0, min(oldest) + self.max_wait - now))
+
+    def run(self):
+        out = self.ctx.socket(zmq.PUSH)
+        out.connect(REPLY_ADDR)
+        while True:
+            with self._cv:
+                batches = self._take_due()
+            for mtype, items in batches:
+                t0 = time.perf_counter()
+                BATCH_SIZE_HIST.record(len(items))
+                for t_enq, _, _ in items:
+                    QUEUE_WAIT_HIST.record((t0 - t_enq) * 1000.0)
+                error = False
+                try:
+                    resps = self.handlers[mtype]([m for _, _, m in items])
+                except Exception as e:
+                    print("Error:", e)
+                    resps = [{"error": str(e)}] * len(items)
+                    error = True
+                t1 = time.perf_counter()
+                for (t_enq, envelope, _), resp in zip(items, resps):
+                    out.send_multipart(envelope + [json.dumps(resp).encode()])
+                    STATS.record((t1 - t_enq) * 1000.0, error)
+
+def _split_envelope(frames):
+    # ROUTER frames: [identity, (request id,) '', body...] → (envelope incl. delimiter, body)
+    for i, f in enumerate(frames):
+        if not len(f.buffer):
+            return [x.bytes for x in frames[:i + 1]], frames[i + 1:]
+    return [frames[0].bytes, b""], frames[1:]
+
+def serve_batched(ctx):
+    frontend = ctx.socket(zmq.ROUTER)
+    frontend.bind(ADDR)
+    replies = ctx.socket(zmq.PULL)
+    replies.bind(REPLY_ADDR)
+    batcher = MicroBatcher(ctx)
+    batcher.start()
+    print(f"✅ AI ZMQ server listening on {ADDR} (batch, max={batcher.max_batch}, wait={BATCH_WAIT_MS}ms)")
+
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(replies, zmq.POLLIN)
+    while True:
+        events = dict(poller.poll())
+        if replies in events:
+            while True:
+                try:
+                    frontend.send_multipart(replies.recv_multipart(zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+        if frontend in events:
+            envelope, body = _split_envelope(frontend.recv_multipart(copy=False))
+            t0 = time.perf_counter()
+            try:
+                if len(body) == 1:
+                    msg = json.loads(body[0].bytes)
+                    mtype = (msg.get("type") or "").lower()
+                    if mtype in batcher.handlers:
+                        batcher.submit(mtype, envelope, msg)
+                        continue
+                resp = handle_frames(body)  # binary batches, tg and unknown types: answer inline
+            except Exception as e:
+                print("Error:", e)
+                resp = {"error": str(e)}
+            frontend.send_multipart(envelope + [json.dumps(resp).encode()])
+            STATS.record((time.perf_counter() - t0) * 1000.0, "error" in resp)
+
+def main():
+    ctx = zmq.Context.instance()
+    if MARKET_MODEL:
+        REGISTRY.load("market", MARKET_MODEL, dim=MARKET_MODEL_DIM or None)  # before binding: the first request never hits a cold model
+        REGISTRY.start_watch()
+    threading.Thread(target=_report_stats, daemon=True).start()
+
+    if MODE == "batch":
+        serve_batched(ctx)
+        return
+    if MODE != "router":
+        sock = ctx.socket(zmq.REP)
+        sock.bind(ADDR)
+        print(f"✅ AI ZMQ server listening on {ADDR}")
+        serve(sock)
+        return
+
+    # ROUTER/DEALER: clients (REQ or DEALER) → ROUTER → DEALER → N REP workers.
+    # The REP envelope keeps the client identity, so replies find their way back.
+    frontend = ctx.socket(zmq.ROUTER)
+    frontend.bind(ADDR)
+    backend = ctx.socket(zmq.DEALER)
+    backend.bind(BACKEND_ADDR)
+    for i in range(WORKERS):
+        threading.Thread(target=_worker, args=(ctx,), name=f"ai-worker-{i}", daemon=True).start()
+    print(f"✅ AI ZMQ server listening on {ADDR} (router, {WORKERS} workers)")
+    zmq.proxy(frontend, backend)
 
 if __name__ == "__main__":
     main()
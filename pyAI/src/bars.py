@@ -0,0 +1,244 @@
+"""
+Multi-timeframe bars aggregated from the 1m kline stream
+========================================================
+
+The Node feed subscribes to one interval (1m); higher timeframes are built here instead of
+opening more WebSocket streams. Per timeframe the state is columnar, one row per symbol
+("Exchange:TOKEN") and O(1) per update: open bucket start, O/H/L/C, Σ volume / quoteVolume /
+trades / takerBuyQuote, number of minutes seen, last minute seen.
+
+A 1m close with ts_close (epoch seconds, Binance closeTime ...59.999 or the boundary itself)
+belongs to the minute [m, m + 60); the minute lands in bucket floor(m / tf) * tf. A bar is
+emitted:
+- as soon as the bucket's last minute arrives (no waiting for the next bar)
+- when a minute of a later bucket arrives first (last minute(s) missing)
+- by flush(now) once now > bucket end + BAR_AGG_GRACE_SEC (symbol went quiet)
+Emitted bars carry `minutes` and `complete` (= all tf / 60 minutes seen); a bar with missing
+minutes is still emitted but flagged, and counted per timeframe in summary(). Duplicate or
+out-of-order minutes (≤ the last one seen) are dropped and counted.
+
+on_bar(tf_sec, keys, bar) gets one call per timeframe and emission reason with unique keys;
+bar is a dict of columns in the PaperTrader.decide_rows format (close, ts_close = bucket end,
+high, low, quoteVolume, vwapApprox, ...).
+
+drop(keys) forgets symbols the trader's universe evicted (Runner registers it as an eviction
+hook): rows are compacted like universe.compact_rows and their open bars are discarded — a
+symbol evicted mid-bar and back later starts a new bucket, flagged if minutes are missing.
+
+Env: BAR_TIMEFRAMES (e.g. "5m,15m,1h", empty → off), BAR_AGG_GRACE_SEC (default 90),
+BAR_AGG_INCOMPLETE: decide (default) | skip — what the Runner does with flagged bars.
+"""
+
+from __future__ import annotations
+import os
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+from universe import compact_rows
+from wire_format import record_keys
+
+BAR_TIMEFRAMES = os.getenv("BAR_TIMEFRAMES", "")
+BAR_AGG_GRACE_SEC = float(os.getenv("BAR_AGG_GRACE_SEC", 90.0))
+BAR_AGG_INCOMPLETE = os.getenv("BAR_AGG_INCOMPLETE", "decide").lower()  # decide | skip
+BASE_SEC = 60
+SUM_FIELDS = ("volume", "quoteVolume", "trades", "takerBuyQuote")
+_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def parse_timeframe(tf) -> int:
+    """'5m' / '1h' / 300 → seconds (a whole number of minutes, at least 2)."""
+    if isinstance(tf, (int, float)):
+        sec = int(tf)
+    else:
+        tf = str(tf).strip().lower()
+        sec = int(float(tf[:-1]) * _UNITS[tf[-1]]) if tf[-1] in _UNITS else int(tf)
+    if sec % BASE_SEC or sec < 2 * BASE_SEC:
+        raise ValueError(f"timeframe {tf!r} must be a multiple of 1m and > 1m")
+    return sec
+
+
+def timeframe_label(sec: int) -> str:
+    return f"{sec // 3600}h" if sec % 3600 == 0 else f"{sec // 60}m"
+
+
+class _Timeframe:
+    """Columnar open-bar state of one timeframe; rows shared with BarAggregator.index."""
+    def __init__(self, sec: int, capacity: int):
+        self.sec = sec
+        self.minutes_per_bar = sec // BASE_SEC
+        self.capacity = 0
+        self.emitted = 0
+        self.incomplete = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int):
+        n = self.capacity
+        self._fills = {}  # empty value of each per-row array (universe.compact_rows)
+
+        def grow(name, fill, dtype=np.float64):
+            new = np.full(capacity, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:n] = old[:n]
+            setattr(self, name, new)
+            self._fills[name] = fill
+
+        grow('start', np.nan)  # bucket start (s), NaN = no open bar
+        grow('last_min', -np.inf)  # start of the last minute seen
+        for name in ('open', 'high', 'low', 'close'):
+            grow(name, np.nan)
+        for name in SUM_FIELDS:
+            grow(name, 0.0)
+        grow('minutes', 0, dtype=np.int32)
+        self.capacity = capacity
+
+
+class BarAggregator:
+    def __init__(self, timeframes: Sequence, on_bar: Callable[[int, List[str], dict], None],
+                 grace_sec: float = BAR_AGG_GRACE_SEC, capacity: int = 256):
+        self.timeframes = sorted({parse_timeframe(tf) for tf in timeframes})
+        self.on_bar = on_bar
+        self.grace_sec = grace_sec
+        self.index: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.capacity = max(1, int(capacity))
+        self.tfs = [_Timeframe(sec, self.capacity) for sec in self.timeframes]
+        self.minutes = 0
+        self.stale = 0  # duplicate / out-of-order minutes dropped
+
+    @classmethod
+    def from_env(cls, on_bar, spec: str = BAR_TIMEFRAMES) -> Optional["BarAggregator"]:
+        tfs = [t for t in spec.split(",") if t.strip()]
+        return cls(tfs, on_bar) if tfs else None
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        out = np.empty(len(keys), dtype=np.int64)
+        for i, k in enumerate(keys):
+            r = self.index.get(k)
+            if r is None:
+                r = self.index[k] = len(self.keys)
+                self.keys.append(k)
+                if r >= self.capacity:
+                    self.capacity *= 2
+                    for t in self.tfs:
+                        t._alloc(self.capacity)
+            out[i] = r
+        return out
+
+    def drop(self, keys: Sequence[str]):
+        """Forget these symbols (open bars discarded); the last rows move into the holes."""
+        rows = np.unique([self.index[k] for k in keys if k in self.index]).astype(np.int64)
+        if not len(rows):
+            return
+        n = len(self.keys)
+        k = n - len(rows)
+        gone = np.zeros(n, dtype=bool)
+        gone[rows] = True
+        dst = np.flatnonzero(gone[:k])
+        src = np.flatnonzero(~gone[k:]) + k
+        for t in self.tfs:
+            compact_rows(t, src, dst, np.arange(k, n))
+        for r in rows.tolist():
+            del self.index[self.keys[r]]
+        for s, d in zip(src.tolist(), dst.tolist()):
+            self.keys[d] = self.keys[s]
+            self.index[self.keys[d]] = d
+        del self.keys[k:]
+
+    # ---------------- input ----------------
+    def add_messages(self, msgs: List[dict]):
+        """Closed 1m kline dicts (live JSON format); other intervals are ignored."""
+        latest = {f"{m.get('exchange')}:{m.get('token')}": m for m in msgs
+                  if str(m.get('interval') or '1m') == '1m'}
+        if not latest:
+            return
+        n = len(latest)
+        vals = list(latest.values())
+
+        def col(field: str) -> np.ndarray:
+            return np.fromiter((float(m.get(field) or 0.0) for m in vals), dtype=np.float64, count=n)
+
+        self.add(list(latest), {f: col(f) for f in ("ts_close", "open", "high", "low", "close") + SUM_FIELDS})
+
+    def add_records(self, recs: np.ndarray):
+        """Packed 1m records (wire_format.KLINE_DTYPE); open klines are skipped, last record per symbol wins."""
+        recs = recs[recs['is_closed'] != 0]
+        if not len(recs):
+            return
+        keys = record_keys(recs)
+        last = {k: i for i, k in enumerate(keys)}
+        if len(last) != len(keys):
+            idx = np.fromiter(last.values(), dtype=np.int64, count=len(last))
+            recs, keys = recs[idx], list(last)
+        self.add(keys, recs)
+
+    def add(self, keys: List[str], m):
+        """One 1m bar per key (unique): m['ts_close'/'open'/'high'/'low'/'close'/SUM_FIELDS] columns."""
+        rows = self.rows(keys)
+        ts = np.asarray(m["ts_close"], dtype=np.float64)
+        minute = np.round(ts / BASE_SEC) * BASE_SEC - BASE_SEC  # start of the 1m bar
+        cols = {f: np.asarray(m[f], dtype=np.float64) for f in ("open", "high", "low", "close") + SUM_FIELDS}
+        self.minutes += len(rows)
+        fresh = minute > self.tfs[0].last_min[rows] if self.tfs else np.ones(len(rows), bool)
+        if not fresh.all():
+            self.stale += int((~fresh).sum())
+            rows, minute = rows[fresh], minute[fresh]
+            cols = {f: v[fresh] for f, v in cols.items()}
+        for t in self.tfs:
+            self._add(t, rows, minute, cols)
+
+    def _add(self, t: _Timeframe, rows: np.ndarray, minute: np.ndarray, cols: Dict[str, np.ndarray]):
+        bucket = np.floor(minute / t.sec) * t.sec
+        start = t.start[rows]
+        rolled = ~np.isnan(start) & (start != bucket)
+        if rolled.any():  # an older bar never saw its last minute
+            self._emit(t, rows[rolled])
+        new = rolled | np.isnan(start)
+        r, i = rows[new], np.flatnonzero(new)
+        t.start[r] = bucket[i]
+        t.open[r], t.high[r], t.low[r], t.close[r] = cols["open"][i], cols["high"][i], cols["low"][i], cols["close"][i]
+        for f in SUM_FIELDS:
+            getattr(t, f)[r] = cols[f][i]
+        t.minutes[r] = 1
+        r, i = rows[~new], np.flatnonzero(~new)
+        if len(r):
+            t.high[r] = np.fmax(t.high[r], cols["high"][i])
+            t.low[r] = np.fmin(t.low[r], cols["low"][i])
+            t.close[r] = cols["close"][i]
+            for f in SUM_FIELDS:
+                getattr(t, f)[r] += cols[f][i]
+            t.minutes[r] += 1
+        t.last_min[rows] = minute
+        done = minute + BASE_SEC == bucket + t.sec
+        if done.any():
+            self._emit(t, rows[done])
+
+    def flush(self, now: float):
+        """Emit bars whose bucket ended more than grace_sec ago (flagged if minutes are missing)."""
+        n = len(self.keys)
+        for t in self.tfs:
+            start = t.start[:n]
+            due = np.flatnonzero(~np.isnan(start) & (start + t.sec + self.grace_sec <= now))
+            if len(due):
+                self._emit(t, due)
+
+    # ---------------- output ----------------
+    def _emit(self, t: _Timeframe, rows: np.ndarray):
+        quote, volume = t.quoteVolume[rows], t.volume[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vwap = np.where(volume > 0, quote / volume, 0.0)
+        minutes = t.minutes[rows].copy()
+        bar = dict(ts_close=t.start[rows] + t.sec, open=t.open[rows], high=t.high[rows], low=t.low[rows],
+                   close=t.close[rows], volume=volume, quoteVolume=quote, trades=t.trades[rows],
+                   takerBuyQuote=t.takerBuyQuote[rows], vwapApprox=vwap, minutes=minutes,
+                   complete=minutes == t.minutes_per_bar)
+        t.start[rows] = np.nan
+        t.emitted += len(rows)
+        t.incomplete += int((~bar["complete"]).sum())
+        self.on_bar(t.sec, [self.keys[r] for r in rows], bar)
+
+    def summary(self) -> dict:
+        out = dict(symbols=len(self.keys), minutes=self.minutes, stale=self.stale)
+        for t in self.tfs:
+            out[timeframe_label(t.sec)] = dict(bars=t.emitted, incomplete=t.incomplete)
+        return out
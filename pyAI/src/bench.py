@@ -0,0 +1,382 @@
+"""
+End-to-end load generator + benchmark for the trader and the AI server
+======================================================================
+
+Starts the target as a subprocess (the real entry point, real sockets), drives it with
+synthetic traffic and prints one JSON result line (also appended to --out as JSONL, so runs
+of different versions can be compared with `bench.py compare`).
+
+Traffic, for --symbols N:
+- TG notifications at --tg-rate msg/s, shaped like node/tools/tgMsgParsing.js output
+  (string fields, "%"-stripped, trades8h only for Binance)
+- kline closes for all N symbols every --bar-sec, sent back to back as one synchronized burst
+  (JSON, or one packed kline.bin frame with --binary); ts_close = burst start, so the trader's
+  close_to_decision span is the end-to-end send → decision latency
+
+Targets:
+    trader   gptShit2.py Runner: PUB → SUB. Throughput = events (TG + decided klines) per second
+             over the load window incl. draining the backlog; latency = close_to_decision
+             (p50/p99/p999); queue depth sampled from /metrics (METRICS_PORT); backlog at the
+             end of the load and time to drain it
+    server   ai_server_zmq.py (AI_ZMQ_MODE rep/router/batch): DEALER client with up to
+             --window requests in flight. Latency = request → reply round trip; the in-flight
+             count is the queue depth; --rate 0 saturates (closed loop)
+RSS (current / peak) is read from /proc/<pid>/status of the target.
+
+Usage:
+    python bench.py trader --symbols 500 --tg-rate 200 --bar-sec 2 --duration 30 [--binary] [--out bench.jsonl]
+    python bench.py server --rate 0 --window 64 --mode batch --duration 20 [--out bench.jsonl]
+    python bench.py compare old.jsonl new.jsonl
+Everything else is configured through the targets' own env vars (BAR_BATCH, PIPE_OVERFLOW, ...).
+"""
+
+from __future__ import annotations
+import argparse, json, os, signal, subprocess, sys, time, urllib.request
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import zmq
+
+from pipeline import StageStats
+from wire_format import KLINE_BIN_TOPIC, encode_klines
+
+HERE = Path(__file__).resolve().parent
+EXCHANGES = ("Binance", "ByBit")
+
+# ----------------------- Traffic ----------------------
+
+class Market:
+    """N synthetic symbols with random-walk prices; builds TG and kline messages."""
+    def __init__(self, n_symbols: int, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.tokens = [f"SYM{i:04d}USDT" for i in range(n_symbols)]
+        self.exchange = [EXCHANGES[i % 3 == 2] for i in range(n_symbols)]  # ~1/3 ByBit
+        self.price = self.rng.uniform(0.01, 100.0, n_symbols)
+        self.oi = self.rng.uniform(1.0, 50.0, n_symbols)
+
+    def tg(self) -> dict:
+        i = int(self.rng.integers(len(self.tokens)))
+        r = self.rng.normal(size=4)
+        binance = self.exchange[i] == "Binance"
+        return dict(type="tg", token=self.tokens[i], exchange=self.exchange[i],
+                    openInterest=f"{self.oi[i]:.3f}", volume=f"{abs(r[0]) * 40:.3f}",
+                    trades8h=str(int(abs(r[1]) * 5000)) if binance else None,
+                    oiChange4h=f" {r[2] * 8:.3f}", coinChange24h=f" {r[3] * 6:.1f}",
+                    notificationsCount8h=str(int(self.rng.integers(1, 20))),
+                    ts=time.time(), sentTime=time.time() * 1000)
+
+    def bar(self, ts_close: float) -> List[dict]:
+        ret = self.rng.normal(0.0, 0.004, len(self.price))
+        opens, self.price = self.price, self.price * np.exp(ret)
+        spread = np.abs(self.rng.normal(0.0, 0.002, len(self.price)))
+        vol = self.rng.uniform(100.0, 10_000.0, len(self.price))
+        return [dict(type="kline", exchange=self.exchange[i], token=self.tokens[i], interval="1m",
+                     open=float(opens[i]), high=float(max(opens[i], self.price[i]) * (1 + spread[i])),
+                     low=float(min(opens[i], self.price[i]) * (1 - spread[i])), close=float(self.price[i]),
+                     volume=float(vol[i]), quoteVolume=float(vol[i] * self.price[i]),
+                     vwapApprox=float((opens[i] + self.price[i]) / 2), is_closed=True, ts_close=ts_close)
+                for i in range(len(self.price))]
+
+
+def drive(market: Market, send: Callable[[List], None], duration: float, tg_rate: float, bar_sec: float,
+          binary: bool = False, tick: Optional[Callable[[], None]] = None) -> dict:
+    """Open-loop schedule: TG evenly spaced at tg_rate, one kline burst per bar_sec."""
+    t0 = time.perf_counter()
+    next_tg, next_bar = t0, t0
+    sent_tg = sent_kl = bursts = 0
+    while True:
+        now = time.perf_counter()
+        if now - t0 >= duration:
+            break
+        if bar_sec > 0 and now >= next_bar:
+            msgs = market.bar(time.time())
+            if binary:
+                send([KLINE_BIN_TOPIC, encode_klines(msgs)])
+            else:
+                sent = time.time() * 1000
+                for m in msgs:
+                    m["sentTime"] = sent
+                    send([json.dumps(m).encode()])
+            sent_kl += len(msgs)
+            bursts += 1
+            next_bar += bar_sec
+        while tg_rate > 0 and next_tg <= now:
+            send([json.dumps(market.tg()).encode()])
+            sent_tg += 1
+            next_tg += 1.0 / tg_rate
+        if tick is not None:
+            tick()
+        wait = min(next_tg if tg_rate > 0 else next_bar, next_bar if bar_sec > 0 else t0 + duration) - time.perf_counter()
+        if wait > 0:
+            time.sleep(min(wait, 0.05))
+    return dict(sent_tg=sent_tg, sent_klines=sent_kl, bursts=bursts, load_sec=round(time.perf_counter() - t0, 3))
+
+# ----------------------- Process ----------------------
+
+def rss_mb(pid: int) -> dict:
+    """VmRSS / VmHWM (peak) in MB from /proc (Linux); empty elsewhere."""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return {}
+    out = {}
+    for line in status.splitlines():
+        name, _, value = line.partition(":")
+        if name in ("VmRSS", "VmHWM"):
+            out["rss" if name == "VmRSS" else "peak"] = round(int(value.split()[0]) / 1024, 1)
+    return out
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+def start(script: str, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, str(HERE / script)], cwd=HERE, env=dict(os.environ, **env),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def stop(proc: subprocess.Popen):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def _latency(summary: dict, unit: str = "ms") -> dict:
+    return {k.replace(f"_{unit}", ""): v for k, v in summary.items() if k.startswith(("p50", "p99", "p999", "max", "avg"))}
+
+# ----------------------- Targets ----------------------
+
+def bench_trader(args) -> dict:
+    port, mport = args.port, args.metrics_port
+    url = f"http://127.0.0.1:{mport}/metrics"
+    proc = start("gptShit2.py", dict(ZMQ_SUB_ADDR=f"tcp://127.0.0.1:{port}", METRICS_PORT=str(mport),
+                                     METRICS_REFRESH_SEC="0.05", LOG_LEVEL="off", PIPE_STATS_SEC="3600"))
+    ctx = zmq.Context.instance()
+    pub = ctx.socket(zmq.PUB)
+    pub.setsockopt(zmq.SNDHWM, 0)  # never drop on our side: overflow must show up in the trader's queues
+    pub.bind(f"tcp://127.0.0.1:{port}")
+    market = Market(args.symbols, args.seed)
+
+    def metrics() -> dict:
+        return json.load(urllib.request.urlopen(url, timeout=5))
+
+    try:
+        deadline = time.monotonic() + 30
+        while True:  # subscriber up and connected (slow joiner): a probe TG has to arrive
+            if proc.poll() is not None:
+                raise RuntimeError(f"trader exited: {proc.stderr.read()[-2000:]}")
+            try:
+                pub.send(json.dumps(market.tg()).encode())
+                if metrics()["tg"]["n"] > 0:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("trader did not come up")
+            time.sleep(0.2)
+
+        depth: List[int] = []
+        last_sample = [0.0]
+
+        def sample():
+            if time.perf_counter() - last_sample[0] >= 0.5:
+                last_sample[0] = time.perf_counter()
+                m = metrics()
+                depth.append(m["raw_q"]["depth"] + m["event_q"]["depth"])
+
+        m0, t0 = metrics(), time.perf_counter()
+        load = drive(market, lambda frames: pub.send_multipart(frames), args.duration, args.tg_rate,
+                     args.bar_sec, args.binary, sample)
+        m1, t1 = metrics(), time.perf_counter()
+        backlog = m1["raw_q"]["depth"] + m1["event_q"]["depth"]
+        while m1["raw_q"]["depth"] + m1["event_q"]["depth"] and time.perf_counter() - t1 < 60:
+            time.sleep(0.1)
+            m1 = metrics()
+        drain = time.perf_counter() - t1
+        time.sleep(max(0.3, float(os.getenv("BAR_GRACE_MS", 250)) / 1000 * 2))  # last bar batch
+        m2 = metrics()
+        # events: TG messages + decided klines (a kline.bin frame counts its records)
+        processed = (m2["tg"]["n"] + m2["close_to_decision"]["n"]) - (m0["tg"]["n"] + m0["close_to_decision"]["n"])
+        mem = rss_mb(proc.pid)
+    finally:
+        stop(proc)
+        pub.close(0)
+    sent = load["sent_tg"] + load["sent_klines"]
+    return dict(
+        load, target="trader", sent=sent, processed=processed,
+        throughput_msg_s=round(processed / (t1 - t0 + drain), 1),
+        offered_msg_s=round(sent / load["load_sec"], 1),
+        dropped=sum(m2[q].get("drop", 0) + m2[q].get("coal", 0) for q in ("raw_q", "event_q")),
+        latency_ms=_latency(m2["close_to_decision"]), recv_latency_ms=_latency(m2["node_to_recv"]),
+        queue=dict(backlog_end=backlog, drain_sec=round(drain, 3), max=m2["event_q"]["max"] + m2["raw_q"]["max"],
+                   avg_sampled=round(float(np.mean(depth)), 1) if depth else 0.0),
+        stages={k: _latency(m2[k], "us") for k in ("parse", "dispatch", "feature", "observe", "decide", "ledger")},
+        rss_mb=mem,
+    )
+
+
+def bench_server(args) -> dict:
+    port = args.port
+    env = dict(AI_ZMQ_BIND=f"tcp://127.0.0.1:{port}", AI_ZMQ_STATS_SEC="3600", LOG_LEVEL="off")
+    if args.mode:
+        env["AI_ZMQ_MODE"] = args.mode
+    proc = start("ai_server_zmq.py", env)
+    ctx = zmq.Context.instance()
+    sock = ctx.socket(zmq.DEALER)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect(f"tcp://127.0.0.1:{port}")
+    market = Market(args.symbols, args.seed)
+    rtt = StageStats("rtt", unit="ms")
+    pending: Dict[bytes, float] = {}
+    rid = [0]
+    inflight_max = [0]
+    replies = [0]
+
+    def request(body: bytes):
+        rid[0] += 1
+        key = str(rid[0]).encode()
+        pending[key] = time.perf_counter()
+        sock.send_multipart([key, b"", body])
+        inflight_max[0] = max(inflight_max[0], len(pending))
+
+    def receive(timeout_ms: int) -> bool:
+        if not sock.poll(timeout_ms):
+            return False
+        key, _, _ = sock.recv_multipart()
+        t = pending.pop(key, None)
+        if t is not None:
+            rtt.record(time.perf_counter() - t)
+            replies[0] += 1
+        return True
+
+    def body() -> bytes:
+        if market.rng.random() < args.tg_share:
+            return json.dumps(market.tg()).encode()
+        i = int(market.rng.integers(len(market.tokens)))
+        return json.dumps(dict(type="bnn_market", symbol=market.tokens[i],
+                               features=market.rng.normal(size=args.features).round(5).tolist())).encode()
+
+    try:
+        deadline = time.monotonic() + 30
+        while True:  # wait for the server to answer
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited: {proc.stderr.read()[-2000:]}")
+            request(json.dumps(dict(type="tg", token="PING", exchange="Binance")).encode())
+            if receive(500):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError("server did not come up")
+        pending.clear()
+        rtt, replies[0], inflight_max[0] = StageStats("rtt", unit="ms"), 0, 0  # ping excluded
+        t0 = time.perf_counter()
+        sent = 0
+        next_send = t0
+        while time.perf_counter() - t0 < args.duration:
+            now = time.perf_counter()
+            if args.rate > 0:  # open loop: on schedule, unless the window is full
+                while next_send <= now and len(pending) < args.window:
+                    request(body())
+                    sent += 1
+                    next_send += 1.0 / args.rate
+                receive(max(0, min(5, int((next_send - time.perf_counter()) * 1000))))
+            else:  # closed loop: keep the window full
+                while len(pending) < args.window:
+                    request(body())
+                    sent += 1
+                receive(5)
+            while receive(0):
+                pass
+        t1 = time.perf_counter()
+        while pending and receive(1000):
+            pass
+        mem = rss_mb(proc.pid)
+    finally:
+        stop(proc)
+        sock.close(0)
+    return dict(target="server", mode=args.mode or os.getenv("AI_ZMQ_MODE", "rep"), sent=sent, replies=replies[0],
+                lost=len(pending), throughput_msg_s=round(rtt.count / (t1 - t0), 1),
+                latency_ms=_latency(rtt.summary()), queue=dict(inflight_max=inflight_max[0], window=args.window),
+                load_sec=round(t1 - t0, 3), rss_mb=mem)
+
+# ----------------------- Compare ----------------------
+
+def _flat(d: dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(_flat(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[f"{prefix}{k}"] = float(v)
+    return out
+
+
+def compare(old_path: str, new_path: str):
+    """Last result per target (server: per mode) in each file → numeric fields side by side with the relative change."""
+    def last(path):
+        runs = {}
+        for line in Path(path).read_text().splitlines():
+            if line.strip():
+                r = json.loads(line)
+                runs[r["target"] + (f":{r['mode']}" if "mode" in r else "")] = r
+        return runs
+
+    old, new = last(old_path), last(new_path)
+    for target in sorted(set(old) & set(new)):
+        a, b = _flat(old[target]), _flat(new[target])
+        print(f"== {target}  {old[target].get('version', '?')} → {new[target].get('version', '?')}")
+        for k in sorted(set(a) & set(b)):
+            delta = "" if not a[k] else f"{(b[k] - a[k]) / abs(a[k]) * 100:+.1f}%"
+            print(f"  {k:32s} {a[k]:>14g} {b[k]:>14g} {delta:>9s}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load generator + end-to-end benchmark")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("trader", "server"):
+        p = sub.add_parser(name)
+        p.add_argument("--symbols", type=int, default=200)
+        p.add_argument("--duration", type=float, default=20.0)
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("--out", help="append the JSON result line to this file")
+        if name == "trader":
+            p.add_argument("--tg-rate", type=float, default=100.0, help="TG notifications per second")
+            p.add_argument("--bar-sec", type=float, default=5.0, help="seconds between kline bursts (0 → none)")
+            p.add_argument("--binary", action="store_true", help="bursts as one kline.bin frame")
+            p.add_argument("--port", type=int, default=5601)
+            p.add_argument("--metrics-port", type=int, default=18601)
+        else:
+            p.add_argument("--rate", type=float, default=0.0, help="requests per second (0 → saturate)")
+            p.add_argument("--window", type=int, default=32, help="max requests in flight")
+            p.add_argument("--mode", help="AI_ZMQ_MODE: rep | router | batch")
+            p.add_argument("--tg-share", type=float, default=0.2, help="fraction of tg requests (rest bnn_market)")
+            p.add_argument("--features", type=int, default=16)
+            p.add_argument("--port", type=int, default=5602)
+    p = sub.add_parser("compare")
+    p.add_argument("old")
+    p.add_argument("new")
+    args = ap.parse_args()
+
+    if args.cmd == "compare":
+        compare(args.old, args.new)
+        return
+    result = (bench_trader if args.cmd == "trader" else bench_server)(args)
+    params = {k: v for k, v in vars(args).items() if k not in ("cmd", "out")}
+    result = dict(result, version=git_rev(), ts=time.strftime("%Y-%m-%dT%H:%M:%S"), params=params,
+                  cpus=os.cpu_count())
+    line = json.dumps(result)
+    print(line)
+    if args.out:
+        with open(args.out, "a") as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
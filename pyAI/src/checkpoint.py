@@ -0,0 +1,390 @@
+"""
+Crash-safe trader checkpoints: periodic snapshots + append-only fill log
+========================================================================
+
+    {root}/snap-{gen}.npz     full PaperTrader state (AssetStore + FeatureEngine arrays, keys)
+    {root}/log-{gen}.bar      BAR_LOG_DTYPE records: every decided bar after snapshot {gen}
+    {root}/log-{gen}.tg       TG_LOG_DTYPE records: every TG snapshot written after snapshot {gen}
+    {root}/log-{gen}.keys     key table of gen {gen}: one JSON string ("Exchange:TOKEN", UTF-8) per line,
+                              line i = key id i in the .bar / .tg / .evt records
+    {root}/log-{gen}.evt      EVENT_LOG_DTYPE records: universe evictions and spill reactivations
+    {root}/spill-{gen}-{seq}.npz  spilled rows a reactivation loaded (moved here from the spill dir)
+
+snapshot() runs on the decision thread between two events: it copies the live arrays
+(a memcpy of the used rows, ~100µs for a thousand symbols), switches the logs to gen + 1 and
+hands the copy to a writer thread, which does the serialisation, fsync and atomic rename — the
+decision loop never waits on disk. A snapshot still being written when the next one is due is
+skipped. Older snapshots/logs are deleted once a newer snapshot is durable.
+
+The logs hold the bar inputs and the target position the policy chose, so restore() rebuilds
+the exact state without calling the policy: load the newest readable snapshot, then replay
+log-{gen}… in order (push closes → update features → settle). Log records are fixed width;
+a torn record at the end (crash mid-write) is ignored. A key is written to the key table before
+the first record that uses its id, so any symbol name (non-ASCII, any length) round-trips.
+The trader logs a bar before settling it: a failed log write leaves the ledger untouched.
+
+Every record carries a sequence number shared by all logs. Universe evictions and
+reactivations (universe.py) are logged as events: replay cuts the bar / TG records at each
+event, applies the event (evict the rows without spilling / load the spilled rows the live
+trader loaded) and goes on, so the restored membership and state match the live trader's.
+AssetStore.on_new is off during restore — a spill file never reloads behind the log's back.
+"""
+
+from __future__ import annotations
+import io, json, os, re, threading, time
+from pathlib import Path
+from typing import Dict, Optional
+import numpy as np
+
+from wire_format import TG_FIELDS
+
+CKPT_DIR = os.getenv("CKPT_DIR", "")  # empty → no checkpoints
+CKPT_SEC = float(os.getenv("CKPT_SEC", 60.0))
+CKPT_FSYNC = os.getenv("CKPT_FSYNC", "0").lower() in ("1", "true", "yes")  # fsync log writes too (power loss)
+
+BAR_LOG_DTYPE = np.dtype([
+    ("seq", "<u8"),             # one decide call; rows inside a decide call are unique
+    ("kid", "<u4"),             # key id in log-{gen}.keys
+    ("ts_close", "<f8"),
+    ("close", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("quoteVolume", "<f8"),
+    ("vwapApprox", "<f8"),
+    ("target_pos", "i1"),
+    ("exec_price", "<f8"),      # fill price (fills.py), = close without a book
+])
+TG_LOG_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("kid", "<u4"),
+    ("ts", "<f8"),
+    ("mask", "u1"),
+    ("values", "<f8", (len(TG_FIELDS),)),
+])
+EVENT_LOG_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("kid", "<u4"),
+    ("kind", "u1"),             # EVICT | REACTIVATE
+])
+EVICT, REACTIVATE = 0, 1
+_NAME = re.compile(r"^(snap|log|spill)-(\d+)(-\d+)?\.(npz|bar|tg|keys|evt)$")
+
+
+def _state_arrays(obj, n: int) -> Dict[str, np.ndarray]:
+    """Per-row arrays of an AssetStore / FeatureEngine (first axis = capacity) → copies of [:n]."""
+    return {name: v[:n].copy() for name, v in vars(obj).items()
+            if isinstance(v, np.ndarray) and v.ndim and len(v) == obj.capacity}
+
+
+def _read_keys(path: Path) -> list:
+    """Key table of one gen; a torn last line (crash mid-write) is dropped."""
+    keys = []
+    if path.exists():
+        for line in path.read_bytes().split(b"\n"):
+            try:
+                keys.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                break
+    return keys
+
+
+def _read_log(path: Path, dtype: np.dtype) -> np.ndarray:
+    size = path.stat().st_size if path.exists() else 0
+    return np.fromfile(path, dtype=dtype, count=size // dtype.itemsize) if size >= dtype.itemsize \
+        else np.zeros(0, dtype=dtype)
+
+
+class Checkpointer:
+    def __init__(self, root, trader, interval_sec: float = CKPT_SEC, fsync: bool = CKPT_FSYNC):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.trader = trader
+        self.interval_sec = interval_sec
+        self.fsync = fsync
+        self.gen = -1
+        self._seq = 0  # orders records across the .bar / .tg / .evt logs
+        self._bar_log = self._tg_log = self._key_log = self._evt_log = None
+        self._kids: Dict[str, int] = {}  # key → id in the current gen's key table
+        self._writer: Optional[threading.Thread] = None
+        self._next = time.monotonic() + interval_sec
+        self.snapshots = 0
+        self.skipped = 0
+        self.last_snapshot_sec = 0.0  # writer-side duration of the last snapshot
+
+    # ---------------- files ----------------
+    def _path(self, kind: str, gen: int) -> Path:
+        return self.root / (f"snap-{gen:08d}.npz" if kind == "snap" else f"log-{gen:08d}.{kind}")
+
+    def _spill_path(self, gen: int, seq: int) -> Path:
+        return self.root / f"spill-{gen:08d}-{seq}.npz"
+
+    def _gens(self, kind: str) -> list:
+        out = []
+        for p in self.root.iterdir():
+            m = _NAME.match(p.name)
+            if m and (m.group(1) == "snap" if kind == "snap" else m.group(1) == "log" and m.group(4) == kind):
+                out.append(int(m.group(2)))
+        return sorted(set(out))
+
+    def _open_logs(self, gen: int):
+        for f in (self._bar_log, self._tg_log, self._key_log, self._evt_log):
+            if f is not None:
+                f.close()
+        self._key_log = open(self._path("keys", gen), "ab", buffering=0)
+        self._bar_log = open(self._path("bar", gen), "ab", buffering=0)
+        self._tg_log = open(self._path("tg", gen), "ab", buffering=0)
+        self._evt_log = open(self._path("evt", gen), "ab", buffering=0)
+        self._kids = {}
+        self.gen = gen
+
+    def _append(self, f, data):
+        f.write(data if isinstance(data, bytes) else data.tobytes())
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _key_ids(self, rows: np.ndarray) -> list:
+        """Key ids of these rows in the current gen; new keys go to the key table first."""
+        keys, kids = self.trader.assets.keys, self._kids
+        new = [keys[r] for r in rows if keys[r] not in kids]
+        if new:
+            new = list(dict.fromkeys(new))
+            self._append(self._key_log, "".join(json.dumps(k) + "\n" for k in new).encode("utf-8"))
+            for k in new:
+                kids[k] = len(kids)
+        return [kids[keys[r]] for r in rows]
+
+    # ---------------- hot path (decision thread) ----------------
+    def log_bar(self, rows: np.ndarray, closes, ts_close, high, low, quote_volume, vwap, target_pos, exec_price):
+        if self._bar_log is None:
+            return
+        rec = np.empty(len(rows), dtype=BAR_LOG_DTYPE)
+        rec["seq"] = self._seq
+        rec["kid"] = self._key_ids(rows)
+        rec["ts_close"], rec["close"], rec["high"], rec["low"] = ts_close, closes, high, low
+        rec["quoteVolume"], rec["vwapApprox"], rec["target_pos"] = quote_volume, vwap, target_pos
+        rec["exec_price"] = exec_price
+        self._seq += 1
+        self._append(self._bar_log, rec)
+
+    def log_tg(self, rows: np.ndarray, values: np.ndarray, mask: np.ndarray, ts: np.ndarray):
+        if self._tg_log is None:
+            return
+        rec = np.empty(len(rows), dtype=TG_LOG_DTYPE)
+        rec["seq"] = self._seq
+        rec["kid"] = self._key_ids(rows)
+        rec["ts"], rec["mask"], rec["values"] = ts, mask, values
+        self._seq += 1
+        self._append(self._tg_log, rec)
+
+    def _log_event(self, rows: np.ndarray, kind: int):
+        rec = np.empty(len(rows), dtype=EVENT_LOG_DTYPE)
+        rec["seq"] = self._seq
+        rec["kid"] = self._key_ids(rows)
+        rec["kind"] = kind
+        self._seq += 1
+        self._append(self._evt_log, rec)
+
+    def log_evict(self, rows: np.ndarray):
+        """Universe.evict: called before the rows are compacted away."""
+        if self._evt_log is not None:
+            self._log_event(rows, EVICT)
+
+    def log_reactivate(self, row: int, spill: Path) -> Optional[Path]:
+        """Universe reactivation: the spill file moves into this gen (the log refers to it); new path."""
+        if self._evt_log is None:
+            return None
+        seq = self._seq
+        self._log_event(np.array([row]), REACTIVATE)
+        path = self._spill_path(self.gen, seq)
+        os.replace(spill, path)
+        return path
+
+    def maybe_snapshot(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        if now >= self._next:
+            self._next = now + self.interval_sec
+            self.snapshot()
+
+    def snapshot(self, wait: bool = False) -> bool:
+        """Copy state + rotate logs now; serialise in the background. False if a write is still running."""
+        if self._writer is not None and self._writer.is_alive():
+            self.skipped += 1
+            return False
+        tr = self.trader
+        tr.flush_tg()  # pending TG snapshots go to the current log before it is rotated
+        st = tr.assets
+        n = len(st)
+        state = {f"store.{k}": v for k, v in _state_arrays(st, n).items()}
+        state.update({f"feat.{k}": v for k, v in _state_arrays(tr.features, min(n, tr.features.capacity)).items()})
+        state["keys"] = np.array(st.keys, dtype=str)
+        gen = self.gen + 1
+        meta = dict(gen=gen, n=n, ts=time.time(), store_window=st.window, feat_window=tr.features.window,
+                    fee_bps=tr.fee_bps)
+        state["meta"] = np.array(json.dumps(meta))
+        self._open_logs(gen)
+        self._writer = threading.Thread(target=self._write, args=(gen, state), daemon=True, name="ckpt-writer")
+        self._writer.start()
+        if wait:
+            self._writer.join()
+        return True
+
+    # ---------------- writer thread ----------------
+    def _write(self, gen: int, state: Dict[str, np.ndarray]):
+        t0 = time.perf_counter()
+        buf = io.BytesIO()
+        np.savez(buf, **state)
+        path = self._path("snap", gen)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(buf.getbuffer())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        dir_fd = os.open(self.root, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        # the new snapshot is durable → everything older is redundant
+        for p in self.root.iterdir():
+            m = _NAME.match(p.name)
+            if m and int(m.group(2)) < gen:
+                p.unlink(missing_ok=True)
+        self.snapshots += 1
+        self.last_snapshot_sec = time.perf_counter() - t0
+
+    # ---------------- startup ----------------
+    def restore(self) -> dict:
+        """Load newest snapshot + replay the log tail into the (fresh) trader, then start a new gen."""
+        t0 = time.perf_counter()
+        st = self.trader.assets
+        on_new, st.on_new = st.on_new, None  # spill files are loaded from the event log only
+        try:
+            base, bars, tgs, events = self._restore()
+        finally:
+            st.on_new = on_new
+        last = max([base] + self._gens("bar") + self._gens("tg"))
+        self.gen = last
+        info = dict(snapshot=base, symbols=len(st), replayed_bars=bars, replayed_tg=tgs, replayed_events=events,
+                    elapsed_ms=round((time.perf_counter() - t0) * 1e3, 2))
+        self.snapshot()  # fresh gen + durable base for the restored state
+        return info
+
+    def _restore(self) -> tuple:
+        base = -1
+        for gen in reversed(self._gens("snap")):
+            try:
+                self._load(self._path("snap", gen))
+                base = gen
+                break
+            except Exception as e:  # torn/corrupt snapshot → fall back to the previous one
+                print(f"[ckpt] snapshot {gen} unreadable ({e}), trying older")
+        bars = tgs = events = 0
+        for gen in sorted(set(self._gens("bar")) | set(self._gens("tg"))):
+            if gen < base:
+                continue
+            keys = _read_keys(self._path("keys", gen))
+            bar, tg, evt = (self._known(_read_log(self._path(kind, gen), dtype), keys) for kind, dtype in
+                            (("bar", BAR_LOG_DTYPE), ("tg", TG_LOG_DTYPE), ("evt", EVENT_LOG_DTYPE)))
+            # tg and bar records touch different arrays and commute; events cut them into segments
+            lo_bar = lo_tg = 0
+            cuts = np.flatnonzero(np.diff(evt["seq"].astype(np.int64))) + 1
+            for group in np.split(evt, cuts) + [evt[:0]]:
+                seq = group["seq"][0] if len(group) else np.iinfo(np.uint64).max
+                hi_bar = int(np.searchsorted(bar["seq"], seq))
+                hi_tg = int(np.searchsorted(tg["seq"], seq))
+                tgs += self._replay_tg(tg[lo_tg:hi_tg], keys)
+                bars += self._replay_bars(bar[lo_bar:hi_bar], keys)
+                lo_bar, lo_tg = hi_bar, hi_tg
+                if len(group):
+                    events += self._replay_event(group, keys, gen)
+        return base, bars, tgs, events
+
+    def _load(self, path: Path):
+        tr, st = self.trader, self.trader.assets
+        with np.load(path) as z:
+            meta = json.loads(str(z["meta"]))
+            if meta["store_window"] != st.window or meta["feat_window"] != tr.features.window:
+                raise ValueError(f"window mismatch (snapshot {meta['store_window']}/{meta['feat_window']}, "
+                                 f"trader {st.window}/{tr.features.window})")
+            keys = [str(k) for k in z["keys"]]
+            rows = st.rows(keys)
+            if len(rows) and not np.array_equal(rows, np.arange(len(keys))):
+                raise ValueError("restore needs an empty trader")
+            for name in z.files:
+                prefix, _, attr = name.partition(".")
+                if prefix not in ("store", "feat"):
+                    continue
+                obj = st if prefix == "store" else tr.features
+                arr = z[name]
+                if len(arr) > obj.capacity:
+                    obj._alloc(1 << (len(arr) - 1).bit_length())
+                getattr(obj, attr)[:len(arr)] = arr
+
+    @staticmethod
+    def _known(rec: np.ndarray, keys: list) -> np.ndarray:
+        """Records whose key id made it into the key table (a crash can tear the table first)."""
+        return rec[rec["kid"] < len(keys)]
+
+    def _replay_tg(self, rec: np.ndarray, keys: list) -> int:
+        if not len(rec):
+            return 0
+        rows = self.trader.assets.rows([keys[k] for k in rec["kid"].tolist()])
+        _, first_rev = np.unique(rows[::-1], return_index=True)  # latest per symbol wins
+        last = len(rows) - 1 - first_rev
+        self.trader.set_tg_rows(rows[last], rec["values"][last], rec["ts"][last], mask=rec["mask"][last])
+        return len(rec)
+
+    def _replay_bars(self, rec: np.ndarray, keys: list) -> int:
+        if not len(rec):
+            return 0
+        tr, st = self.trader, self.trader.assets
+        all_rows = st.rows([keys[k] for k in rec["kid"].tolist()])
+        # rows evolve independently → consecutive batches merge until a symbol repeats
+        # (the per-message path logs one batch per symbol, a bar becomes one vectorised step)
+        bounds, seen = [0], set()
+        starts = np.r_[0, np.flatnonzero(np.diff(rec["seq"].astype(np.int64))) + 1]
+        for lo, hi in zip(starts, np.r_[starts[1:], len(rec)]):
+            batch_rows = all_rows[lo:hi].tolist()
+            if not seen.isdisjoint(batch_rows):
+                bounds.append(lo)
+                seen = set()
+            seen.update(batch_rows)
+        bounds.append(len(rec))
+        fee_rate = tr.fee_bps / 1e4
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            r, b = all_rows[lo:hi], rec[lo:hi]
+            st.push_closes(r, b["close"])
+            tr.features.update(r, b["high"], b["low"], b["close"], b["quoteVolume"], b["vwapApprox"])
+            st.settle(r, b["close"], b["target_pos"].astype(np.int64), b["ts_close"], fee_rate=fee_rate,
+                      notional=tr.cfg.position_notional, exec_price=b["exec_price"])
+        return len(rec)
+
+    def _replay_event(self, rec: np.ndarray, keys: list, gen: int) -> int:
+        """One logged eviction (many rows) or reactivation (one row, its spill moved into gen)."""
+        universe, st = self.trader.universe, self.trader.assets
+        names = [keys[k] for k in rec["kid"].tolist()]
+        if rec["kind"][0] == EVICT:
+            universe.evict(st.rows(names), spill=False)
+        else:
+            r = st.row(names[0])
+            path = self._spill_path(gen, int(rec["seq"][0]))
+            # crash between the log record and the move → the file is still in the spill dir
+            if not path.exists() and universe.spill_dir is not None:
+                path = universe.spill_path(names[0])
+            universe.load(names[0], r, path)
+        return len(rec)
+
+    def close(self):
+        """Final snapshot on clean shutdown (restart then has no log tail to replay)."""
+        if self._writer is not None:
+            self._writer.join()
+        self.snapshot(wait=True)
+        for f in (self._bar_log, self._tg_log, self._key_log, self._evt_log):
+            if f is not None:
+                f.close()
+        self._bar_log = self._tg_log = self._key_log = self._evt_log = None
+
+    def summary(self) -> dict:
+        return dict(gen=self.gen, snapshots=self.snapshots, skipped=self.skipped,
+                    last_write_ms=round(self.last_snapshot_sec * 1e3, 2))
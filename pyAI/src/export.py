@@ -0,0 +1,162 @@
+"""
+Offline RL dataset export: recorded events → (obs, action, reward, next_obs, done)
+=================================================================================
+
+Replays recorded TG/kline events (replay.Replay, so TG coalescing, features and ledger are the
+live code paths) and taps every decision: the observation is the one the policy saw —
+ObsLayout.write_batch, i.e. build_observation_batch for the config — and the action the one
+it took. Variants come from TraderConfig, e.g.:
+
+    tg_decay=false   gptShit2.py: raw TG snapshot + dt_tg_min / dt_close_min age features
+    tg_decay=true    gpt_shit.py: TG values × exp(-age / tau_sec)
+
+Output directory (one transition per bar per symbol, each symbol a contiguous time-ordered
+slice [offsets[i], offsets[i] + counts[i]) of every array):
+
+    obs.npy, next_obs.npy   float32 (N × dim)   layout.names in meta.json
+    action.npy              int8    (N,)        0 sell / 1 hold / 2 buy
+    reward.npy              float32 (N,)        -(fees + slippage) of this bar's trade
+                                                + mark-to-market of the new position to the next close
+    done.npy                bool    (N,)        last bar of the symbol (next_obs = obs there)
+    meta.json               keys, offsets, counts, names, config
+
+The arrays are created up front with the final shape (np.lib.format.open_memmap); worker
+processes each take a shard of the symbols (code % shards, as in sweep.py), read the input
+ReplayData memory-mapped and write their rows straight into the shared files, so neither the
+input nor the output has to fit in RAM.
+
+Usage:
+    python export.py events.jsonl [more | RECORD_DIR | ReplayData dir] --out dataset/ \\
+        [--set tg_decay=true policy=momentum] [--workers 8] [--shards 8]
+"""
+
+from __future__ import annotations
+import argparse, json, os, time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+from gptShit2 import TraderConfig
+from replay import Replay, ReplayData
+from sweep import parse_grid, prepare_data
+
+ARRAYS = {  # name → (dtype, per-row shape given obs dim)
+    "obs": (np.float32, lambda dim: (dim,)),
+    "next_obs": (np.float32, lambda dim: (dim,)),
+    "action": (np.int8, lambda dim: ()),
+    "reward": (np.float32, lambda dim: ()),
+    "done": (np.bool_, lambda dim: ()),
+}
+
+
+class TransitionWriter:
+    """PaperTrader.tap → rows of the output memmaps (one shard of symbols)."""
+    def __init__(self, out_dir: Path, trader, keys: List[str], offsets: np.ndarray):
+        self.arrays = {name: np.load(out_dir / f"{name}.npy", mmap_mode="r+") for name in ARRAYS}
+        self.trader = trader
+        st = trader.assets
+        key_rows = st.rows(keys)
+        self.base = np.zeros(st.capacity, dtype=np.int64)  # store row → first output row of its symbol
+        self.base[key_rows] = offsets[:len(keys)]
+        self.cursor = np.zeros(st.capacity, dtype=np.int64)
+        self.prev_pnl = np.zeros(st.capacity)
+        self.prev_cost = np.zeros(st.capacity)
+
+    def __call__(self, rows: np.ndarray, obs: np.ndarray, actions: np.ndarray):
+        st, a = self.trader.assets, self.arrays
+        n = len(rows)
+        cur = self.cursor[rows]
+        pos = self.base[rows] + cur
+        a["obs"][pos] = obs[:n]
+        a["action"][pos] = actions
+        # settle at this bar = mark of the previous action's position − cost of this action's trade
+        pnl, cost = st.realized_pnl[rows], st.fees[rows] + st.slippage[rows]
+        d_cost = cost - self.prev_cost[rows]
+        mark = pnl - self.prev_pnl[rows] + d_cost
+        a["reward"][pos] = -d_cost
+        prev = cur > 0
+        if prev.any():
+            p = pos[prev] - 1
+            a["next_obs"][p] = obs[:n][prev]
+            a["reward"][p] += mark[prev]
+        self.prev_pnl[rows], self.prev_cost[rows] = pnl, cost
+        self.cursor[rows] = cur + 1
+
+    def close(self, key_rows: np.ndarray, counts: np.ndarray):
+        """Terminal transitions: last bar of each symbol."""
+        a = self.arrays
+        last = self.base[key_rows] + counts - 1
+        last = last[counts > 0]
+        a["next_obs"][last] = a["obs"][last]
+        a["done"][last] = True
+        for arr in a.values():
+            arr.flush()
+
+
+def _export_shard(task) -> Dict:
+    data_dir, out_dir, params, shard, n_shards = task
+    data = ReplayData.load(data_dir, mmap=True)
+    meta = json.loads((Path(out_dir) / "meta.json").read_text())
+    offsets, counts = np.asarray(meta["offsets"]), np.asarray(meta["counts"])
+    if n_shards > 1:
+        data = data.select(np.arange(len(data.keys)) % n_shards == shard)
+    rp = Replay(config=TraderConfig(**params))
+    writer = TransitionWriter(Path(out_dir), rp.trader, data.keys, offsets)
+    rp.trader.tap = writer
+    rp.run_data(data)
+    key_rows = rp.trader.assets.rows(data.keys)
+    mine = np.arange(len(data.keys)) % n_shards == shard
+    writer.close(key_rows[mine], counts[mine])
+    return dict(shard=shard, transitions=int(counts[mine].sum()), elapsed_sec=round(rp.elapsed, 3))
+
+
+def export(data_dir, out_dir, params: Dict, workers: int = os.cpu_count() or 1, n_shards: int = 0) -> dict:
+    """Allocate the output arrays, then fill them shard by shard (in parallel if workers > 1)."""
+    data = ReplayData.load(data_dir, mmap=True)
+    cfg = TraderConfig(**params)
+    layout = cfg.layout
+    counts = np.bincount(np.asarray(data.kl_code), minlength=len(data.keys)).astype(np.int64)
+    offsets = np.r_[0, np.cumsum(counts)[:-1]].astype(np.int64)
+    total = int(counts.sum())
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    for name, (dtype, shape) in ARRAYS.items():
+        arr = np.lib.format.open_memmap(out / f"{name}.npy", mode="w+", dtype=dtype, shape=(total,) + shape(layout.dim))
+        del arr  # sized on disk (sparse), workers fill it
+    (out / "meta.json").write_text(json.dumps(dict(
+        keys=data.keys, offsets=offsets.tolist(), counts=counts.tolist(), names=list(layout.names),
+        dim=layout.dim, config=asdict(cfg))))
+
+    n_shards = n_shards or max(1, workers)
+    tasks = [(str(data_dir), str(out), params, shard, n_shards) for shard in range(n_shards)]
+    t0 = time.perf_counter()
+    if workers <= 1:
+        results = [_export_shard(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_export_shard, tasks))
+    return dict(out=str(out), symbols=len(data.keys), transitions=total, dim=layout.dim, shards=results,
+                wall_sec=round(time.perf_counter() - t0, 3))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export recorded events as offline RL transitions")
+    ap.add_argument("inputs", nargs="+", help="event files (JSONL/CSV/Parquet), a RECORD_DIR or a ReplayData directory")
+    ap.add_argument("--out", required=True, help="output directory")
+    ap.add_argument("--set", nargs="*", default=[], help="field=value (TraderConfig fields, one value each)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--shards", type=int, default=0, help="symbol shards (default: one per worker)")
+    ap.add_argument("--data-dir", help="where to write the memory-mapped input dataset")
+    args = ap.parse_args()
+
+    grid = parse_grid(args.set)
+    if len(grid) != 1:
+        ap.error("--set takes a single value per field")
+    data_dir = prepare_data(args.inputs, args.data_dir)
+    print("[export]", json.dumps(export(data_dir, args.out, grid[0], args.workers, args.shards)))
+
+
+if __name__ == "__main__":
+    main()
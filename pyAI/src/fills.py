@@ -0,0 +1,227 @@
+"""
+Fill / slippage simulation from cached order books
+==================================================
+
+Per symbol ("Exchange:TOKEN") an OrderBook of two BookSides. A side is a pair of preallocated
+float64 arrays (price key, qty) kept sorted best → worst, at most BOOK_LEVELS levels.
+Diffs update it in place: np.searchsorted finds the level, then qty is replaced, or the tail
+is shifted one slot to insert/delete — no rebuild, no per-level objects.
+
+A fill of `size` base units walks the opposite side: cumulative qty → searchsorted → volume-
+weighted price of the levels consumed. Size beyond the visible book is priced at the worst
+level (counted as `exhausted`). Without a usable book (none, out of sync, older than
+BOOK_MAX_AGE_SEC) the caller's reference price (bar close) is used, as before.
+
+Messages (same envelope as TG/kline, payload fields as Binance returns them —
+node/binanceMidleware.js getDepth / getBookTicker, @depth stream for diffs):
+    {"type": "depth",       "exchange", "token", "lastUpdateId", "bids": [[p, q], ...], "asks": [...]}
+    {"type": "depth_diff",  "exchange", "token", "U", "u", "b": [[p, q], ...], "a": [...]}   q = 0 → remove
+    {"type": "book_ticker", "exchange", "token", "bidPrice", "bidQty", "askPrice", "askQty"}
+A diff that skips update ids marks the book out of sync until the next "depth" snapshot.
+"""
+
+from __future__ import annotations
+import os, time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+BOOK_LEVELS = int(os.getenv("BOOK_LEVELS", 200))  # levels kept per side
+BOOK_MAX_AGE_SEC = float(os.getenv("BOOK_MAX_AGE_SEC", 30.0))  # older books are not used for fills
+
+BOOK_TYPES = ("depth", "depth_diff", "book_ticker")
+
+
+def _levels(rows) -> tuple:
+    """[[price, qty], ...] (strings or numbers) → (prices, qtys) float64 arrays."""
+    if rows is None or not len(rows):
+        return np.zeros(0), np.zeros(0)
+    arr = np.asarray(rows, dtype=np.float64).reshape(-1, 2)
+    if not np.isfinite(arr).all():
+        raise ValueError("non-finite price level")
+    return arr[:, 0], arr[:, 1]
+
+
+class BookSide:
+    """
+    Sorted price levels of one side. Prices are stored as keys = price * sign (sign = -1 for
+    bids), so both sides are ascending in key and index 0 is the best level.
+    """
+    __slots__ = ("sign", "key", "qty", "n")
+
+    def __init__(self, bids: bool, capacity: int = BOOK_LEVELS):
+        self.sign = -1.0 if bids else 1.0
+        self.key = np.empty(max(1, capacity), dtype=np.float64)
+        self.qty = np.empty(max(1, capacity), dtype=np.float64)
+        self.n = 0
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self.key[:self.n] * self.sign
+
+    def load(self, prices: np.ndarray, qtys: np.ndarray):
+        """Full snapshot: sort, drop empty levels, keep the best `capacity`."""
+        keep = qtys > 0
+        keys, qtys = prices[keep] * self.sign, qtys[keep]
+        order = np.argsort(keys, kind="stable")[:len(self.key)]
+        self.n = len(order)
+        self.key[:self.n] = keys[order]
+        self.qty[:self.n] = qtys[order]
+
+    def update(self, price: float, qty: float):
+        """One level change in place: qty > 0 sets/inserts the level, qty <= 0 removes it."""
+        k, n = price * self.sign, self.n
+        i = int(np.searchsorted(self.key[:n], k))
+        hit = i < n and self.key[i] == k
+        if qty <= 0:
+            if hit:
+                self.key[i:n - 1] = self.key[i + 1:n]
+                self.qty[i:n - 1] = self.qty[i + 1:n]
+                self.n = n - 1
+            return
+        if hit:
+            self.qty[i] = qty
+            return
+        cap = len(self.key)
+        if i >= cap:
+            return  # worse than every level we track
+        if n == cap:
+            n -= 1  # full: the worst level falls off
+        self.key[i + 1:n + 1] = self.key[i:n]
+        self.qty[i + 1:n + 1] = self.qty[i:n]
+        self.key[i] = k
+        self.qty[i] = qty
+        self.n = n + 1
+
+    def update_many(self, prices: np.ndarray, qtys: np.ndarray):
+        for p, q in zip(prices.tolist(), qtys.tolist()):
+            self.update(p, q)
+
+    def set_best(self, price: float, qty: float):
+        """Top-of-book update: levels better than `price` are gone, then the level itself is set."""
+        k = price * self.sign
+        drop = int(np.searchsorted(self.key[:self.n], k))
+        if drop:
+            self.key[:self.n - drop] = self.key[drop:self.n]
+            self.qty[:self.n - drop] = self.qty[drop:self.n]
+            self.n -= drop
+        self.update(price, qty)
+
+    def walk(self, size: float) -> tuple:
+        """Take `size` from the best level down → (vwap price, exhausted). Empty side → (nan, True)."""
+        n = self.n
+        if not n:
+            return np.nan, True
+        qty = self.qty[:n]
+        price = self.key[:n] * self.sign
+        cum = np.cumsum(qty)
+        i = int(np.searchsorted(cum, size))  # level where the order completes
+        if i >= n:  # deeper than the book: the rest at the worst visible price
+            return (float(price @ qty) + (size - cum[-1]) * price[-1]) / size, True
+        done = cum[i - 1] if i else 0.0
+        return (float(price[:i] @ qty[:i]) + (size - done) * price[i]) / size, False
+
+
+class OrderBook:
+    __slots__ = ("bids", "asks", "last_update_id", "synced", "updated_at")
+
+    def __init__(self, levels: int = BOOK_LEVELS):
+        self.bids = BookSide(bids=True, capacity=levels)
+        self.asks = BookSide(bids=False, capacity=levels)
+        self.last_update_id = -1
+        self.synced = False
+        self.updated_at = 0.0
+
+    def load(self, bids, asks, last_update_id: int = -1, now: Optional[float] = None):
+        bids, asks, last_update_id = _levels(bids), _levels(asks), int(last_update_id)  # parse before touching
+        self.bids.load(*bids)
+        self.asks.load(*asks)
+        self.last_update_id = last_update_id
+        self.synced = True
+        self.updated_at = time.time() if now is None else now
+
+    def apply_diff(self, first_id: int, last_id: int, bids, asks, now: Optional[float] = None) -> bool:
+        """@depth diff (U..u). Old diffs are skipped; a gap → out of sync until the next snapshot."""
+        if last_id <= self.last_update_id:
+            return True
+        if self.last_update_id >= 0 and first_id > self.last_update_id + 1:
+            self.synced = False
+            return False
+        bids, asks = _levels(bids), _levels(asks)
+        self.bids.update_many(*bids)
+        self.asks.update_many(*asks)
+        self.last_update_id = last_id
+        self.updated_at = time.time() if now is None else now
+        return True
+
+    def set_top(self, bid: float, bid_qty: float, ask: float, ask_qty: float, now: Optional[float] = None):
+        self.bids.set_best(bid, bid_qty)
+        self.asks.set_best(ask, ask_qty)
+        self.synced = self.synced or self.last_update_id < 0  # ticker-only book: top level is all we have
+        self.updated_at = time.time() if now is None else now
+
+    def fill(self, size: float) -> tuple:
+        """Signed base size (> 0 buy → asks, < 0 sell → bids) → (vwap price, exhausted)."""
+        return (self.asks if size > 0 else self.bids).walk(abs(size))
+
+
+class FillSimulator:
+    """Books per symbol + execution prices for the ledger (PaperTrader.settle)."""
+    def __init__(self, levels: int = BOOK_LEVELS, max_age_sec: float = BOOK_MAX_AGE_SEC):
+        self.levels = levels
+        self.max_age_sec = max_age_sec
+        self.books: Dict[str, OrderBook] = {}
+        self.fills = 0           # orders priced from a book
+        self.fallback = 0        # orders priced at the reference price (no usable book)
+        self.exhausted = 0       # orders larger than the visible side
+        self.gaps = 0            # diffs that found a missing update id
+        self.rejected = 0        # malformed book messages (missing / non-numeric fields), book left as it was
+        self.slippage_bps = 0.0  # Σ signed (exec / ref - 1) × 1e4 over book fills
+
+    def book(self, key: str) -> OrderBook:
+        b = self.books.get(key)
+        if b is None:
+            b = self.books[key] = OrderBook(self.levels)
+        return b
+
+    def on_message(self, msg: dict, now: Optional[float] = None):
+        key = f"{msg.get('exchange')}:{msg.get('token')}"
+        mtype = str(msg.get("type", "")).lower()
+        try:  # ParseStage rejects most of these; direct callers may not validate
+            if mtype == "depth":
+                self.book(key).load(msg["bids"], msg["asks"], msg.get("lastUpdateId", -1), now)
+            elif mtype == "depth_diff":
+                self.gaps += not self.book(key).apply_diff(int(msg["U"]), int(msg["u"]), msg.get("b"), msg.get("a"), now)
+            elif mtype == "book_ticker":
+                top = [float(msg[f]) for f in ("bidPrice", "bidQty", "askPrice", "askQty")]
+                if not np.isfinite(top).all():
+                    raise ValueError("non-finite top of book")
+                self.book(key).set_top(*top, now)
+        except (KeyError, TypeError, ValueError):
+            self.rejected += 1
+
+    def exec_prices(self, keys: Sequence[str], sizes: np.ndarray, ref: np.ndarray,
+                    now: Optional[float] = None) -> np.ndarray:
+        """Signed base sizes (non-zero) → execution prices; `ref` where no usable book."""
+        now = time.time() if now is None else now
+        out = np.array(ref, dtype=np.float64)
+        for j, (key, size) in enumerate(zip(keys, sizes.tolist())):
+            b = self.books.get(key)
+            if b is None or not b.synced or now - b.updated_at > self.max_age_sec:
+                self.fallback += 1
+                continue
+            price, exhausted = b.fill(size)
+            if np.isnan(price):
+                self.fallback += 1
+                continue
+            out[j] = price = float(price)
+            self.fills += 1
+            self.exhausted += exhausted
+            self.slippage_bps += (price / ref[j] - 1.0) * 1e4 * (1.0 if size > 0 else -1.0)
+        return out
+
+    def summary(self) -> dict:
+        return dict(books=len(self.books), fills=self.fills, fallback=self.fallback, exhausted=self.exhausted,
+                    gaps=self.gaps, rejected=self.rejected, avg_slip_bps=round(self.slippage_bps / self.fills, 3) if self.fills else 0.0)
@@ -7,11 +7,12 @@ What you get:
 - Single decision rhythm: we ONLY trade on KLINE_CLOSE events
 - Discrete actions: 0=SELL, 1=HOLD, 2=BUY
 - Tier-0 TG features (no encoder yet): last TG snapshot + age features (no decay)
-- Paper-trading ledger (PnL, fees), per-asset
-- ZMQ SUB listener with one queue for both streams
+- Paper-trading ledger (PnL, fees, slippage vs close), per-asset, kept in a columnar NumPy AssetStore
+- Staged pipeline: ZMQ recv → parse/validate → decision (feature → decide → ledger), bounded
+  queues in between with per-stage counters and latency (pipeline.py)
 
 How to run (suggested):
-1) pip install pyzmq
+1) pip install pyzmq numpy
 2) python paper_trader.py  (rename this file as you like)
 3) Feed JSON messages over ZeroMQ PUB → SUB:
    - TG example (irregular):
@@ -45,20 +46,66 @@ How to run (suggested):
 Environment variables (or edit defaults below):
 - ZMQ_SUB_ADDR:  e.g. "tcp://127.0.0.1:5559"  (subscriber endpoint)
 - ZMQ_TOPIC:     if you use pub-sub topics; otherwise leave empty to receive all
+- FEAT_WINDOW / EMA_SPAN / ATR_PERIOD: rolling kline features (FeatureEngine), default 20 / 20 / 14
+  (all knobs are also per-instance via TraderConfig, see sweep.py)
+- POLICY:        coin_change (default) | momentum | model
+- POLICY_MODEL:  model file for POLICY=model (.onnx / TorchScript .pt / SB3 .pkl|.zip), loaded once,
+                 warmed up and hot-swapped when the file changes (model_registry.py)
+- LOG_LEVEL / LOG_EVENT_LEVELS / LOG_SAMPLE: console log controls, TRADE_JOURNAL: JSONL journal of
+                 decisions and fills; both written by a background thread (logsink.py)
+- RECORD_DIR:    if set, every received TG/kline message is appended to day files there (recorder.py)
+- BAR_BATCH:     1 → collect every kline closing on the same ts_close and decide them in one batch
+- BAR_GRACE_MS:  how long a bar waits for late symbols after its first close arrived (default 250)
+- PIPE_OVERFLOW: block | drop_oldest | coalesce — what a full stage queue does (pipeline.py)
+- PIPE_QUEUE_SIZE / PIPE_STATS_SEC: queue bound per stage (default 10000), stats log period (default 30)
+- METRICS_PORT:  if set, the same stats (stage latencies, close→decision lag) as JSON on
+                 http://127.0.0.1:PORT/metrics, rebuilt on the decision thread every
+                 METRICS_REFRESH_SEC (default 1)
+- CKPT_DIR:      if set, trader state is snapshotted there every CKPT_SEC (default 60) with an
+                 append-only fill log in between; a restart restores it (checkpoint.py)
+- POSITION_NOTIONAL: quote notional per position unit (0 → 1 base unit, the old demo sizing)
+- BOOK_LEVELS / BOOK_MAX_AGE_SEC: order books from "depth" / "depth_diff" / "book_ticker" messages
+                 price fills volume-weighted against the book instead of at the close (fills.py)
+- TICK_FEATS:    1 → trade / liquidation ticks ("trade", "liquidation" JSON or packed [b"tick.bin", ...])
+                 are aggregated into rolling microstructure features, appended to the observation;
+                 TICK_WINDOW_SEC / TICK_BUCKETS / LARGE_TRADE_USD (ticks.py)
+- UNIVERSE_MAX / UNIVERSE_IDLE_MIN: cap on tracked symbols / idle minutes after which flat assets
+                 are evicted (LRU above the cap); UNIVERSE_SPILL_DIR keeps evicted state on disk for
+                 reactivation; memory per asset and in total in the metrics (universe.py)
+- BAR_TIMEFRAMES: e.g. "5m,15m,1h" → higher-timeframe bars built from the 1m closes, each decided
+                 by its own PaperTrader; BAR_AGG_GRACE_SEC / BAR_AGG_INCOMPLETE (bars.py). Their
+                 decision rows carry tf="5m" etc. (the base trader's "1m"), their state is in the
+                 metrics / shard snapshots under "timeframes" and checkpointed in CKPT_DIR/{tf};
+                 bars still open in the aggregator are not checkpointed (a restart flags them incomplete)
+- Multi-core: `python shard.py --shards N` runs N of these Runners as processes, symbols
+                 hash-partitioned by a router process (shard.py)
 
 Notes:
 - If your PUB sends Python repr instead of JSON — we try ast.literal_eval fallback.
+- Packed binary klines ([b"kline.bin", N records], see wire_format.py) are decoded with
+  np.frombuffer and decided as one batch; JSON remains the default.
 - This is a *paper* trader. No real orders here.
-- Policy = heuristic by default. Plug your SB3/FinRL model later via Policy interface.
+- Policy = heuristic by default; POLICY=model runs an ONNX/TorchScript/SB3 model via ModelPolicy.
 """
 
 from __future__ import annotations
-import os, time, json, math, threading, queue, signal
-from dataclasses import dataclass, field
-from typing import Dict, Optional, Any, Deque
-from collections import defaultdict, deque
+import os, time, json, math, functools, threading, queue, signal
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Any, Sequence
 import ast
+import numpy as np
 import zmq
+from wire_format import (KLINE_BIN_TOPIC, TICK_BIN_TOPIC, TG_FIELDS, decode_klines, decode_ticks, decode_tg,
+                         decode_tg_batch, record_keys)
+from recorder import RECORD_DIR, EventRecorder
+from bars import BAR_AGG_INCOMPLETE, BarAggregator, timeframe_label
+from checkpoint import CKPT_DIR, Checkpointer
+from fills import BOOK_TYPES, FillSimulator
+from logsink import LOG
+from model_registry import REGISTRY
+from universe import UNIVERSE_SPILL_DIR, Universe
+from ticks import TICK_FEATS, TICK_NAMES, TICK_TYPES, TickAggregator
+from pipeline import METRICS_PORT, METRICS_REFRESH_SEC, PIPE_STATS_SEC, LagTracer, ParseStage, StageQueue, StageStats, collect, serve_metrics
 
 # ----------------------- Config -----------------------
 ZMQ_SUB_ADDR = os.getenv("ZMQ_SUB_ADDR", "tcp://127.0.0.1:5559")
@@ -67,20 +114,55 @@ ZMQ_TOPIC = os.getenv("ZMQ_TOPIC", "")  # empty → subscribe to all
 # decay for TG features (seconds). Example: 1h half-life ~ tau ≈ 3600 / ln(2)
 TAU_SEC = float(os.getenv("TG_DECAY_TAU_SEC", 3600.0))
 FEE_BPS = float(os.getenv("FEE_BPS", 3.0))  # 3 bps per turnover leg (example)
+POSITION_NOTIONAL = float(os.getenv("POSITION_NOTIONAL", 0.0))  # quote per position unit, 0 → 1 base unit
 
 # kline window for simple returns (Tier-0 kline features)
 RET_WINDOW = int(os.getenv("RET_WINDOW", 3))
 
+# rolling kline features (FeatureEngine): window for mean/var/z-score/VWAP, EMA span, ATR period
+FEAT_WINDOW = int(os.getenv("FEAT_WINDOW", 20))
+EMA_SPAN = int(os.getenv("EMA_SPAN", 20))
+ATR_PERIOD = int(os.getenv("ATR_PERIOD", 14))
+
+POLICY = os.getenv("POLICY", "coin_change")  # key in POLICIES
+POLICY_MODEL = os.getenv("POLICY_MODEL", "")
+
+# bar-synchronous batching: all klines sharing a ts_close are decided in one policy call
+BAR_BATCH = os.getenv("BAR_BATCH", "0").lower() in ("1", "true", "yes")
+BAR_GRACE_MS = float(os.getenv("BAR_GRACE_MS", 250.0))  # wait for late arrivals of the same bar
+
+@dataclass(frozen=True)
+class TraderConfig:
+    """
+    Per-instance trader knobs. Defaults come from the env globals above; passing a config
+    explicitly lets many configurations run side by side (sweeps, backtests).
+    """
+    fee_bps: float = FEE_BPS
+    position_notional: float = POSITION_NOTIONAL
+    ret_window: int = RET_WINDOW
+    tau_sec: float = TAU_SEC
+    tg_decay: bool = False  # gpt_shit.py variant: TG values × exp(-age / tau_sec) instead of raw
+    feat_window: int = FEAT_WINDOW
+    ema_span: int = EMA_SPAN
+    atr_period: int = ATR_PERIOD
+    policy: str = POLICY  # key in POLICIES
+    tick_feats: bool = TICK_FEATS  # append the ticks.TICK_NAMES block to the observation
+
+    @property
+    def kline_dim(self) -> int:
+        return self.ret_window + len(FeatureEngine.NAMES)
+
+    @property
+    def obs_dim(self) -> int:
+        return len(TG_FIELDS) + self.kline_dim + (len(TICK_NAMES) if self.tick_feats else 0) + 2 + 3
+
+    @property
+    def layout(self) -> "ObsLayout":
+        """Compiled observation layout (cached per config)."""
+        return _layout(self)
+
 # --------------------- Data classes -------------------
-@dataclass
-class TGFeatures:
-    openInterest: Optional[float] = None
-    volume: Optional[float] = None
-    trades8h: Optional[float] = None
-    oiChange4h: Optional[float] = None
-    coinChange24h: Optional[float] = None
-    notificationsCount8h: Optional[float] = None
-    ts: float = 0.0  # epoch seconds of last update
+# TG_FIELDS (wire_format): order of the TG snapshot in AssetStore.tg and in the observation
 
 @dataclass
 class KlineClose:
@@ -91,36 +173,255 @@ class KlineClose:
     volume: float
     ts_close: float
 
-    open: float
-    high: float
-    low: float
-    close: float
-    volume: float
-    ts_close: float
+# --------------------- Asset store --------------------
+class AssetStore:
+    """
+    Columnar per-asset state: one row per "Exchange:TOKEN" key, NumPy arrays per field.
+    - tg:        (rows × len(TG_FIELDS)) last TG snapshot, 0.0 where missing; tg_mask = null bitmask
+    - closes:    (rows × window) ring buffer of closes, `n_closes` = total closes pushed
+    - position / last_close / realized_pnl / last_close_ts: ledger columns; position is the -1/0/1
+      signal, qty the base quantity held (sized when the signal switches)
+    - turnover / fees / slippage / n_trades / n_bars: running ledger stats
+    - last_seen: wall-clock time of the last TG snapshot / decided bar (universe.py evicts idle rows)
+    Arrays grow by doubling, so batch updates are plain fancy-indexed writes; `_fills` holds each
+    array's empty value (rows vacated by universe.py are reset to it).
+    """
+    def __init__(self, capacity: int = 256, window: int = RET_WINDOW + 1):
+        self.window = int(window)
+        self.index: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.on_new: Optional[Callable[[str, int], None]] = None  # on_new(key, row) for a key's new row
+        self.capacity = 0
+        self._alloc(max(1, int(capacity)))
 
-@dataclass
-class AssetState:
-    key: str  # "Exchange:TOKEN"
-    tg: TGFeatures = field(default_factory=TGFeatures)
-    last_close: Optional[float] = None
-    position: int = 0  # -1,0,1
-    realized_pnl: float = 0.0
-    # for simple return features
-    close_window: Deque[float] = field(default_factory=lambda: deque(maxlen=RET_WINDOW+1))
+    def _alloc(self, capacity: int):
+        n = self.capacity
+        self._fills = {}
 
-# --------------------- Feature utils ------------------
+        def grow(name, fill, shape=(), dtype=np.float64):
+            new = np.full((capacity,) + shape, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:n] = old[:n]
+            setattr(self, name, new)
+            self._fills[name] = fill
 
-def _to_float(x: Any) -> Optional[float]:
-    if x is None:
-        return None
-    try:
-        s = str(x).strip()
-        if s.lower() == 'none' or s == '':
-            return None
-        return float(s)
-    except Exception:
-        return None
+        grow('position', 0, dtype=np.int8)  # -1,0,1
+        grow('qty', 0.0)
+        grow('last_close', np.nan)
+        grow('last_close_ts', np.nan)
+        grow('realized_pnl', 0.0)
+        grow('turnover', 0.0)
+        grow('fees', 0.0)
+        grow('slippage', 0.0)  # Σ Δqty × (exec price - close)
+        grow('n_trades', 0, dtype=np.int64)
+        grow('n_bars', 0, dtype=np.int64)
+        grow('tg', 0.0, shape=(len(TG_FIELDS),))
+        grow('tg_mask', 0, dtype=np.uint8)  # bit i ↔ TG_FIELDS[i] present (wire_format.TG_DTYPE)
+        grow('tg_ts', 0.0)  # epoch seconds of last TG update
+        grow('closes', 0.0, shape=(self.window,))
+        grow('n_closes', 0, dtype=np.int64)
+        grow('last_seen', 0.0)
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def row(self, key: str) -> int:
+        r = self.index.get(key)
+        if r is None:
+            r = len(self.keys)
+            if r >= self.capacity:
+                self._alloc(self.capacity * 2)
+            self.index[key] = r
+            self.keys.append(key)
+            self.last_seen[r] = time.time()
+            if self.on_new is not None:
+                self.on_new(key, r)
+        return r
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        return np.fromiter((self.row(k) for k in keys), dtype=np.int64, count=len(keys))
+
+    def push_closes(self, rows: np.ndarray, closes: np.ndarray):
+        """Append one close per row into the ring buffer (rows must be unique)."""
+        self.closes[rows, self.n_closes[rows] % self.window] = closes
+        self.n_closes[rows] += 1
+
+    def returns(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Simple returns over the ring window, oldest → newest, left-aligned and zero-padded
+        to window-1 columns (same layout the old per-asset deque produced).
+        """
+        w = self.window
+        n = np.minimum(self.n_closes[rows], w)
+        start = (self.n_closes[rows] - n) % w
+        j = np.arange(w)
+        ordered = self.closes[rows[:, None], (start[:, None] + j) % w]
+        prev, cur = ordered[:, :-1], ordered[:, 1:]
+        valid = (j[1:] < n[:, None]) & (prev != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(valid, cur / prev - 1.0, 0.0)
+
+    def target_qty(self, rows: np.ndarray, target_pos: np.ndarray, closes: np.ndarray,
+                   notional: float = 0.0) -> np.ndarray:
+        """Base quantity after the bar: resized to target_pos × unit on a signal switch, else kept."""
+        unit = notional / closes if notional > 0 else 1.0
+        return np.where(target_pos != self.position[rows], target_pos * unit, self.qty[rows])
+
+    def settle(self, rows: np.ndarray, closes: np.ndarray, target_pos: np.ndarray,
+               ts_close: np.ndarray, fee_rate: float, notional: float = 0.0,
+               exec_price: Optional[np.ndarray] = None):
+        """
+        Mark existing positions to the new close, trade to target_pos at exec_price (default:
+        the close), charge fees on the traded notional and the execution cost vs the close.
+        """
+        prev = self.last_close[rows]
+        pos = self.position[rows]
+        qty = self.qty[rows]
+        pnl = np.where(np.isnan(prev), 0.0, (closes - prev) * qty)
+        new_qty = self.target_qty(rows, target_pos, closes, notional)
+        dq = new_qty - qty
+        px = closes if exec_price is None else exec_price
+        turnover = np.abs(dq) * px  # |Δqty| * price (1 base unit per position without POSITION_NOTIONAL)
+        fees = fee_rate * turnover
+        slippage = dq * (px - closes)
+        self.realized_pnl[rows] += pnl - fees - slippage
+        self.turnover[rows] += turnover
+        self.fees[rows] += fees
+        self.slippage[rows] += slippage
+        self.n_trades[rows] += target_pos != pos
+        self.n_bars[rows] += 1
+        self.position[rows] = target_pos
+        self.qty[rows] = new_qty
+        self.last_close[rows] = closes
+        self.last_close_ts[rows] = ts_close
+
+# ------------------- Feature engine -------------------
+class FeatureEngine:
+    """
+    Incremental rolling kline features, O(1) per update per symbol (rows shared with AssetStore).
+    Running sums over ring buffers give rolling mean/variance without rescanning the window;
+    the sums are re-synced from the ring once per wrap to keep float drift bounded.
+    Features (all scale-free):
+    - ret_mean, ret_std: rolling mean / std (ddof=1) of simple returns over `window`
+    - zscore:   (close - rolling mean close) / rolling std close
+    - ema_dev:  close / EMA(close, span) - 1
+    - atr_pct:  Wilder ATR(period) from high/low/close, divided by close
+    - vwap_dev: close / rolling VWAP - 1, VWAP = Σ quoteVolume / Σ (quoteVolume / vwapApprox)
+    """
+    NAMES = ("ret_mean", "ret_std", "zscore", "ema_dev", "atr_pct", "vwap_dev")
+
+    def __init__(self, capacity: int = 256, window: int = FEAT_WINDOW, ema_span: int = EMA_SPAN,
+                 atr_period: int = ATR_PERIOD):
+        self.window = max(2, int(window))
+        self.alpha = 2.0 / (ema_span + 1.0)
+        self.atr_period = float(atr_period)
+        self.capacity = 0
+        self._alloc(max(1, int(capacity)))
+
+    def _alloc(self, capacity: int):
+        n, w = self.capacity, self.window
+        self._fills = {}
 
+        def grow(name, fill, shape=(), dtype=np.float64):
+            new = np.full((capacity,) + shape, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:n] = old[:n]
+            setattr(self, name, new)
+            self._fills[name] = fill
+
+        for name in ("ret", "close", "qv", "bv"):
+            grow(f"{name}_buf", 0.0, shape=(w,))
+            grow(f"{name}_sum", 0.0)
+        grow("ret_sq", 0.0)
+        grow("close_sq", 0.0)
+        grow("n_close", 0, dtype=np.int64)
+        grow("n_ret", 0, dtype=np.int64)
+        grow("prev_close", np.nan)
+        grow("ema", np.nan)
+        grow("atr", np.nan)
+        grow("out", 0.0, shape=(len(self.NAMES),))  # latest feature row per symbol
+        self.capacity = capacity
+
+    def _roll(self, name: str, rows: np.ndarray, count: np.ndarray, x: np.ndarray, sq: bool = False):
+        """Push x into ring `name` at position count % window, updating running sum (and sum of squares)."""
+        w = self.window
+        buf, s = getattr(self, f"{name}_buf"), getattr(self, f"{name}_sum")
+        slot = count % w
+        old = np.where(count >= w, buf[rows, slot], 0.0)
+        buf[rows, slot] = x
+        s[rows] += x - old
+        q = getattr(self, f"{name}_sq") if sq else None
+        if q is not None:
+            q[rows] += x * x - old * old
+        wrap = rows[slot == w - 1]
+        if len(wrap):  # ring full turn → exact re-sync
+            s[wrap] = buf[wrap].sum(axis=1)
+            if q is not None:
+                q[wrap] = np.square(buf[wrap]).sum(axis=1)
+
+    def _mean_std(self, name: str, rows: np.ndarray, cnt: np.ndarray):
+        c = np.maximum(cnt, 1).astype(np.float64)
+        mean = getattr(self, f"{name}_sum")[rows] / c
+        ss = getattr(self, f"{name}_sq")[rows] - c * mean * mean
+        var = np.where(cnt > 1, np.maximum(ss, 0.0) / np.maximum(c - 1.0, 1.0), 0.0)
+        return mean, np.sqrt(var)
+
+    def update(self, rows: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+               quote_volume: np.ndarray, vwap: np.ndarray) -> np.ndarray:
+        """One new closed bar per row (rows unique) → (len(rows) × len(NAMES)) feature matrix."""
+        if len(rows) and rows.max() >= self.capacity:
+            cap = self.capacity
+            while cap <= rows.max():
+                cap *= 2
+            self._alloc(cap)
+        w = self.window
+        prev = self.prev_close[rows]
+
+        # returns (first bar of a symbol has none)
+        has_ret = ~np.isnan(prev) & (prev != 0)
+        r_rows = rows[has_ret]
+        self._roll("ret", r_rows, self.n_ret[r_rows], close[has_ret] / prev[has_ret] - 1.0, sq=True)
+        self.n_ret[r_rows] += 1
+
+        n_close = self.n_close[rows]
+        self._roll("close", rows, n_close, close, sq=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base_vol = np.where(vwap > 0, quote_volume / vwap, 0.0)
+        self._roll("qv", rows, n_close, np.where(vwap > 0, quote_volume, 0.0))
+        self._roll("bv", rows, n_close, base_vol)
+        self.n_close[rows] += 1
+
+        # EMA / Wilder ATR (seeded with the first value)
+        ema = self.ema[rows]
+        ema = np.where(np.isnan(ema), close, ema + self.alpha * (close - ema))
+        self.ema[rows] = ema
+        tr = np.where(np.isnan(prev), high - low,
+                      np.maximum(high - low, np.maximum(np.abs(high - prev), np.abs(low - prev))))
+        atr = self.atr[rows]
+        atr = np.where(np.isnan(atr), tr, atr + (tr - atr) / self.atr_period)
+        self.atr[rows] = atr
+        self.prev_close[rows] = close
+
+        ret_mean, ret_std = self._mean_std("ret", rows, np.minimum(self.n_ret[rows], w))
+        c_mean, c_std = self._mean_std("close", rows, np.minimum(self.n_close[rows], w))
+        bv_sum = self.bv_sum[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            feats = np.stack([
+                ret_mean,
+                ret_std,
+                np.where(c_std > 0, (close - c_mean) / c_std, 0.0),
+                np.where(ema != 0, close / ema - 1.0, 0.0),
+                np.where(close != 0, atr / close, 0.0),
+                np.where(bv_sum > 0, close / (self.qv_sum[rows] / bv_sum) - 1.0, 0.0),
+            ], axis=1)
+        feats = np.nan_to_num(feats, nan=0.0, posinf=0.0, neginf=0.0)
+        self.out[rows] = feats
+        return feats
+
+# --------------------- Feature utils ------------------
 
 def decay_weight(now_ts: float, last_ts: float, tau_sec: float = TAU_SEC) -> float:
     if last_ts <= 0 or now_ts <= last_ts:
@@ -129,54 +430,148 @@ def decay_weight(now_ts: float, last_ts: float, tau_sec: float = TAU_SEC) -> flo
     return math.exp(-dt / tau_sec)
 
 
-def build_observation(asset: AssetState, now_ts: float, kline_feats: Optional[list] = None,
-                      event_type: int = 0, trade_allowed: int = 0, last_close_ts: Optional[float] = None) -> list:
+class ObsLayout:
     """
-    Build Tier-0 observation (fixed-size vector).
-    - TG part: last snapshot **without** value decay (we add staleness as separate features)
-    - KLINE part: simple return features (if provided), else zeros
+    Observation vector layout, compiled once per TraderConfig (see TraderConfig.layout):
+
+        [TG_FIELDS | ret_1..ret_W | FeatureEngine.NAMES | (TICK_NAMES) | is_tg, is_kline, trade_allowed,
+         dt_tg_min, dt_close_min]
+
+    - TG part: last snapshot **without** value decay (we add staleness as separate features);
+      with tg_decay on, values are decayed by staleness instead (gpt_shit.py variant)
+    - KLINE part: RET_WINDOW simple returns + FeatureEngine.NAMES (if provided), else zeros
+    - TICK part (only with tick_feats): rolling trade / liquidation features at the close (ticks.py)
     - Meta: one_hot(event_type), trade_allowed, age metrics
-    event_type: 0=TG, 1=KLINE_CLOSE
+    write()/write_batch() fill a preallocated float32 buffer in place; policies look features up
+    by name (layout.index['coinChange24h']) instead of hard-coded positions.
     """
-    tg = asset.tg
-
-    def to_num(x):
-        v = _to_float(x)
-        return 0.0 if v is None else float(v)
-
-    # RAW TG values (no decay). We let the model see staleness via dt_* features instead.
-    tg_part = [
-        to_num(tg.openInterest),
-        to_num(tg.volume),
-        to_num(tg.trades8h),
-        to_num(tg.oiChange4h),
-        to_num(tg.coinChange24h),
-        to_num(tg.notificationsCount8h),
-    ]
-
-    if kline_feats is None:
-        kline_part = [0.0] * (RET_WINDOW)  # returns placeholder
-    else:
-        kline_part = kline_feats
-        if len(kline_part) < RET_WINDOW:
-            kline_part = kline_part + [0.0] * (RET_WINDOW - len(kline_part))
+    DTYPE = np.float32
+    META = ("is_tg", "is_kline", "trade_allowed", "dt_tg_min", "dt_close_min")
+
+    def __init__(self, ret_window: int = RET_WINDOW, tau_sec: Optional[float] = None, ticks: bool = False):
+        self.tau_sec = tau_sec  # None → raw TG values
+        self.names = (TG_FIELDS + tuple(f"ret_{i + 1}" for i in range(ret_window))
+                      + FeatureEngine.NAMES + (TICK_NAMES if ticks else ()) + self.META)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.dim = len(self.names)
+        k = len(TG_FIELDS)
+        self.kline_dim = ret_window + len(FeatureEngine.NAMES)
+        self.tg = slice(0, k)
+        self.kline = slice(k, k + self.kline_dim)
+        self.tick = slice(k + self.kline_dim, k + self.kline_dim + len(TICK_NAMES)) if ticks else None
+        self.meta = self.index["is_tg"]
+
+    @classmethod
+    def from_config(cls, cfg: "TraderConfig") -> "ObsLayout":
+        return cls(cfg.ret_window, cfg.tau_sec if cfg.tg_decay else None, cfg.tick_feats)
+
+    def buffer(self, n: Optional[int] = None) -> np.ndarray:
+        return np.zeros(self.dim if n is None else (n, self.dim), dtype=self.DTYPE)
+
+    def write(self, out: np.ndarray, store: AssetStore, row: int, now_ts: float,
+              kline_feats: Optional[np.ndarray] = None, event_type: int = 0, trade_allowed: int = 0,
+              last_close_ts: Optional[float] = None, tick_feats: Optional[np.ndarray] = None) -> np.ndarray:
+        """One observation into `out` (a layout.buffer() or one row of a batch matrix)."""
+        tg_ts = float(store.tg_ts[row])
+        if self.tau_sec is None:
+            out[self.tg] = store.tg[row]
         else:
-            kline_part = kline_part[:RET_WINDOW]
+            out[self.tg] = store.tg[row] * decay_weight(now_ts, tg_ts, self.tau_sec)
+        kl = out[self.kline]
+        if kline_feats is None:
+            kl[:] = 0.0
+        else:
+            m = min(self.kline_dim, len(kline_feats))
+            kl[:m] = kline_feats[:m]
+            kl[m:] = 0.0
+        if self.tick is not None:
+            out[self.tick] = 0.0 if tick_feats is None else tick_feats
+        k = self.meta
+        out[k] = 1.0 if event_type == 0 else 0.0
+        out[k + 1] = 0.0 if event_type == 0 else 1.0
+        out[k + 2] = trade_allowed
+        out[k + 3] = 0.0 if tg_ts <= 0 else max(0.0, (now_ts - tg_ts) / 60.0)
+        out[k + 4] = 0.0 if last_close_ts is None else max(0.0, (now_ts - last_close_ts) / 60.0)
+        return out
+
+    def write_batch(self, out: np.ndarray, store: AssetStore, rows: np.ndarray, now_ts: np.ndarray,
+                    kline_feats: Optional[np.ndarray] = None, event_type: int = 1,
+                    trade_allowed: int = 1, tick_feats: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Same layout for many rows → out[:len(rows)] (N × dim).
+        Age features are taken from store.last_close_ts, so call it before settling the bar.
+        """
+        n = len(rows)
+        out = out[:n]
+        tg_ts = store.tg_ts[rows]
+        out[:, self.tg] = store.tg[rows]
+        if self.tau_sec is not None:
+            # vectorized decay_weight
+            age = np.maximum(now_ts - tg_ts, 0.0)
+            out[:, self.tg] *= np.where(tg_ts <= 0, 0.0, np.exp(-age / self.tau_sec))[:, None]
+        if kline_feats is None:
+            out[:, self.kline] = 0.0
+        else:
+            m = min(self.kline_dim, kline_feats.shape[1])
+            out[:, self.kline.start:self.kline.start + m] = kline_feats[:, :m]
+            out[:, self.kline.start + m:self.kline.stop] = 0.0
+        if self.tick is not None:
+            out[:, self.tick] = 0.0 if tick_feats is None else tick_feats
+        k = self.meta
+        out[:, k] = 1.0 if event_type == 0 else 0.0
+        out[:, k + 1] = 0.0 if event_type == 0 else 1.0
+        out[:, k + 2] = trade_allowed
+        out[:, k + 3] = np.where(tg_ts <= 0, 0.0, np.maximum(0.0, (now_ts - tg_ts) / 60.0))
+        last_close_ts = store.last_close_ts[rows]
+        out[:, k + 4] = np.where(np.isnan(last_close_ts), 0.0, np.maximum(0.0, (now_ts - last_close_ts) / 60.0))
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def _layout(cfg: "TraderConfig") -> ObsLayout:
+    return ObsLayout.from_config(cfg)
+
 
-    # meta
-    one_hot = [1.0, 0.0] if event_type == 0 else [0.0, 1.0]
-    dt_tg_min = 0.0 if tg.ts <= 0 else max(0.0, (now_ts - tg.ts) / 60.0)
-    dt_close_min = 0.0 if last_close_ts is None else max(0.0, (now_ts - last_close_ts) / 60.0)
+def build_observation(store: AssetStore, row: int, now_ts: float, kline_feats: Optional[np.ndarray] = None,
+                      event_type: int = 0, trade_allowed: int = 0, last_close_ts: Optional[float] = None,
+                      layout: Optional[ObsLayout] = None, out: Optional[np.ndarray] = None,
+                      tick_feats: Optional[np.ndarray] = None) -> np.ndarray:
+    """Tier-0 observation for one AssetStore row (event_type: 0=TG, 1=KLINE_CLOSE), see ObsLayout."""
+    layout = layout or TraderConfig().layout
+    return layout.write(layout.buffer() if out is None else out, store, row, now_ts, kline_feats,
+                        event_type, trade_allowed, last_close_ts, tick_feats)
 
-    obs = tg_part + kline_part + one_hot + [float(trade_allowed), dt_tg_min, dt_close_min]
-    return obs
+KLINE_DIM = TraderConfig().kline_dim
+OBS_DIM = TraderConfig().obs_dim  # default config; per-config size is TraderConfig.obs_dim
+
+
+def build_observation_batch(store: AssetStore, rows: np.ndarray, now_ts: np.ndarray,
+                            kline_feats: Optional[np.ndarray] = None, event_type: int = 1,
+                            trade_allowed: int = 1, layout: Optional[ObsLayout] = None,
+                            out: Optional[np.ndarray] = None, tick_feats: Optional[np.ndarray] = None) -> np.ndarray:
+    """Same layout as build_observation, for many rows at once → (N × obs_dim) float32 matrix."""
+    layout = layout or TraderConfig().layout
+    return layout.write_batch(layout.buffer(len(rows)) if out is None else out, store, rows, now_ts,
+                              kline_feats, event_type, trade_allowed, tick_feats)
 
 # ----------------------- Policy -----------------------
 class Policy:
     """Interface for a trading policy. Replace with your SB3/FinRL model later."""
-    def predict(self, obs: list) -> int:
+    # recurrent/memory policies set this to get observe() called with every TG-event observation;
+    # otherwise TG snapshots are coalesced per symbol and no observation is built for them
+    wants_tg_obs = False
+
+    def __init__(self, cfg: Optional[TraderConfig] = None):
+        self.cfg = cfg or TraderConfig()
+        self.layout = self.cfg.layout
+        self._coin_change = self.layout.index["coinChange24h"]
+
+    def observe(self, obs: np.ndarray):
+        """Non-trading observation (TG event, trade_allowed=0). Only called if wants_tg_obs."""
+
+    def predict(self, obs: np.ndarray) -> int:
         # Default heuristic: BUY if decayed coinChange24h > 0, SELL if <0, else HOLD
-        coin_change = obs[4]  # index per build_observation tg_part[4]
+        coin_change = obs[self._coin_change]
         if coin_change > 0:
             return 2  # BUY
         elif coin_change < 0:
@@ -184,163 +579,632 @@ class Policy:
         else:
             return 1  # HOLD
 
+    def predict_batch(self, obs: np.ndarray) -> np.ndarray:
+        """(N × obs_dim) float32 → N actions. Override with a vectorized model call.
+        obs is a reused buffer: copy it if you need to keep it past the call."""
+        return (np.sign(obs[:, self._coin_change]) + 1).astype(np.int64)
+
+
+class MomentumPolicy(Policy):
+    """Follow the sign of the rolling mean return (FeatureEngine ret_mean)."""
+    def predict(self, obs: np.ndarray) -> int:
+        return int(self.predict_batch(obs[None])[0])
+
+    def predict_batch(self, obs: np.ndarray) -> np.ndarray:
+        ret_mean = obs[:, self.layout.index["ret_mean"]]
+        return (np.sign(ret_mean) + 1).astype(np.int64)
+
+
+class ModelPolicy(Policy):
+    """
+    Model from model_registry (POLICY_MODEL, loaded + warmed once per process, hot-swapped on change).
+    Model output: N actions, or N × 3 scores/logits for SELL/HOLD/BUY → argmax.
+    """
+    name = "policy"
+
+    def __init__(self, cfg: Optional[TraderConfig] = None, path: str = POLICY_MODEL, registry=REGISTRY):
+        super().__init__(cfg)
+        self.registry = registry
+        if self.name not in registry:
+            if not path:
+                raise ValueError("POLICY=model needs POLICY_MODEL=/path/to/model")
+            registry.load(self.name, path, dim=self.layout.dim)
+        registry.start_watch()
+
+    def predict(self, obs: np.ndarray) -> int:
+        return int(self.predict_batch(obs[None])[0])
+
+    def predict_batch(self, obs: np.ndarray) -> np.ndarray:
+        out = self.registry.get(self.name)(obs)
+        if out.ndim == 2 and out.shape[1] > 1:
+            return out.argmax(axis=1)
+        return out.reshape(len(obs)).astype(np.int64)
+
+
+POLICIES = {
+    "coin_change": Policy,
+    "momentum": MomentumPolicy,
+    "model": ModelPolicy,
+}
+
 # -------------------- Paper Trader --------------------
 class PaperTrader:
-    def __init__(self, fee_bps: float = FEE_BPS):
-        self.assets: Dict[str, AssetState] = {}
-        self.policy = Policy()
-        self.last_close_ts: Dict[str, float] = {}
-        self.fee_bps = fee_bps
+    def __init__(self, fee_bps: Optional[float] = None, verbose: bool = True,
+                 config: Optional[TraderConfig] = None):
+        cfg = config or TraderConfig()
+        if fee_bps is not None:
+            cfg = replace(cfg, fee_bps=fee_bps)
+        self.cfg = cfg
+        self.assets = AssetStore(window=cfg.ret_window + 1)
+        self.features = FeatureEngine(window=cfg.feat_window, ema_span=cfg.ema_span, atr_period=cfg.atr_period)
+        self.policy = POLICIES[cfg.policy](cfg)
+        self.layout = cfg.layout
+        self._obs = self.layout.buffer()  # reused per single-message observation
+        self._obs_batch = self.layout.buffer(256)  # grows by doubling, rows [:n] used per bar
+        self.fee_bps = cfg.fee_bps
+        self.fills = FillSimulator()  # per-symbol books; fills at the close until one arrives
+        self.ticks = TickAggregator(self.assets) if cfg.tick_feats else None  # trade / liquidation windows
+        self.universe = Universe(self, spill_dir="")  # eviction runs from Runner; spill dir set there
+        self.verbose = verbose  # per-bar decision events (console/trade journal via logsink); off for replay
+        self.log = LOG if verbose else None
         self.lock = threading.Lock()
+        self.stats = {name: StageStats(name) for name in ("feature", "observe", "decide", "ledger")}
+        self._tg_pending: Dict[str, tuple] = {}  # key → (msg, recv_ts), latest TG snapshot not yet applied
+        self.tg_received = 0
+        self.tg_coalesced = 0
+        self.checkpoint = None  # checkpoint.Checkpointer: gets every TG write and settled bar
+        self.timeframe = "1m"  # bar timeframe it decides on, `tf` of its journal rows (Runner: BAR_TIMEFRAMES)
+        self.tap = None  # tap(rows, obs, actions) after each settled decide_rows batch (export.py)
 
-    def get_asset(self, key: str) -> AssetState:
-        if key not in self.assets:
-            self.assets[key] = AssetState(key=key)
-        return self.assets[key]
-
-    def _fees(self, turnover_qty_value: float) -> float:
-        # fee in value terms (bps of traded notional)
-        return (self.fee_bps / 1e4) * turnover_qty_value
+    @staticmethod
+    def _key(msg: dict) -> str:
+        return f"{msg.get('exchange')}:{msg.get('token')}"
 
     def on_tg(self, msg: dict):
-        key = f"{msg.get('exchange')}:{msg.get('token')}"
-        now_ts = float(msg.get('ts') or time.time())
-        a = self.get_asset(key)
-        a.tg = TGFeatures(
-            openInterest=_to_float(msg.get('openInterest')),
-            volume=_to_float(msg.get('volume')),
-            trades8h=_to_float(msg.get('trades8h')),
-            oiChange4h=_to_float(msg.get('oiChange4h')),
-            coinChange24h=_to_float(msg.get('coinChange24h')),
-            notificationsCount8h=_to_float(msg.get('notificationsCount8h')),
-            ts=now_ts,
-        )
-        # Build observation for TG event (trade_allowed=0) — feeding memory if you switch to RNN in future
-        _obs = build_observation(a, now_ts, kline_feats=None, event_type=0, trade_allowed=0,
-                                 last_close_ts=self.last_close_ts.get(key))
-        # We do NOT trade on TG events; no action taken.
+        self.tg_received += 1
+        if not self.policy.wants_tg_obs:
+            # We do NOT trade on TG events: keep the latest snapshot per symbol, apply before the next decision
+            key = self._key(msg)
+            self.tg_coalesced += key in self._tg_pending
+            self._tg_pending[key] = (msg, time.time())
+            return
+        key = self._key(msg)
+        now_ts, mask, values = decode_tg(msg, time.time())
+        st = self.assets
+        r = st.row(key)
+        if self.checkpoint is not None:
+            self.checkpoint.log_tg(np.array([r]), values[None], np.array([mask]), np.array([now_ts]))
+        st.tg[r] = values
+        st.tg_mask[r] = mask
+        st.tg_ts[r] = now_ts
+        st.last_seen[r] = time.time()
+        # Build observation for TG event (trade_allowed=0) — feeds the policy's memory
+        last_close_ts = st.last_close_ts[r]
+        obs = self.layout.write(self._obs, st, r, now_ts, kline_feats=None, event_type=0, trade_allowed=0,
+                                last_close_ts=None if np.isnan(last_close_ts) else float(last_close_ts))
+        self.policy.observe(obs)
+
+    def flush_tg(self):
+        """Write the coalesced TG snapshots into the store (one row per symbol, however many messages)."""
+        if not self._tg_pending:
+            return
+        pending, self._tg_pending = self._tg_pending, {}
+        msgs, recv_ts = zip(*pending.values())
+        recs = decode_tg_batch(list(msgs), default_ts=recv_ts)
+        self.set_tg_rows(self.assets.rows(list(pending)), recs['values'], recs['ts'], mask=recs['mask'])
+
+    def set_tg_rows(self, rows: np.ndarray, values: np.ndarray, ts: np.ndarray, mask: Optional[np.ndarray] = None):
+        """
+        Vectorized TG snapshot write (rows unique). Without `mask`, values use NaN = missing
+        (replay / recorder arrays) and the bitmask is derived from them.
+        """
+        st = self.assets
+        if mask is None:
+            present = ~np.isnan(values)
+            mask = (present << np.arange(len(TG_FIELDS))).sum(axis=1)
+            values = np.where(present, values, 0.0)
+        if self.checkpoint is not None:
+            self.checkpoint.log_tg(rows, values, mask, ts)
+        st.tg[rows] = values
+        st.tg_mask[rows] = mask
+        st.tg_ts[rows] = ts
+        st.last_seen[rows] = time.time()
+
+    def on_tick(self, msg: dict):
+        """Single JSON trade / liquidation; buffered and folded into the windows as one batch."""
+        if self.ticks is not None:
+            self.ticks.on_message(msg)
+
+    def on_tick_records(self, recs: np.ndarray):
+        """Packed tick batch (wire_format.TICK_DTYPE)."""
+        if self.ticks is not None:
+            self.ticks.add_records(recs)
+
+    def _tick_feats(self, rows: np.ndarray, ts_close: np.ndarray) -> Optional[np.ndarray]:
+        return None if self.ticks is None else self.ticks.features(rows, ts_close)
+
+    def on_book(self, msg: dict):
+        """depth snapshot / depth diff / book ticker → cached book used to price the next fills."""
+        self.fills.on_message(msg)
+
+    def _exec_prices(self, rows: np.ndarray, closes: np.ndarray, target_pos: np.ndarray) -> Optional[np.ndarray]:
+        """Book VWAP for the rows that trade this bar; None (= close) while no book is cached."""
+        if not self.fills.books:
+            return None
+        st = self.assets
+        dq = st.target_qty(rows, target_pos, closes, self.cfg.position_notional) - st.qty[rows]
+        px = closes.copy()
+        traded = np.flatnonzero(dq)
+        if len(traded):
+            px[traded] = self.fills.exec_prices([st.keys[r] for r in rows[traded]], dq[traded], closes[traded])
+        return px
 
     def on_kline_close(self, msg: dict):
-        key = f"{msg.get('exchange')}:{msg.get('token')}"
-        a = self.get_asset(key)
+        key = self._key(msg)
+        st = self.assets
+        r = st.row(key)
+        rows = np.array([r])
+        self.flush_tg()
         kl = KlineClose(
             open=float(msg['open']), high=float(msg['high']), low=float(msg['low']),
             close=float(msg['close']), volume=float(msg['volume']), ts_close=float(msg['ts_close'])
         )
 
-        # Feature: simple returns over last RET_WINDOW closes
-        if a.close_window.maxlen != RET_WINDOW+1:
-            a.close_window = deque(maxlen=RET_WINDOW+1)
-        a.close_window.append(kl.close)
-        rets = []
-        if len(a.close_window) >= 2:
-            closes = list(a.close_window)
-            for i in range(1, len(closes)):
-                prev = closes[i-1]
-                cur = closes[i]
-                rets.append(0.0 if prev == 0 else (cur/prev - 1.0))
+        # Features: simple returns over last RET_WINDOW closes (ring buffer in the store) + rolling stats
+        t0 = time.perf_counter()
+        st.push_closes(rows, np.array([kl.close]))
+        quote_volume = np.array([float(msg.get('quoteVolume') or 0.0)])
+        vwap = np.array([float(msg.get('vwapApprox') or 0.0)])
+        feats = self.features.update(rows, np.array([kl.high]), np.array([kl.low]), np.array([kl.close]),
+                                     quote_volume, vwap)
+        kline_feats = np.concatenate([st.returns(rows)[0], feats[0]])
+        t_obs = time.perf_counter()
         # Build observation for KLINE_CLOSE (trade_allowed=1)
-        obs = build_observation(a, kl.ts_close, kline_feats=rets, event_type=1, trade_allowed=1,
-                                last_close_ts=self.last_close_ts.get(key))
-
-        # Compute PnL from previous close to this close on existing position
-        if a.last_close is not None:
-            price_diff = kl.close - a.last_close
-            pnl = price_diff * a.position
-            a.realized_pnl += pnl
+        last_close_ts = st.last_close_ts[r]
+        tick_feats = self._tick_feats(rows, np.array([kl.ts_close]))
+        obs = self.layout.write(self._obs, st, r, kl.ts_close, kline_feats=kline_feats, event_type=1,
+                                trade_allowed=1,
+                                last_close_ts=None if np.isnan(last_close_ts) else float(last_close_ts),
+                                tick_feats=None if tick_feats is None else tick_feats[0])
+        t1 = time.perf_counter()
+
         # Decide new action
         action = self.policy.predict(obs)  # 0 sell, 1 hold, 2 buy
         target_pos = {-1: -1, 0: -1, 1: 0, 2: 1}[action]  # map 0/1/2 → -1/0/1
-        # Fees for turnover: |Δpos| * notional (we use close as 1x notional unit for demo)
-        turnover = abs(target_pos - a.position) * kl.close
-        fees = self._fees(turnover)
-        a.realized_pnl -= fees
-        # Apply new position
-        a.position = target_pos
-        a.last_close = kl.close
-        self.last_close_ts[key] = kl.ts_close
+        t2 = time.perf_counter()
+        logging = self.log is not None and self.log.enabled("decision")
+        prev = (st.position[rows], st.qty[rows]) if logging else None
+        # PnL from previous close on the existing position, turnover fees, then apply new position
+        closes = np.array([kl.close])
+        exec_price = self._exec_prices(rows, closes, np.array([target_pos]))
+        if self.checkpoint is not None:  # logged first: a failed write must not leave an unlogged settle
+            self.checkpoint.log_bar(rows, kl.close, kl.ts_close, kl.high, kl.low, quote_volume, vwap, target_pos,
+                                    closes if exec_price is None else exec_price)
+        st.settle(rows, closes, np.array([target_pos]), np.array([kl.ts_close]),
+                  fee_rate=self.fee_bps / 1e4, notional=self.cfg.position_notional, exec_price=exec_price)
+        st.last_seen[r] = time.time()
+        self._record_stages(t0, t_obs, t1, t2)
+
+        if logging:
+            self._log_decisions(rows, closes, np.array([kl.ts_close]), np.array([action]), prev, exec_price)
+
+    def on_kline_close_batch(self, msgs: List[dict]):
+        """Decide a whole bar (many symbols, same ts_close) with one Policy.predict_batch call."""
+        latest = {self._key(m): m for m in msgs}  # a symbol closing twice in one batch → keep last
+        if not latest:
+            return
+        keys = list(latest)
+        n = len(keys)
+
+        def col(field: str, default: Optional[float] = None) -> np.ndarray:
+            return np.fromiter((float(latest[k][field] if default is None else latest[k].get(field) or default)
+                                for k in keys), dtype=np.float64, count=n)
+
+        self._decide_bar(keys, dict(close=col('close'), ts_close=col('ts_close'), high=col('high'),
+                                    low=col('low'), quoteVolume=col('quoteVolume', 0.0),
+                                    vwapApprox=col('vwapApprox', 0.0)))
+
+    def on_kline_records(self, recs: np.ndarray):
+        """Packed binary batch (wire_format.KLINE_DTYPE) → same batched decision, no per-message dicts."""
+        recs = recs[recs['is_closed'] != 0]
+        if not len(recs):
+            return
+        keys = record_keys(recs)
+        last = {k: i for i, k in enumerate(keys)}  # duplicate symbol in one frame → keep last
+        if len(last) != len(keys):
+            idx = np.fromiter(last.values(), dtype=np.int64, count=len(last))
+            recs, keys = recs[idx], list(last)
+        self._decide_bar(keys, recs)
+
+    def on_bar(self, keys: List[str], bar):
+        """Aggregated higher-timeframe bar (bars.BarAggregator, unique keys) → batched decision."""
+        self._decide_bar(keys, bar)
+
+    def _decide_bar(self, keys: List[str], bar):
+        """bar: structured array or dict of columns (close, ts_close, high, low, quoteVolume, vwapApprox)."""
+        self.decide_rows(self.assets.rows(keys), bar)
+
+    def decide_rows(self, rows: np.ndarray, bar):
+        """Batched decision for unique AssetStore rows — entry point for replay, which maps keys once."""
+        self.flush_tg()
+        closes = np.asarray(bar['close'], dtype=np.float64)
+        ts_close = np.asarray(bar['ts_close'], dtype=np.float64)
+        st = self.assets
+        t0 = time.perf_counter()
+        high = np.asarray(bar['high'], dtype=np.float64)
+        low = np.asarray(bar['low'], dtype=np.float64)
+        quote_volume = np.asarray(bar['quoteVolume'], dtype=np.float64)
+        vwap = np.asarray(bar['vwapApprox'], dtype=np.float64)
+        st.push_closes(rows, closes)
+        feats = self.features.update(rows, high, low, closes, quote_volume, vwap)
+        t_obs = time.perf_counter()
+        if len(rows) > len(self._obs_batch):
+            self._obs_batch = self.layout.buffer(1 << (len(rows) - 1).bit_length())
+        obs = self.layout.write_batch(self._obs_batch, st, rows, ts_close,
+                                      kline_feats=np.hstack([st.returns(rows), feats]), event_type=1, trade_allowed=1,
+                                      tick_feats=self._tick_feats(rows, ts_close))
+        t1 = time.perf_counter()
+        actions = np.asarray(self.policy.predict_batch(obs), dtype=np.int64)
+        target_pos = np.clip(actions, 0, 2) - 1  # map 0/1/2 → -1/0/1
+        t2 = time.perf_counter()
+        logging = self.log is not None and self.log.enabled("decision")
+        prev = (st.position[rows], st.qty[rows]) if logging else None
+        exec_price = self._exec_prices(rows, closes, target_pos)
+        if self.checkpoint is not None:  # logged first: a failed write must not leave an unlogged settle
+            self.checkpoint.log_bar(rows, closes, ts_close, high, low, quote_volume, vwap, target_pos,
+                                    closes if exec_price is None else exec_price)
+        st.settle(rows, closes, target_pos, ts_close, fee_rate=self.fee_bps / 1e4,
+                  notional=self.cfg.position_notional, exec_price=exec_price)
+        st.last_seen[rows] = time.time()
+        self._record_stages(t0, t_obs, t1, t2)
+        if self.tap is not None:
+            self.tap(rows, obs, actions)
+
+        if logging:
+            self._log_decisions(rows, closes, ts_close, actions, prev, exec_price)
+
+    def _log_decisions(self, rows, closes, ts_close, actions, prev, exec_price=None):
+        """
+        One columnar 'decision' event per bar; fill = position change (0 → no trade),
+        qty = signed base quantity traded, exec_price = its price (book VWAP, else the close).
+        """
+        st = self.assets
+        prev_pos, prev_qty = prev
+        pos = st.position[rows]
+        self.log.emit_rows("decision", key=[st.keys[r] for r in rows], tf=[self.timeframe] * len(rows),
+                           ts_close=ts_close.copy(),
+                           close=closes.copy(), action=np.asarray(actions).copy(), pos=pos,
+                           fill=pos - prev_pos, qty=st.qty[rows] - prev_qty,
+                           exec_price=(closes if exec_price is None else exec_price).copy(),
+                           pnl=st.realized_pnl[rows])
 
-        print(f"[{time.strftime('%H:%M:%S')}] {key} close={kl.close:.6f} action={action} pos={a.position} PnL={a.realized_pnl:.6f}")
+    def _record_stages(self, t0: float, t_obs: float, t1: float, t2: float):
+        """feature = t0..t_obs, observe = ..t1, decide = ..t2, ledger = t2..now (one sample per bar batch)."""
+        self.stats["feature"].record(t_obs - t0)
+        self.stats["observe"].record(t1 - t_obs)
+        self.stats["decide"].record(t2 - t1)
+        self.stats["ledger"].record(time.perf_counter() - t2)
 
     def snapshot(self) -> Dict[str, dict]:
+        self.flush_tg()
+        st = self.assets
         out = {}
-        for k, a in self.assets.items():
-            out[k] = dict(position=a.position, last_close=a.last_close, pnl=a.realized_pnl,
-                          last_tg_ts=a.tg.ts)
+        for k, r in st.index.items():
+            last_close = st.last_close[r]
+            out[k] = dict(position=int(st.position[r]), last_close=None if np.isnan(last_close) else float(last_close),
+                          qty=float(st.qty[r]), pnl=float(st.realized_pnl[r]), last_tg_ts=float(st.tg_ts[r]),
+                          turnover=float(st.turnover[r]), fees=float(st.fees[r]),
+                          slippage=float(st.slippage[r]), trades=int(st.n_trades[r]),
+                          bars=int(st.n_bars[r]))
         return out
 
 # -------------------- ZMQ subscriber ------------------
 class ZMQSubscriber(threading.Thread):
-    def __init__(self, addr: str, topic: str, out_queue: "queue.Queue[dict]"):
+    """
+    Recv stage: raw frames go straight to out_queue, parsing happens in pipeline.ParseStage.
+    sock_type=zmq.PULL receives the same frames from a shard.ShardRouter instead of the publisher.
+    """
+    def __init__(self, addr: str, topic: str, out_queue: StageQueue, sock_type: int = zmq.SUB):
         super().__init__(daemon=True)
         self.addr = addr
         self.topic = topic.encode() if topic else None
         self.out_queue = out_queue
+        self.stats = StageStats("recv")  # time from frame received to handed off (includes blocking)
         self.ctx = zmq.Context.instance()
-        self.sock = self.ctx.socket(zmq.SUB)
+        self.sock = self.ctx.socket(sock_type)
         self.sock.connect(self.addr)
-        if self.topic is None:
-            self.sock.setsockopt(zmq.SUBSCRIBE, b"")
-        else:
-            self.sock.setsockopt(zmq.SUBSCRIBE, self.topic)
+        if sock_type == zmq.SUB:
+            for topic in ([b""] if self.topic is None else [self.topic, KLINE_BIN_TOPIC, TICK_BIN_TOPIC]):
+                self.sock.setsockopt(zmq.SUBSCRIBE, topic)
 
     def run(self):
         while True:
             try:
-                if self.topic is None:
-                    raw = self.sock.recv()
-                    payload = raw
-                else:
-                    topic, payload = self.sock.recv_multipart()
-                msg = self._parse(payload)
-                if msg:
-                    self.out_queue.put(msg)
+                # single frame (no topic) or [topic, payload]; copy=False keeps binary frames zero-copy
+                frames = self.sock.recv_multipart(copy=False)
+                recv_ts = time.time()
+                t0 = time.perf_counter()
+                self.out_queue.put((recv_ts, frames))
+                self.stats.record(time.perf_counter() - t0)
             except Exception as e:
                 print("ZMQ recv error:", e)
                 time.sleep(0.5)
 
+    @classmethod
+    def parse_frames(cls, frames) -> Optional[dict]:
+        if len(frames) >= 2 and frames[0].bytes == KLINE_BIN_TOPIC:
+            return {'type': 'kline_bin', 'records': decode_klines(frames[1].buffer)}
+        if len(frames) >= 2 and frames[0].bytes == TICK_BIN_TOPIC:
+            return {'type': 'tick_bin', 'records': decode_ticks(frames[1].buffer)}
+        return cls._parse(frames[-1].bytes)
+
     @staticmethod
     def _parse(payload: bytes) -> Optional[dict]:
         s = payload.decode('utf-8', errors='ignore').strip()
         try:
             return json.loads(s)
         except Exception:
+            # literal_eval is slow on garbage — only try it on something that looks like a dict repr
+            if not s.startswith('{'):
+                return None
             try:
                 return ast.literal_eval(s)
             except Exception:
                 return None
 
+# ------------------- Bar batcher ----------------------
+class BarBatcher:
+    """
+    Groups closed klines by ts_close. A bar is released `grace_sec` after its first
+    message arrived, so symbols that close on the same boundary go out as one batch.
+    """
+    def __init__(self, grace_sec: float = BAR_GRACE_MS / 1000.0):
+        self.grace_sec = grace_sec
+        self._pending: Dict[float, List[dict]] = {}
+        self._deadline: Dict[float, float] = {}
+
+    def add(self, msg: dict, now: Optional[float] = None):
+        ts_close = float(msg['ts_close'])
+        bar = self._pending.get(ts_close)
+        if bar is None:
+            bar = self._pending[ts_close] = []
+            self._deadline[ts_close] = (time.monotonic() if now is None else now) + self.grace_sec
+        bar.append(msg)
+
+    def time_to_flush(self, now: Optional[float] = None) -> float:
+        if not self._deadline:
+            return math.inf
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(self._deadline.values()) - now)
+
+    def pop_due(self, now: Optional[float] = None) -> List[List[dict]]:
+        now = time.monotonic() if now is None else now
+        due = sorted(ts for ts, dl in self._deadline.items() if dl <= now)
+        return [self._pop(ts) for ts in due]
+
+    def pop_all(self) -> List[List[dict]]:
+        return [self._pop(ts) for ts in sorted(self._pending)]
+
+    def _pop(self, ts_close: float) -> List[dict]:
+        del self._deadline[ts_close]
+        return self._pending.pop(ts_close)
+
 # ----------------------- Runner -----------------------
 class Runner:
-    def __init__(self):
-        self.q: "queue.Queue[dict]" = queue.Queue(maxsize=100000)
-        self.sub = ZMQSubscriber(ZMQ_SUB_ADDR, ZMQ_TOPIC, self.q)
+    """
+    Single-process trader. As shard i of shard.py it pulls its symbols from the router at
+    `addr`, keeps recorder/checkpoint files in a shard-i subdirectory and answers portfolio
+    requests on `ctl_addr` from the decision loop (so replies see a consistent state).
+    """
+    def __init__(self, addr: str = ZMQ_SUB_ADDR, shard: Optional[int] = None, ctl_addr: Optional[str] = None):
+        self.name = "Runner" if shard is None else f"shard {shard}"
+        self.shard = shard
+        self.addr = addr
+        sub_dir = (lambda root: root) if shard is None else (lambda root: os.path.join(root, f"shard-{shard}"))
+        self.raw_q = StageQueue("raw_q")
+        self.q = StageQueue("event_q")  # coalesce: latest tg/kline per symbol replaces a pending one
+        self.sub = ZMQSubscriber(addr, ZMQ_TOPIC, self.raw_q, sock_type=zmq.SUB if shard is None else zmq.PULL)
+        self.recorder = EventRecorder(sub_dir(RECORD_DIR)) if RECORD_DIR else None
+        # recorder sees every parsed event, also those coalesced away before the decision stage
+        self.parser = ParseStage(self.raw_q, self.q, ZMQSubscriber.parse_frames,
+                                 on_event=self.recorder.record if self.recorder is not None else None)
         self.trader = PaperTrader()
+        if UNIVERSE_SPILL_DIR:
+            self.trader.universe = Universe(self.trader, spill_dir=sub_dir(UNIVERSE_SPILL_DIR))
+        self.checkpoint = self._restore(self.trader, sub_dir(CKPT_DIR)) if CKPT_DIR else None
+        self.batcher = BarBatcher() if BAR_BATCH else None
+        # higher timeframes: one trader each, fed from the 1m closes; books are shared
+        self.bars = BarAggregator.from_env(self._on_tf_bar)
+        self.tf_traders: Dict[int, PaperTrader] = {}
+        for sec in self.bars.timeframes if self.bars is not None else ():
+            label = timeframe_label(sec)
+            trader = self.tf_traders[sec] = PaperTrader()
+            trader.timeframe = label
+            trader.fills = self.trader.fills
+            trader.universe = Universe(trader, drop_books=False, spill_dir=os.path.join(
+                sub_dir(UNIVERSE_SPILL_DIR), label) if UNIVERSE_SPILL_DIR else "")
+            if CKPT_DIR:
+                self._restore(trader, os.path.join(sub_dir(CKPT_DIR), label))
+        if self.bars is not None:
+            for trader in (self.trader, *self.tf_traders.values()):
+                trader.universe.on_evict.append(self._drop_bars)
+        self.stats = StageStats("dispatch")
+        self.tracer = LagTracer()
+        self.metrics_port = METRICS_PORT if shard is None else 0  # shards: aggregated by the router
+        self._metrics: dict = {}  # what the HTTP thread serves; only this thread replaces it
+        self.ctl = None
+        if ctl_addr:
+            self.ctl = zmq.Context.instance().socket(zmq.REP)
+            self.ctl.bind(ctl_addr)
         self._stop = False
 
     def start(self):
         self.sub.start()
-        signal.signal(signal.SIGINT, self._sig)
+        self.parser.start()
+        if self.metrics_port:
+            self._metrics = self.metrics()
+            serve_metrics(lambda: self._metrics, self.metrics_port)  # copy rebuilt by this thread below
+        if self.recorder is not None:
+            self.recorder.start()
+        # shard processes share the terminal's Ctrl-C; the supervisor stops them (SIGTERM) after the router
+        signal.signal(signal.SIGINT, self._sig if self.shard is None else signal.SIG_IGN)
         signal.signal(signal.SIGTERM, self._sig)
-        print(f"[Runner] Listening {ZMQ_SUB_ADDR} topic='{ZMQ_TOPIC or '*'}'")
+        print(f"[{self.name}] Listening {self.addr} topic='{ZMQ_TOPIC or '*'}'"
+              + (f" bar-batch grace={BAR_GRACE_MS:.0f}ms" if self.batcher else "")
+              + f" overflow={self.q.overflow} qsize={self.q.maxsize}"
+              + (f" metrics=http://127.0.0.1:{self.metrics_port}/metrics" if self.metrics_port else ""))
+        next_stats = time.monotonic() + PIPE_STATS_SEC
+        next_flush = time.monotonic() + 1.0
+        next_metrics = time.monotonic() + METRICS_REFRESH_SEC
         while not self._stop:
+            timeout = 0.5 if self.batcher is None else min(0.5, self.batcher.time_to_flush())
+            if self.metrics_port:
+                timeout = max(0.0, min(timeout, next_metrics - time.monotonic()))
             try:
-                msg = self.q.get(timeout=0.5)
+                msg = self.q.get(timeout=timeout)
             except queue.Empty:
-                continue
-            mtype = str(msg.get('type', '')).lower()
-            if mtype == 'tg':
-                self.trader.on_tg(msg)
-            elif mtype == 'kline':
-                # only process closed klines
-                is_closed = bool(msg.get('is_closed', True))
-                if is_closed:
+                pass
+            else:
+                self._guarded(self._dispatch, msg)
+            if self.batcher is not None:
+                for bar in self.batcher.pop_due():
+                    self._guarded(self._on_bar_batch, bar)
+            if self.bars is not None and time.monotonic() >= next_flush:
+                self.bars.flush(time.time())  # symbols that stopped closing 1m bars
+                next_flush = time.monotonic() + 1.0
+            for trader in (self.trader, *self.tf_traders.values()):
+                trader.universe.maybe_evict()
+            for trader in (self.trader, *self.tf_traders.values()):
+                if trader.checkpoint is not None:
+                    trader.checkpoint.maybe_snapshot()
+            if self.ctl is not None:
+                self._serve_ctl()
+            if self.metrics_port and time.monotonic() >= next_metrics:
+                self._metrics = self.metrics()
+                next_metrics = time.monotonic() + METRICS_REFRESH_SEC
+            if time.monotonic() >= next_stats:
+                print(f"[{self.name}] pipeline", self.stats_line())
+                next_stats = time.monotonic() + PIPE_STATS_SEC
+        if self.batcher is not None:
+            for bar in self.batcher.pop_all():
+                self.trader.on_kline_close_batch(bar)
+        for trader in (self.trader, *self.tf_traders.values()):
+            if trader.checkpoint is not None:
+                trader.checkpoint.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        LOG.close()
+
+    def metrics(self) -> dict:
+        return collect([self.raw_q, self.q], [self.sub.stats, self.parser.stats, self.stats,
+                                              *self.trader.stats.values(), *self.tracer.stages()],
+                       tg=dict(n=self.trader.tg_received, coal=self.trader.tg_coalesced),
+                       fills=self.trader.fills.summary(), universe=self.trader.universe.summary(),
+                       **(dict(ticks=self.trader.ticks.summary()) if self.trader.ticks is not None else {}),
+                       models=REGISTRY.stats(), log=LOG.summary(),
+                       **(dict(ckpt=self.checkpoint.summary()) if self.checkpoint is not None else {}),
+                       **(dict(bars=self.bars.summary()) if self.bars is not None else {}),
+                       **(dict(timeframes={t.timeframe: self._tf_metrics(t) for t in self.tf_traders.values()})
+                          if self.tf_traders else {}))
+
+    @staticmethod
+    def _tf_metrics(trader: PaperTrader) -> dict:
+        return dict(stages={s.name: s.summary() for s in trader.stats.values()},
+                    universe=trader.universe.summary(),
+                    **(dict(ckpt=trader.checkpoint.summary()) if trader.checkpoint is not None else {}))
+
+    def stats_line(self) -> str:
+        return json.dumps(self.metrics(), separators=(",", ":"))
+
+    def _serve_ctl(self):
+        """Answer pending router requests: b"snapshot" → {shard, metrics, portfolio, timeframes} JSON."""
+        while True:
+            try:
+                req = self.ctl.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            reply = dict(shard=self.shard, metrics=self.metrics(), portfolio=self.trader.snapshot(),
+                         timeframes={t.timeframe: t.snapshot() for t in self.tf_traders.values()}) \
+                if req == b"snapshot" else dict(error=f"unknown request {req[:40]!r}")
+            self.ctl.send(json.dumps(reply, separators=(",", ":")).encode())
+
+    def _restore(self, trader: PaperTrader, root: str) -> Checkpointer:
+        """Checkpoint `trader` under root; before it sees live events: snapshot + log tail → last decided bar."""
+        ckpt = Checkpointer(root, trader)
+        print(f"[{self.name}] restored {trader.timeframe}", json.dumps(ckpt.restore()))
+        trader.checkpoint = ckpt
+        return ckpt
+
+    def _guarded(self, fn: Callable, item):
+        """
+        Decision-thread work for one event (or one batched bar): an exception is counted as a
+        dispatch error and the item dropped, so one malformed message can't stop the runner.
+        """
+        t0 = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as e:
+            self.stats.record(time.perf_counter() - t0, error=True)
+            if self.stats.errors <= 10 or self.stats.errors % 1000 == 0:
+                print(f"[{self.name}] dropped event #{self.stats.errors}: {e!r}")
+            return
+        self.stats.record(time.perf_counter() - t0)
+
+    def _on_bar_batch(self, bar: List[dict]):
+        self.trader.on_kline_close_batch(bar)
+        self.tracer.on_klines(bar)
+        if self.bars is not None:
+            self.bars.add_messages(bar)
+
+    def _dispatch(self, msg: dict):
+        mtype = str(msg.get('type', '')).lower()
+        if mtype == 'tg':
+            self.trader.on_tg(msg)
+            for trader in self.tf_traders.values():
+                trader.on_tg(msg)
+        elif mtype == 'kline':
+            # only process closed klines
+            is_closed = bool(msg.get('is_closed', True))
+            if is_closed:
+                if self.batcher is not None:
+                    self.batcher.add(msg)
+                else:
                     self.trader.on_kline_close(msg)
-            # else: ignore
+                    self.tracer.on_klines([msg])
+                    if self.bars is not None:
+                        self.bars.add_messages([msg])
+        elif mtype == 'kline_bin':
+            # already one batch per frame from the publisher → decide directly
+            self.trader.on_kline_records(msg['records'])
+            self.tracer.on_records(msg['records'], msg.get('_recv_ts', time.time()))
+            if self.bars is not None:
+                self.bars.add_records(msg['records'])
+        elif mtype in TICK_TYPES:
+            for trader in (self.trader, *self.tf_traders.values()):
+                trader.on_tick(msg)
+        elif mtype == 'tick_bin':
+            for trader in (self.trader, *self.tf_traders.values()):
+                trader.on_tick_records(msg['records'])
+        elif mtype in BOOK_TYPES:
+            self.trader.on_book(msg)
+        # else: ignore
+
+    def _drop_bars(self, keys: List[str]):
+        """Universe eviction hook: open bars of keys no trader holds any more are forgotten."""
+        traders = (self.trader, *self.tf_traders.values())
+        self.bars.drop([k for k in keys if not any(k in t.assets.index for t in traders)])
+
+    def _on_tf_bar(self, sec: int, keys: List[str], bar: dict):
+        if BAR_AGG_INCOMPLETE == "skip" and not bar["complete"].all():
+            keep = np.flatnonzero(bar["complete"])
+            if not len(keep):
+                return
+            keys, bar = [keys[i] for i in keep], {f: v[keep] for f, v in bar.items()}
+        self.tf_traders[sec].on_bar(keys, bar)
 
     def _sig(self, *args):
         self._stop = True
-        print("\n[Runner] Stopping...")
+        print(f"\n[{self.name}] Stopping...")
 
 if __name__ == "__main__":
     Runner().start()
@@ -0,0 +1,179 @@
+"""
+Non-blocking structured log sink
+================================
+
+Hot path: emit() / emit_rows() check the level and push one tuple onto an in-memory queue.
+A background thread drains them every LOG_FLUSH_SEC and does all formatting and I/O in batches:
+- console (stdout): events at or above their level, sampled per event type. Their queue is a
+  ring (collections.deque with maxlen — when full, the oldest line is dropped and counted)
+- trade journal (TRADE_JOURNAL, JSONL): every JOURNAL_EVENTS row (decisions incl. fills),
+  never sampled and never dropped: its own unbounded queue, the writer is woken early once
+  it holds LOG_RING_SIZE entries
+
+Controls (env):
+- LOG_LEVEL:         debug | info | warning | error | off   (console threshold, default info)
+- LOG_EVENT_LEVELS:  per event type, e.g. "decision=debug,tg=warning"
+- LOG_SAMPLE:        per event type rate, e.g. "decision=0.01" → every 100th to the console
+- LOG_RING_SIZE / LOG_FLUSH_SEC: console ring capacity (default 65536) and flush period (default 0.2)
+- TRADE_JOURNAL:     path of the JSONL trade journal (empty → off)
+"""
+
+from __future__ import annotations
+import atexit, json, os, sys, threading, time
+from collections import deque
+from typing import Dict, Optional
+import numpy as np
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
+JOURNAL_EVENTS = ("decision",)
+
+
+def _parse_map(spec: str, cast) -> Dict[str, object]:
+    """'a=1,b=2' → {'a': cast('1'), 'b': cast('2')}"""
+    out = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            out[name.strip()] = cast(value.strip())
+    return out
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").lower()
+LOG_EVENT_LEVELS = _parse_map(os.getenv("LOG_EVENT_LEVELS", ""), str.lower)
+LOG_SAMPLE = _parse_map(os.getenv("LOG_SAMPLE", ""), float)
+LOG_RING_SIZE = int(os.getenv("LOG_RING_SIZE", 65536))
+LOG_FLUSH_SEC = float(os.getenv("LOG_FLUSH_SEC", 0.2))
+TRADE_JOURNAL = os.getenv("TRADE_JOURNAL", "")
+
+# console line per event type; anything else is "event k=v ..."
+FORMATS = {
+    "decision": "{key} close={close:.6f} action={action} pos={pos} PnL={pnl:.6f}",
+}
+
+
+def _jsonable(v):
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+
+class LogSink(threading.Thread):
+    def __init__(self, stream=None, journal_path: str = TRADE_JOURNAL, level: str = LOG_LEVEL,
+                 event_levels: Optional[dict] = None, sample: Optional[dict] = None,
+                 ring_size: int = LOG_RING_SIZE, flush_sec: float = LOG_FLUSH_SEC):
+        super().__init__(daemon=True, name="log-sink")
+        self.stream = stream or sys.stdout
+        self.journal_path = journal_path
+        self.threshold = LEVELS[level]
+        self.event_levels = dict(LOG_EVENT_LEVELS if event_levels is None else event_levels)
+        # rate → keep every k-th console line of that event type (0 → none)
+        self._every = {e: (0 if r <= 0 else max(1, round(1 / r)))
+                       for e, r in (LOG_SAMPLE if sample is None else sample).items()}
+        self._seen: Dict[str, int] = {}
+        self._ring: deque = deque(maxlen=max(1, ring_size))  # console
+        self._journal_q: deque = deque()  # journal, unbounded
+        self.flush_sec = flush_sec
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        self._start_lock = threading.Lock()
+        self._journal = None
+        self.dropped = 0  # console entries only
+        self.written = 0
+        self.journaled = 0
+
+    # ---- hot path ----
+    def console(self, event: str, level: str = "info") -> bool:
+        return (LEVELS[self.event_levels.get(event, level)] >= self.threshold
+                and self._every.get(event, 1) > 0)
+
+    def enabled(self, event: str, level: str = "info") -> bool:
+        """Cheap pre-check so callers can skip building fields nobody will see."""
+        return self.console(event, level) or (bool(self.journal_path) and event in JOURNAL_EVENTS)
+
+    def emit(self, event: str, level: str = "info", **fields):
+        if self.enabled(event, level):
+            self._push((time.time(), event, level, fields, False))
+
+    def emit_rows(self, event: str, level: str = "info", **columns):
+        """Columnar batch (equal-length arrays/lists) → one line per row, expanded off the hot path."""
+        if self.enabled(event, level):
+            self._push((time.time(), event, level, columns, True))
+
+    def _push(self, item):
+        if not self.is_alive() and not self._closing.is_set():
+            with self._start_lock:
+                if not self.is_alive() and self.ident is None:
+                    self.start()
+                    atexit.register(self.close)
+        _, event, level, _, _ = item
+        if self.journal_path and event in JOURNAL_EVENTS:
+            self._journal_q.append(item)
+            if len(self._journal_q) >= self._ring.maxlen:
+                self._wake.set()
+        if self.console(event, level):
+            if len(self._ring) == self._ring.maxlen:
+                self.dropped += 1
+            self._ring.append(item)
+
+    # ---- background ----
+    def run(self):
+        while not self._closing.is_set():
+            self._wake.wait(self.flush_sec)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def close(self):
+        self._closing.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    @staticmethod
+    def _items(fields: dict, rows: bool) -> list:
+        if not rows:
+            return [fields]
+        keys = list(fields)
+        cols = [np.asarray(fields[k]).tolist() for k in keys]
+        return [dict(zip(keys, vals)) for vals in zip(*cols)]
+
+    def flush(self):
+        journal = []
+        for _ in range(len(self._journal_q)):
+            ts, event, _, fields, rows = self._journal_q.popleft()
+            journal.extend(json.dumps(dict(ts=ts, event=event, **f), default=_jsonable)
+                           for f in self._items(fields, rows))
+        console = []
+        for _ in range(len(self._ring)):
+            ts, event, level, fields, rows = self._ring.popleft()
+            every = self._every.get(event, 1)
+            stamp = time.strftime('%H:%M:%S', time.localtime(ts))
+            for f in self._items(fields, rows):
+                seen = self._seen[event] = self._seen.get(event, 0) + 1
+                if (seen - 1) % every:
+                    continue
+                fmt = FORMATS.get(event)
+                text = fmt.format(**f) if fmt else " ".join([event] + [f"{k}={v}" for k, v in f.items()])
+                console.append(f"[{stamp}] {text}")
+        if console:
+            self.stream.write("\n".join(console) + "\n")
+            self.stream.flush()
+            self.written += len(console)
+        if journal:
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a")
+            self._journal.write("\n".join(journal) + "\n")
+            self._journal.flush()
+            self.journaled += len(journal)
+
+    def summary(self) -> dict:
+        return dict(pending=len(self._ring), journal_pending=len(self._journal_q), written=self.written,
+                    journaled=self.journaled, dropped=self.dropped)
+
+
+LOG = LogSink()
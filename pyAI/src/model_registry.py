@@ -0,0 +1,196 @@
+"""
+Model registry: warm-loaded inference sessions with hot-swap
+============================================================
+
+Loads a model once, keeps the session for the life of the process and warms it up with a
+dummy batch (JIT compilation, graph optimisation, arena allocation) before it serves a
+single live request. Backends are picked by file extension, each import is lazy:
+
+    .onnx        ONNX Runtime, CPUExecutionProvider   (pip install onnxruntime)
+    .pt / .ts    TorchScript, torch.jit.load on CPU   (pip install torch)
+    .pkl         pickled SB3 policy / model (anything with .predict(obs, deterministic=True))
+    .zip         SB3 model saved with .save(), class from SB3_ALGO (default PPO)
+
+A model is a callable X (N × dim float32) → np.ndarray. ONNX and SB3 files declare their input
+width; TorchScript does not, so its dim has to be passed to load(..., dim=) (ai_server_zmq:
+AI_MARKET_MODEL_DIM) or warm-up is skipped.
+
+The registry polls the model files every MODEL_RELOAD_SEC; a changed file is loaded and warmed in the watcher thread, then swapped
+in with one dict assignment, so callers never see a cold or half-loaded model and in-flight
+calls finish on the old one. A model that fails to load keeps the previous version serving.
+Replace model files atomically (write elsewhere, then rename over the old path).
+
+Per-model latency (count, p50/p99) is in ModelRegistry.stats().
+"""
+
+from __future__ import annotations
+import importlib, os, pickle, threading, time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+
+from pipeline import StageStats
+
+MODEL_RELOAD_SEC = float(os.getenv("MODEL_RELOAD_SEC", 5.0))  # 0 → no hot-swap watcher
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", 1))  # intra-op threads per session
+MODEL_WARMUP_BATCH = int(os.getenv("MODEL_WARMUP_BATCH", 64))
+MODEL_WARMUP_RUNS = 3  # TorchScript's profiling executor specialises after a couple of calls
+SB3_ALGO = os.getenv("SB3_ALGO", "PPO")
+
+# ----------------------- Loaders ----------------------
+# path → (fn(X) → np.ndarray, input dim or None if the model doesn't say)
+
+def _load_onnx(path: str) -> Tuple[Callable, Optional[int]]:
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = MODEL_THREADS
+    so.inter_op_num_threads = 1
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+    inp = sess.get_inputs()[0]
+    dim = inp.shape[-1] if isinstance(inp.shape[-1], int) else None
+    name = inp.name
+    return (lambda X: sess.run(None, {name: X})[0]), dim
+
+
+def _load_torchscript(path: str) -> Tuple[Callable, Optional[int]]:
+    import torch
+    torch.set_num_threads(MODEL_THREADS)
+    model = torch.jit.load(path, map_location="cpu").eval()
+    try:
+        model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+    except Exception:
+        pass  # not every scripted module can be frozen; the plain one still works
+
+    def run(X):
+        with torch.inference_mode():
+            return model(torch.from_numpy(X)).numpy()
+    return run, None
+
+
+def _sb3_dim(model) -> Optional[int]:
+    shape = getattr(getattr(model, "observation_space", None), "shape", None)
+    return int(shape[-1]) if shape else None
+
+
+def _load_sb3_pickle(path: str) -> Tuple[Callable, Optional[int]]:
+    with open(path, "rb") as f:
+        model = pickle.load(f)  # trusted files only
+    return (lambda X: model.predict(X, deterministic=True)[0]), _sb3_dim(model)
+
+
+def _load_sb3_zip(path: str) -> Tuple[Callable, Optional[int]]:
+    algo = getattr(importlib.import_module("stable_baselines3"), SB3_ALGO)
+    model = algo.load(path, device="cpu")
+    return (lambda X: model.predict(X, deterministic=True)[0]), _sb3_dim(model)
+
+
+LOADERS: Dict[str, Callable] = {
+    ".onnx": _load_onnx,
+    ".pt": _load_torchscript,
+    ".ts": _load_torchscript,
+    ".pkl": _load_sb3_pickle,
+    ".zip": _load_sb3_zip,
+}
+
+# ----------------------- Session ----------------------
+
+class ModelSession:
+    """One loaded model version: call with X (N × dim) → np.ndarray, latency recorded per call."""
+    def __init__(self, name: str, path: str, fn: Callable, dim: Optional[int]):
+        self.name = name
+        self.path = path
+        self.dim = dim
+        self.mtime = os.path.getmtime(path)
+        self.loaded_at = time.time()
+        self.stats = StageStats(name)
+        self._fn = fn
+
+    def __call__(self, X: np.ndarray) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        t0 = time.perf_counter()
+        try:
+            out = np.asarray(self._fn(X))
+        except Exception:
+            self.stats.record(time.perf_counter() - t0, error=True)
+            raise
+        self.stats.record(time.perf_counter() - t0)
+        return out
+
+    def warmup(self, batch: int = MODEL_WARMUP_BATCH, runs: int = MODEL_WARMUP_RUNS):
+        if self.dim is None:
+            print(f"[models] {self.name}: input dim unknown (load(..., dim=)), skipping warm-up")
+            return
+        for n in (1, batch):  # single-row path and the largest batch we expect
+            X = np.zeros((n, self.dim), dtype=np.float32)
+            for _ in range(runs):
+                self._fn(X)
+
+# ----------------------- Registry ---------------------
+
+class ModelRegistry:
+    def __init__(self, reload_sec: float = MODEL_RELOAD_SEC):
+        self.reload_sec = reload_sec
+        self._models: Dict[str, ModelSession] = {}
+        self._lock = threading.Lock()  # serialises loads, never held by callers
+        self._watcher: Optional[threading.Thread] = None
+        self.swaps = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str) -> Optional[ModelSession]:
+        return self._models.get(name)
+
+    def load(self, name: str, path: str, dim: Optional[int] = None) -> ModelSession:
+        """Load + warm a model, then make it the current version of `name`."""
+        loader = LOADERS.get(Path(path).suffix.lower())
+        if loader is None:
+            raise ValueError(f"no loader for '{path}' (have: {', '.join(LOADERS)})")
+        with self._lock:
+            t0 = time.perf_counter()
+            fn, model_dim = loader(path)
+            sess = ModelSession(name, path, fn, dim or model_dim)
+            sess.warmup()
+            old = self._models.get(name)
+            self._models[name] = sess
+            self.swaps += old is not None
+        print(f"[models] {'reloaded' if old else 'loaded'} {name} ← {path} "
+              f"(dim={sess.dim}, {time.perf_counter() - t0:.2f}s incl. warm-up)")
+        return sess
+
+    def start_watch(self):
+        """Hot-swap watcher thread (idempotent, no-op if MODEL_RELOAD_SEC <= 0)."""
+        if self._watcher is not None or self.reload_sec <= 0:
+            return
+        self._watcher = threading.Thread(target=self._watch, daemon=True, name="model-watch")
+        self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_sec)
+            for name, sess in list(self._models.items()):
+                try:  # one bad checkpoint must not stop the watcher
+                    self._check(name, sess)
+                except Exception as e:
+                    print(f"[models] watching {sess.path} failed: {e!r}")
+
+    def _check(self, name: str, sess):
+        try:
+            mtime = os.path.getmtime(sess.path)
+        except OSError:
+            return  # mid-replace; try again next round
+        if mtime == sess.mtime:
+            return
+        try:
+            self.load(name, sess.path, sess.dim)
+        except Exception as e:
+            sess.mtime = mtime  # don't retry a broken file every round
+            print(f"[models] reload of {sess.path} failed, keeping previous version: {e!r}")
+
+    def stats(self) -> dict:
+        return {name: dict(sess.stats.summary(), path=Path(sess.path).name)
+                for name, sess in self._models.items()}
+
+
+REGISTRY = ModelRegistry()
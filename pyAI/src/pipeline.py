@@ -0,0 +1,356 @@
+"""
+Staged ingest pipeline for the paper trader
+===========================================
+
+    ZMQSubscriber (recv) ──raw q──▶ ParseStage (parse/validate) ──event q──▶ Runner
+                                                                     (feature → observe → decide → ledger)
+
+Queues between stages are bounded StageQueues with an overflow policy (PIPE_OVERFLOW):
+- block:        producer waits for room (nothing is lost, recv can fall behind)
+- drop_oldest:  the oldest pending item is discarded to make room
+- coalesce:     a newer message for the same (type, Exchange:TOKEN) replaces the pending one in
+                place, so a burst for one symbol never queues stale klines/snapshots ahead of
+                fresh ones; a full queue then drops oldest
+
+Every queue counts puts/gets/drops/coalesced and its max depth, and records the time items
+wait in it; every stage records its own processing time (StageStats). LagTracer turns the
+ingest timestamps a kline carries into end-to-end spans from the Binance close to our decision.
+Runner logs a compact line with all of it every PIPE_STATS_SEC and, with METRICS_PORT set,
+serves the same JSON at http://127.0.0.1:{METRICS_PORT}/metrics. The HTTP thread never reads
+live trader state: the decision thread rebuilds the JSON dict every METRICS_REFRESH_SEC
+(default 1) and the handler serves that copy.
+"""
+
+from __future__ import annotations
+import json, os, queue, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from typing import Callable, Dict, Hashable, Optional
+import numpy as np
+
+PIPE_QUEUE_SIZE = int(os.getenv("PIPE_QUEUE_SIZE", 10000))
+PIPE_OVERFLOW = os.getenv("PIPE_OVERFLOW", "block").lower()  # block | drop_oldest | coalesce
+PIPE_STATS_SEC = float(os.getenv("PIPE_STATS_SEC", 30))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # 0 → no HTTP endpoint, log line only
+METRICS_REFRESH_SEC = float(os.getenv("METRICS_REFRESH_SEC", 1.0))
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "coalesce")
+# every field the kline decision path (PaperTrader.on_kline_close / on_kline_close_batch) reads
+KLINE_FIELDS = ("open", "high", "low", "close", "volume", "ts_close")
+KLINE_OPTIONAL = ("quoteVolume", "vwapApprox")  # missing / empty → 0
+# fields fills.FillSimulator.on_message requires per book message type (levels are parsed there)
+BOOK_FIELDS = {"depth": ("bids", "asks"), "depth_diff": ("U", "u"),
+               "book_ticker": ("bidPrice", "bidQty", "askPrice", "askQty")}
+
+# ----------------------- Stats ------------------------
+
+class StageStats:
+    """
+    Count + HDR-style latency histogram for one stage. Values are integer µs in log-linear
+    buckets: exact below 2**SUB_BITS, above that 2**SUB_BITS sub-buckets per power of two
+    (≤ ~3% relative error) up to 2**MAX_BITS µs (~12 days). Quantiles report the bucket's
+    highest equivalent value, like HdrHistogram.
+    """
+    SUB_BITS = 5
+    MAX_BITS = 40
+    N_BUCKETS = (MAX_BITS - SUB_BITS + 1) << SUB_BITS
+
+    def __init__(self, name: str, unit: str = "us"):
+        self.name = name
+        self.unit = unit  # summary unit: "us" or "ms"
+        self.count = 0
+        self.errors = 0
+        self.total_sec = 0.0
+        self.buckets = np.zeros(self.N_BUCKETS, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _bucket(cls, us: int) -> int:
+        m = us.bit_length()
+        if m <= cls.SUB_BITS:
+            return us
+        shift = m - cls.SUB_BITS - 1
+        return min(cls.N_BUCKETS - 1, (shift << cls.SUB_BITS) + (us >> shift))
+
+    @classmethod
+    def _upper(cls, b: int) -> int:
+        if b < (2 << cls.SUB_BITS):
+            return b
+        shift = (b >> cls.SUB_BITS) - 1
+        top = b - (shift << cls.SUB_BITS)
+        return ((top + 1) << shift) - 1
+
+    def record(self, sec: float, error: bool = False):
+        b = self._bucket(max(0, int(sec * 1e6)))
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self.total_sec += sec
+            self.buckets[b] += 1
+
+    def record_many(self, secs: np.ndarray):
+        """Vectorized record() for an array of durations (e.g. one lag per symbol of a bar)."""
+        us = np.maximum(np.asarray(secs, dtype=np.float64) * 1e6, 0.0).astype(np.int64)
+        if not len(us):
+            return
+        m = np.frexp(us.astype(np.float64))[1]  # == int.bit_length for these magnitudes
+        shift = np.maximum(m - self.SUB_BITS - 1, 0)
+        idx = np.where(m <= self.SUB_BITS, us, (shift << self.SUB_BITS) + (us >> shift))
+        idx = np.minimum(idx, self.N_BUCKETS - 1)
+        with self._lock:
+            self.count += len(us)
+            self.total_sec += float(np.sum(secs))
+            np.add.at(self.buckets, idx, 1)
+
+    def quantile_us(self, q: float) -> float:
+        """Highest equivalent value of the bucket holding quantile q (0 if empty)."""
+        with self._lock:
+            counts = self.buckets.copy()
+        total = counts.sum()
+        if not total:
+            return 0.0
+        b = int(np.searchsorted(np.cumsum(counts), q * total))
+        return float(self._upper(b))
+
+    def summary(self) -> dict:
+        out = dict(n=self.count)
+        if self.errors:
+            out["err"] = self.errors
+        if self.count:
+            div, u = (1000.0, "ms") if self.unit == "ms" else (1.0, "us")
+            out.update({f"avg_{u}": round(float(self.total_sec) / self.count * 1e6 / div, 1),
+                        f"p50_{u}": round(self.quantile_us(0.5) / div, 3),
+                        f"p99_{u}": round(self.quantile_us(0.99) / div, 3),
+                        f"p999_{u}": round(self.quantile_us(0.999) / div, 3),
+                        f"max_{u}": round(self.quantile_us(1.0) / div, 3)})
+        return out
+
+# ----------------------- Queue ------------------------
+
+class StageQueue:
+    """Bounded queue between two stages, see module docstring for overflow policies."""
+    def __init__(self, name: str, maxsize: int = PIPE_QUEUE_SIZE, overflow: str = PIPE_OVERFLOW):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got '{overflow}'")
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.overflow = overflow
+        self._items: deque = deque()           # entries: [key, item, t_put]
+        self._by_key: Dict[Hashable, list] = {}  # coalesce: key → pending entry
+        self._cv = threading.Condition()
+        self.wait = StageStats(f"{name}.wait")
+        self.puts = self.gets = self.dropped = self.coalesced = self.max_depth = 0
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def put(self, item, key: Optional[Hashable] = None):
+        now = time.perf_counter()
+        with self._cv:
+            self.puts += 1
+            if self.overflow == "coalesce" and key is not None:
+                entry = self._by_key.get(key)
+                if entry is not None:
+                    entry[1] = item  # keep the queue slot, replace the payload
+                    self.coalesced += 1
+                    return
+            while len(self._items) >= self.maxsize:
+                if self.overflow == "block":
+                    self._cv.wait()
+                    continue
+                old = self._items.popleft()
+                if self._by_key.get(old[0]) is old:
+                    del self._by_key[old[0]]
+                self.dropped += 1
+            entry = [key, item, now]
+            self._items.append(entry)
+            if self.overflow == "coalesce" and key is not None:
+                self._by_key[key] = entry
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cv.notify_all()
+
+    def get(self, timeout: Optional[float] = None):
+        """Like queue.Queue.get: raises queue.Empty after timeout."""
+        with self._cv:
+            if not self._items:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self._items:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        raise queue.Empty
+                    self._cv.wait(left)
+            entry = self._items.popleft()
+            if entry[0] is not None and self._by_key.get(entry[0]) is entry:
+                del self._by_key[entry[0]]
+            self.gets += 1
+            self._cv.notify_all()
+        self.wait.record(time.perf_counter() - entry[2])
+        return entry[1]
+
+    def summary(self) -> dict:
+        out = dict(depth=len(self._items), max=self.max_depth, put=self.puts, get=self.gets)
+        if self.dropped:
+            out["drop"] = self.dropped
+        if self.coalesced:
+            out["coal"] = self.coalesced
+        out["wait"] = self.wait.summary()
+        return out
+
+# ----------------------- Stages -----------------------
+
+def event_key(msg: dict) -> Optional[Hashable]:
+    """
+    Coalescing key: (type, Exchange:TOKEN); batches without a single symbol and incremental
+    messages (depth_diff, trade / liquidation ticks) are never coalesced.
+    """
+    mtype = str(msg.get("type", "")).lower()
+    if mtype in ("tg", "kline", "depth", "book_ticker"):
+        return mtype, f"{msg.get('exchange')}:{msg.get('token')}"
+    return None
+
+
+def validate(msg: dict) -> bool:
+    mtype = str(msg.get("type", "")).lower()
+    if mtype == "tg":
+        return bool(msg.get("token"))
+    if mtype == "depth":
+        return all(isinstance(msg.get(f), list) for f in BOOK_FIELDS[mtype]) and bool(msg.get("token"))
+    if mtype in BOOK_FIELDS:
+        try:
+            values = [float(msg[f]) for f in BOOK_FIELDS[mtype]]
+        except (KeyError, TypeError, ValueError):
+            return False
+        return bool(np.isfinite(values).all()) and bool(msg.get("token"))
+    if mtype in ("trade", "liquidation"):  # same field aliases as ticks.tick_record
+        try:
+            values = float(msg.get("price", msg.get("ap", msg.get("p")))), float(msg.get("qty", msg.get("q")))
+        except (TypeError, ValueError):
+            return False
+        return bool(np.isfinite(values).all()) and bool(msg.get("token"))
+    if mtype == "kline":
+        try:
+            values = [float(msg[f]) for f in KLINE_FIELDS] + [float(msg.get(f) or 0.0) for f in KLINE_OPTIONAL]
+        except (KeyError, TypeError, ValueError):
+            return False
+        return bool(np.isfinite(values).all()) and bool(msg.get("token"))
+    return mtype in ("kline_bin", "tick_bin")
+
+
+class ParseStage(threading.Thread):
+    """
+    (recv_ts, raw frames) → parsed, validated message dicts (parse_frames returns None to skip).
+    The receive time travels with the message as msg['_recv_ts'].
+    """
+    def __init__(self, in_q: StageQueue, out_q: StageQueue, parse_frames: Callable,
+                 on_event: Optional[Callable] = None):
+        super().__init__(daemon=True, name="parse-stage")
+        self.in_q = in_q
+        self.out_q = out_q
+        self.parse_frames = parse_frames
+        self.on_event = on_event  # on_event(msg, recv_ts): every valid event before coalescing (recorder)
+        self.stats = StageStats("parse")
+
+    def run(self):
+        while True:
+            recv_ts, frames = self.in_q.get()
+            t0 = time.perf_counter()
+            msg = None
+            try:
+                msg = self.parse_frames(frames)
+                ok = msg is not None and validate(msg)
+            except Exception:
+                ok = False
+            self.stats.record(time.perf_counter() - t0, error=not ok)
+            if not ok:
+                continue
+            msg['_recv_ts'] = recv_ts
+            if self.on_event is not None:
+                self.on_event(msg, recv_ts)
+            self.out_q.put(msg, key=event_key(msg))
+
+
+class LagTracer:
+    """
+    Wall-clock spans (ms) of a kline from the Binance close to our decision, from the ingest
+    timestamps it carries:
+        ts_close (s, Binance close) → recvTime (ms, Node WS receive) → sentTime (ms, Node publish)
+        → _recv_ts (s, our ZMQ receive) → decision
+    Node timestamps are optional (binary records only have ts_close). Spans across hosts include
+    clock skew; negative spans count as 0.
+    """
+    SPANS = ("close_to_node", "node_to_recv", "close_to_recv", "close_to_decision")
+
+    def __init__(self):
+        self.stats = {name: StageStats(name, unit="ms") for name in self.SPANS}
+
+    def _span(self, name: str, end: np.ndarray, start: np.ndarray):
+        lag = end - start
+        lag = lag[~np.isnan(lag)]
+        if len(lag):
+            self.stats[name].record_many(lag)
+
+    def on_klines(self, msgs: list, now: Optional[float] = None):
+        """Decided kline dicts (live JSON format)."""
+        now = time.time() if now is None else now
+        n = len(msgs)
+        if not n:
+            return
+
+        def col(field: str, scale: float = 1.0) -> np.ndarray:
+            return np.fromiter((float(m[field]) * scale if m.get(field) is not None else np.nan for m in msgs),
+                               dtype=np.float64, count=n)
+
+        ts_close, recv_ts = col("ts_close"), col("_recv_ts")
+        node_recv, node_sent = col("recvTime", 1e-3), col("sentTime", 1e-3)
+        self._span("close_to_node", node_recv, ts_close)
+        self._span("node_to_recv", recv_ts, np.where(np.isnan(node_sent), node_recv, node_sent))
+        self._span("close_to_recv", recv_ts, ts_close)
+        self._span("close_to_decision", np.full(n, now), ts_close)
+
+    def on_records(self, recs: np.ndarray, recv_ts: float, now: Optional[float] = None):
+        """Decided packed records (wire_format.KLINE_DTYPE) received at recv_ts."""
+        now = time.time() if now is None else now
+        ts_close = recs["ts_close"]
+        self._span("close_to_recv", np.full(len(recs), recv_ts), ts_close)
+        self._span("close_to_decision", np.full(len(recs), now), ts_close)
+
+    def stages(self) -> list:
+        return list(self.stats.values())
+
+
+def collect(queues, stages, **extra) -> dict:
+    """All queue/stage summaries (+ extra sections) → one dict, for the log line and /metrics."""
+    parts = {q.name: q.summary() for q in queues}
+    parts.update({s.name: s.summary() for s in stages})
+    parts.update(extra)
+    return parts
+
+
+def stats_line(queues, stages, **extra) -> str:
+    return json.dumps(collect(queues, stages, **extra), separators=(",", ":"))
+
+
+def serve_metrics(snapshot: Callable[[], dict], port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """
+    GET /metrics → JSON of snapshot(), from a daemon thread. Returns the server. snapshot() runs
+    on the HTTP thread: it must return a copy the owner thread built, not read live state.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = json.dumps(snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # no per-request stderr line
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
@@ -0,0 +1,208 @@
+"""
+Append-only event recorder (fixed-width NumPy record files)
+===========================================================
+
+Every TG and kline message the Runner receives is appended to
+
+    {root}/{YYYYMMDD}/tg.bin      TG_RECORD_DTYPE
+    {root}/{YYYYMMDD}/kline.bin   KLINE_RECORD_DTYPE  (recv_ts + wire_format.KLINE_DTYPE)
+
+(day = UTC receive date). Files are raw back-to-back records with no header, so
+`np.memmap(path, dtype, mode='r')` — see read_day() — is a zero-copy columnar view;
+each day dir also gets a schema.json describing both dtypes.
+
+Hot path cost is one deque.append; a background thread turns the pending messages into
+structured arrays and writes them in bulk every RECORD_FLUSH_SEC (or RECORD_FLUSH_MAX msgs).
+"""
+
+from __future__ import annotations
+import json, os, threading, time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from wire_format import KLINE_DTYPE, TG_FIELDS, decode_tg_batch, tg_nan_values
+
+RECORD_DIR = os.getenv("RECORD_DIR", "")  # empty → recorder off
+RECORD_FLUSH_SEC = float(os.getenv("RECORD_FLUSH_SEC", 1.0))
+RECORD_FLUSH_MAX = int(os.getenv("RECORD_FLUSH_MAX", 20000))
+
+TG_RECORD_DTYPE = np.dtype(
+    [("recv_ts", "<f8"), ("ts", "<f8"), ("exchange", "S16"), ("token", "S24")]
+    + [(f, "<f8") for f in TG_FIELDS]  # NaN = missing
+)
+KLINE_RECORD_DTYPE = np.dtype([("recv_ts", "<f8")] + KLINE_DTYPE.descr)
+DTYPES = {"tg": TG_RECORD_DTYPE, "kline": KLINE_RECORD_DTYPE}
+
+
+def _f(x, default=np.nan) -> float:
+    if x is None:
+        return default
+    try:
+        return float(str(x).strip())
+    except ValueError:
+        return default
+
+
+def _s(x) -> bytes:
+    return str(x if x is not None else "").encode("ascii", errors="replace")
+
+# ---------------------- Recorder ----------------------
+
+class EventRecorder(threading.Thread):
+    def __init__(self, root: str, flush_sec: float = RECORD_FLUSH_SEC, flush_max: int = RECORD_FLUSH_MAX):
+        super().__init__(daemon=True, name="event-recorder")
+        self.root = Path(root)
+        self.flush_sec = flush_sec
+        self.flush_max = flush_max
+        self._pending: deque = deque()
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        self._files: Dict[Tuple[str, str], object] = {}
+        self.written = {"tg": 0, "kline": 0}
+
+    # hot path: O(1), no parsing, no I/O
+    def record(self, msg: dict, recv_ts: Optional[float] = None):
+        self._pending.append((time.time() if recv_ts is None else recv_ts, msg))
+        if len(self._pending) >= self.flush_max:
+            self._wake.set()
+
+    def run(self):
+        while not self._closing.is_set():
+            self._wake.wait(self.flush_sec)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def close(self):
+        self._closing.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def flush(self):
+        n = len(self._pending)
+        if not n:
+            return
+        tg, klines = [], []
+        for _ in range(n):
+            recv_ts, msg = self._pending.popleft()
+            mtype = str(msg.get("type", "")).lower()
+            if mtype == "tg":
+                tg.append((recv_ts, msg))
+            elif mtype in ("kline", "kline_bin"):
+                klines.append((recv_ts, msg))
+        if tg:
+            self._write("tg", self._tg_records(tg))
+        if klines:
+            self._write("kline", self._kline_records(klines))
+
+    @staticmethod
+    def _tg_records(items) -> np.ndarray:
+        recv_ts, msgs = zip(*items)
+        recs = decode_tg_batch(list(msgs), default_ts=recv_ts)
+        arr = np.zeros(len(items), dtype=TG_RECORD_DTYPE)
+        arr["recv_ts"] = recv_ts
+        arr["ts"] = recs["ts"]
+        arr["exchange"] = [_s(m.get("exchange")) for m in msgs]
+        arr["token"] = [_s(m.get("token")) for m in msgs]
+        for f, col in zip(TG_FIELDS, tg_nan_values(recs).T):
+            arr[f] = col
+        return arr
+
+    @staticmethod
+    def _kline_records(items) -> np.ndarray:
+        parts = []
+        for recv_ts, m in items:
+            if m.get("type") == "kline_bin":
+                recs = m["records"]
+                out = np.empty(len(recs), dtype=KLINE_RECORD_DTYPE)
+                out["recv_ts"] = recv_ts
+                for name in KLINE_DTYPE.names:
+                    out[name] = recs[name]
+                parts.append(out)
+                continue
+            out = np.zeros(1, dtype=KLINE_RECORD_DTYPE)
+            out[0] = (recv_ts, _s(m.get("token") or m.get("symbol")), _s(m.get("exchange") or "Binance"),
+                      _f(m.get("ts_close")), _f(m.get("open")), _f(m.get("high")), _f(m.get("low")),
+                      _f(m.get("close")), _f(m.get("volume"), 0.0), _f(m.get("quoteVolume"), 0.0),
+                      _f(m.get("takerBuyQuote"), 0.0), _f(m.get("vwapApprox"), 0.0),
+                      int(_f(m.get("trades"), 0.0)), 1 if m.get("is_closed", True) else 0, b"")
+            parts.append(out)
+        return np.concatenate(parts)
+
+    def _write(self, kind: str, arr: np.ndarray):
+        days = (arr["recv_ts"] // 86400).astype(np.int64)
+        for day in np.unique(days):
+            chunk = arr[days == day]
+            self._file(kind, time.strftime("%Y%m%d", time.gmtime(int(day) * 86400))).write(chunk.tobytes())
+            self.written[kind] += len(chunk)
+        for f in self._files.values():
+            f.flush()
+
+    def _file(self, kind: str, day: str):
+        f = self._files.get((kind, day))
+        if f is None:
+            for key in [k for k in self._files if k[0] == kind]:  # day rolled over → close old file
+                self._files.pop(key).close()
+            d = self.root / day
+            d.mkdir(parents=True, exist_ok=True)
+            schema = d / "schema.json"
+            if not schema.exists():
+                schema.write_text(json.dumps({k: dt.descr for k, dt in DTYPES.items()}))
+            path = d / f"{kind}.bin"
+            _truncate_partial(path, DTYPES[kind].itemsize)
+            f = self._files[(kind, day)] = open(path, "ab")
+        return f
+
+
+def _truncate_partial(path: Path, itemsize: int):
+    """Drop a torn trailing record left by a crash mid-write."""
+    if path.exists():
+        size = path.stat().st_size
+        if size % itemsize:
+            os.truncate(path, size - size % itemsize)
+
+# ----------------------- Readers ----------------------
+
+def read_day(root, day: str, kind: str) -> np.ndarray:
+    """Zero-copy memmap of one day's records (empty array if nothing recorded)."""
+    path = Path(root) / day / f"{kind}.bin"
+    dtype = DTYPES[kind]
+    if not path.exists() or path.stat().st_size < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(path.stat().st_size // dtype.itemsize,))
+
+
+def days(root) -> list:
+    return sorted(p.name for p in Path(root).iterdir() if p.is_dir() and (p / "schema.json").exists())
+
+
+def read_frame(root) -> pd.DataFrame:
+    """All recorded days → one DataFrame in live-message schema (with `type`), e.g. for replay.load_events."""
+    frames = []
+    for day in days(root):
+        tg = read_day(root, day, "tg")
+        if len(tg):
+            df = pd.DataFrame({f: tg[f] for f in ("ts",) + TG_FIELDS})
+            df["exchange"] = np.char.decode(tg["exchange"], "ascii")
+            df["token"] = np.char.decode(tg["token"], "ascii")
+            df["type"] = "tg"
+            frames.append(df)
+        kl = read_day(root, day, "kline")
+        if len(kl):
+            cols = [n for n in KLINE_DTYPE.names if n not in ("symbol", "exchange", "_pad")]
+            df = pd.DataFrame({c: kl[c] for c in cols})
+            df["exchange"] = np.char.decode(kl["exchange"], "ascii")
+            df["token"] = np.char.decode(kl["symbol"], "ascii")
+            df["is_closed"] = df["is_closed"].astype(bool)
+            df["type"] = "kline"
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,251 @@
+"""
+Historical replay / backtest for PaperTrader
+============================================
+
+Reads recorded TG events and klines (JSONL / CSV / Parquet, mixed or one stream per file,
+or a recorder.EventRecorder directory),
+merges them by timestamp and drives the trader with no ZMQ and no prints:
+- klines are grouped by ts_close and decided bar by bar through PaperTrader.decide_rows
+  (one vectorized policy call per bar, keys mapped to rows once up front)
+- TG snapshots with ts <= bar close are written in bulk right before that bar
+
+Input rows use the same fields as the live messages (see gptShit2.py docstring):
+- TG:    type="tg",    exchange, token, openInterest, volume, ..., ts
+- KLINE: type="kline", exchange, token, open/high/low/close, volume, ts_close
+  (Node-style rows with `symbol` / `closeTime` in ms are accepted too)
+Files without a `type` column are split by the presence of `ts_close`/`closeTime`.
+
+Usage:
+    python replay.py events.jsonl [more files... | RECORD_DIR] [--fee-bps 3]
+"""
+
+from __future__ import annotations
+import argparse, json, time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from gptShit2 import FEE_BPS, TG_FIELDS, PaperTrader, TraderConfig
+from recorder import read_frame
+
+KLINE_COLS = ("close", "high", "low", "quoteVolume", "vwapApprox")
+
+# --------------------- Loading ------------------------
+
+def _read(path: Path) -> pd.DataFrame:
+    if path.is_dir():  # recorder.EventRecorder output
+        return read_frame(path)
+    suffix = path.suffix.lower()
+    if suffix in (".jsonl", ".json", ".ndjson"):
+        return pd.read_json(path, lines=True, dtype=False)
+    if suffix == ".csv":
+        return pd.read_csv(path)
+    if suffix == ".parquet":
+        return pd.read_parquet(path)  # needs pyarrow or fastparquet
+    raise ValueError(f"unsupported file type: {path}")
+
+
+def _num(df: pd.DataFrame, col: str, default: float = np.nan) -> np.ndarray:
+    """Column → float64 array; TG values arrive as strings like ' 9.632', garbage → NaN."""
+    if col not in df:
+        return np.full(len(df), default)
+    s = df[col]
+    if s.dtype == object:
+        s = s.astype(str).str.strip()
+    return pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _keys(df: pd.DataFrame) -> pd.Series:
+    if "token" in df:
+        token = df["token"].fillna(df["symbol"]) if "symbol" in df else df["token"]
+    elif "symbol" in df:
+        token = df["symbol"]
+    else:
+        raise ValueError("rows need a 'token' (or 'symbol') column")
+    exchange = df["exchange"].fillna("Binance") if "exchange" in df else pd.Series("Binance", index=df.index)
+    return exchange.astype(str) + ":" + token.astype(str)
+
+
+def load_events(paths: Iterable) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Files → (tg, klines) frames with normalized columns: key, ts / ts_close, numeric fields."""
+    frames = [_read(Path(p)) for p in paths]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if "type" in df:
+        mtype = df["type"].astype(str).str.lower()
+        is_kline = mtype == "kline"
+        is_tg = mtype == "tg"
+    else:
+        is_kline = pd.Series(False, index=df.index)
+        for col in ("ts_close", "closeTime"):
+            if col in df:
+                is_kline |= df[col].notna()
+        is_tg = ~is_kline
+
+    kl = df[is_kline]
+    if "is_closed" in kl:
+        kl = kl[kl["is_closed"].fillna(True).astype(bool)]
+    if "isFinal" in kl:
+        kl = kl[kl["isFinal"].fillna(True).astype(bool)]
+    ts_close = _num(kl, "ts_close")
+    if "closeTime" in kl:
+        ts_close = np.where(np.isnan(ts_close), _num(kl, "closeTime") / 1000.0, ts_close)
+    close, high, low = _num(kl, "close"), _num(kl, "high"), _num(kl, "low")
+    klines = pd.DataFrame({
+        "key": _keys(kl).to_numpy(),
+        "ts_close": ts_close,
+        "close": close,
+        "high": np.where(np.isnan(high), close, high),
+        "low": np.where(np.isnan(low), close, low),
+        "quoteVolume": np.nan_to_num(_num(kl, "quoteVolume", 0.0)),
+        "vwapApprox": np.nan_to_num(_num(kl, "vwapApprox", 0.0)),
+    }).dropna(subset=["ts_close", "close"])
+
+    tg_raw = df[is_tg]
+    tg = pd.DataFrame({"key": _keys(tg_raw).to_numpy(), "ts": _num(tg_raw, "ts")})
+    for f in TG_FIELDS:
+        tg[f] = _num(tg_raw, f)
+    tg = tg.dropna(subset=["ts"])
+    return tg, klines
+
+# --------------------- Replay data --------------------
+
+@dataclass
+class ReplayData:
+    """
+    Replay-ready arrays: keys coded to ints, klines sorted by ts_close (one per bar × symbol),
+    TG sorted by ts. save()/load() keep them as .npy files so worker processes can np.load
+    them with mmap_mode='r' and share one copy through the page cache.
+    """
+    keys: List[str]
+    kl_code: np.ndarray   # int32 index into keys
+    kl_ts: np.ndarray     # float64 ts_close, sorted
+    kl_cols: np.ndarray   # (n × len(KLINE_COLS)) float64
+    tg_code: np.ndarray
+    tg_ts: np.ndarray     # float64, sorted
+    tg_vals: np.ndarray   # (n × len(TG_FIELDS)) float64, NaN = missing
+
+    ARRAYS = ("kl_code", "kl_ts", "kl_cols", "tg_code", "tg_ts", "tg_vals")
+
+    @classmethod
+    def from_frames(cls, tg: pd.DataFrame, klines: pd.DataFrame) -> "ReplayData":
+        codes, uniques = pd.factorize(pd.concat([klines["key"], tg["key"]], ignore_index=True))
+        kl = pd.DataFrame({"code": codes[:len(klines)], "ts_close": klines["ts_close"].to_numpy()})
+        for c in KLINE_COLS:
+            kl[c] = klines[c].to_numpy()
+        kl = kl.sort_values("ts_close", kind="stable").drop_duplicates(["ts_close", "code"], keep="last")
+        order = np.argsort(tg["ts"].to_numpy(), kind="stable")
+        return cls(
+            keys=[str(k) for k in uniques],
+            kl_code=kl["code"].to_numpy(np.int32),
+            kl_ts=kl["ts_close"].to_numpy(np.float64),
+            kl_cols=kl[list(KLINE_COLS)].to_numpy(np.float64),
+            tg_code=codes[len(klines):].astype(np.int32)[order],
+            tg_ts=tg["ts"].to_numpy(np.float64)[order],
+            tg_vals=tg[list(TG_FIELDS)].to_numpy(np.float64)[order],
+        )
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "keys.json").write_text(json.dumps(self.keys))
+        for name in self.ARRAYS:
+            np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        return path
+
+    @classmethod
+    def load(cls, path, mmap: bool = True) -> "ReplayData":
+        path = Path(path)
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None) for name in cls.ARRAYS}
+        return cls(keys=json.loads((path / "keys.json").read_text()), **arrays)
+
+    def select(self, code_mask: np.ndarray) -> "ReplayData":
+        """Subset of symbols (code_mask[code] → keep), e.g. one shard of a sweep."""
+        k, t = code_mask[self.kl_code], code_mask[self.tg_code]
+        return ReplayData(self.keys, self.kl_code[k], self.kl_ts[k], self.kl_cols[k],
+                          self.tg_code[t], self.tg_ts[t], self.tg_vals[t])
+
+# ----------------------- Replay -----------------------
+
+class Replay:
+    def __init__(self, trader: Optional[PaperTrader] = None, fee_bps: Optional[float] = None,
+                 config: Optional[TraderConfig] = None):
+        self.trader = trader or PaperTrader(fee_bps=fee_bps, verbose=False, config=config)
+        self.elapsed = 0.0
+        self.n_bars = 0
+        self.n_tg = 0
+
+    def run(self, tg: pd.DataFrame, klines: pd.DataFrame) -> "Replay":
+        return self.run_data(ReplayData.from_frames(tg, klines))
+
+    def run_data(self, data: ReplayData) -> "Replay":
+        t0 = time.perf_counter()
+        # map every key to a store row once
+        key_rows = self.trader.assets.rows(data.keys)
+        rows = key_rows[data.kl_code]
+        ts = np.asarray(data.kl_ts)
+        cols = {c: data.kl_cols[:, i] for i, c in enumerate(KLINE_COLS)}
+        bounds = np.r_[0, np.flatnonzero(np.diff(ts)) + 1, len(ts)] if len(ts) else np.zeros(1, np.int64)
+
+        tg_ts = np.asarray(data.tg_ts)
+        tg_rows = key_rows[data.tg_code]
+        tg_vals = data.tg_vals
+        tg_end = np.searchsorted(tg_ts, ts[bounds[:-1]], side="right")  # TG at the close time goes first
+
+        j = 0
+        for b in range(len(bounds) - 1):
+            lo, hi = bounds[b], bounds[b + 1]
+            if tg_end[b] > j:
+                self._apply_tg(tg_rows[j:tg_end[b]], tg_vals[j:tg_end[b]], tg_ts[j:tg_end[b]])
+                j = tg_end[b]
+            bar = {c: v[lo:hi] for c, v in cols.items()}
+            bar["ts_close"] = ts[lo:hi]
+            self.trader.decide_rows(rows[lo:hi], bar)
+        if j < len(tg_ts):
+            self._apply_tg(tg_rows[j:], tg_vals[j:], tg_ts[j:])
+
+        self.n_bars += len(ts)
+        self.n_tg += len(tg_ts)
+        self.elapsed += time.perf_counter() - t0
+        return self
+
+    def _apply_tg(self, rows: np.ndarray, vals: np.ndarray, ts: np.ndarray):
+        # several snapshots of one symbol in the chunk → the latest wins
+        _, first_rev = np.unique(rows[::-1], return_index=True)
+        last = len(rows) - 1 - first_rev
+        self.trader.set_tg_rows(rows[last], vals[last], ts[last])
+
+    def per_symbol(self) -> pd.DataFrame:
+        st = self.trader.assets
+        n = len(st)
+        df = pd.DataFrame({
+            "bars": st.n_bars[:n], "trades": st.n_trades[:n], "turnover": st.turnover[:n],
+            "fees": st.fees[:n], "pnl": st.realized_pnl[:n], "position": st.position[:n],
+        }, index=pd.Index(st.keys, name="symbol"))
+        return df.sort_values("pnl", ascending=False)
+
+    def summary(self) -> dict:
+        df = self.per_symbol()
+        return dict(symbols=len(df), bars=self.n_bars, tg_events=self.n_tg,
+                    pnl=float(df["pnl"].sum()), turnover=float(df["turnover"].sum()),
+                    fees=float(df["fees"].sum()), trades=int(df["trades"].sum()),
+                    elapsed_sec=round(self.elapsed, 3),
+                    bars_per_sec=round(self.n_bars / self.elapsed) if self.elapsed else None)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay recorded TG/kline events through PaperTrader")
+    ap.add_argument("files", nargs="+", help="JSONL / CSV / Parquet event files")
+    ap.add_argument("--fee-bps", type=float, default=FEE_BPS)
+    args = ap.parse_args()
+
+    tg, klines = load_events(args.files)
+    rp = Replay(fee_bps=args.fee_bps).run(tg, klines)
+    with pd.option_context("display.max_rows", 50, "display.width", 120):
+        print(rp.per_symbol())
+    print("[replay]", rp.summary())
+
+
+if __name__ == "__main__":
+    main()
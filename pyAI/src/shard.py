@@ -0,0 +1,240 @@
+"""
+Multi-process symbol sharding for the paper trader
+==================================================
+
+One decision loop (gptShit2.Runner) is bound to one core. Symbols are independent in
+PaperTrader, so this runs N Runners as separate processes, each owning the symbols whose
+"Exchange:TOKEN" key hashes to it (crc32 % N — stable across processes and restarts, so a
+shard's checkpoint always holds the same symbols):
+
+    publisher ──PUB/SUB──▶ router (this process) ──PUSH/PULL──▶ shard 0..N-1 (gptShit2.Runner)
+                                 ◀──── REQ/REP "snapshot" ────
+
+The router only finds the key: a regex over the JSON bytes (full parse as fallback), frames
+are forwarded untouched. Binary batches ([b"kline.bin" | b"tick.bin", records]) are split per shard
+with one boolean mask each; a batch that belongs to a single shard is forwarded as is.
+A slow shard blocks the router once its PUSH high-water mark is reached (same as
+PIPE_OVERFLOW=block); the other shards keep the frames they already have.
+
+Every PIPE_STATS_SEC the router asks each shard for its portfolio + pipeline metrics and
+prints the aggregated view; METRICS_PORT serves it as JSON (shards don't open their own).
+RECORD_DIR / CKPT_DIR get a shard-{i} subdirectory per shard; restart with the same N.
+
+Env: SHARDS (default: CPU count), SHARD_ADDR / SHARD_CTL_ADDR (templates with {shard},
+default ipc:///tmp/paper-shard-{shard}[.ctl]); everything else as in gptShit2.py.
+
+Usage:
+    python shard.py [--shards 4]
+"""
+
+from __future__ import annotations
+import argparse, json, multiprocessing as mp, os, re, signal, threading, time, zlib
+from typing import Dict, List, Optional
+import numpy as np
+import zmq
+
+from gptShit2 import ZMQ_SUB_ADDR, ZMQ_TOPIC, Runner, ZMQSubscriber
+from pipeline import METRICS_PORT, PIPE_STATS_SEC, StageStats, serve_metrics
+from wire_format import KLINE_BIN_TOPIC, TICK_BIN_TOPIC, decode_klines, decode_ticks, record_keys
+
+SHARDS = int(os.getenv("SHARDS", os.cpu_count() or 1))
+SHARD_ADDR = os.getenv("SHARD_ADDR", "ipc:///tmp/paper-shard-{shard}")
+SHARD_CTL_ADDR = os.getenv("SHARD_CTL_ADDR", "ipc:///tmp/paper-shard-{shard}.ctl")
+CTL_TIMEOUT_MS = 2000
+BINARY_TOPICS = {KLINE_BIN_TOPIC: decode_klines, TICK_BIN_TOPIC: decode_ticks}  # packed batches, split per shard
+
+_EXCHANGE_RE = re.compile(rb'"exchange"\s*:\s*"([^"\\]*)"')
+_TOKEN_RE = re.compile(rb'"token"\s*:\s*"([^"\\]*)"')
+
+
+def shard_of(key: str, n_shards: int) -> int:
+    return zlib.crc32(key.encode()) % n_shards
+
+
+def message_key(payload: bytes) -> str:
+    """Same key as PaperTrader._key, without a full JSON parse when the fields are plain strings."""
+    ex, tok = _EXCHANGE_RE.search(payload), _TOKEN_RE.search(payload)
+    if ex is not None and tok is not None:
+        return f"{ex.group(1).decode()}:{tok.group(1).decode()}"
+    msg = ZMQSubscriber._parse(payload) or {}
+    return f"{msg.get('exchange')}:{msg.get('token')}"
+
+# ----------------------- Router -----------------------
+
+class ShardRouter(threading.Thread):
+    """SUB from the publisher → PUSH to the shard owning each message's symbol."""
+    def __init__(self, n_shards: int, sub_addr: str = ZMQ_SUB_ADDR, topic: str = ZMQ_TOPIC,
+                 shard_addr: str = SHARD_ADDR):
+        super().__init__(daemon=True, name="shard-router")
+        self.n_shards = n_shards
+        ctx = zmq.Context.instance()
+        self.sub = ctx.socket(zmq.SUB)
+        self.sub.connect(sub_addr)
+        for t in ([b""] if not topic else [topic.encode(), *BINARY_TOPICS]):
+            self.sub.setsockopt(zmq.SUBSCRIBE, t)
+        self.push = []
+        for i in range(n_shards):
+            sock = ctx.socket(zmq.PUSH)
+            sock.setsockopt(zmq.LINGER, 0)
+            sock.bind(shard_addr.format(shard=i))
+            self.push.append(sock)
+        self.stats = StageStats("route")
+        self.routed = np.zeros(n_shards, dtype=np.int64)  # messages (binary batches: records) per shard
+        self._stop = threading.Event()
+
+    def run(self):
+        poller = zmq.Poller()
+        poller.register(self.sub, zmq.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(200):
+                continue
+            frames = self.sub.recv_multipart(copy=False)
+            t0 = time.perf_counter()
+            try:
+                self.route(frames)
+            except Exception as e:
+                self.stats.record(time.perf_counter() - t0, error=True)
+                print("[router] dropped frame:", e)
+                continue
+            self.stats.record(time.perf_counter() - t0)
+
+    def route(self, frames):
+        decode = BINARY_TOPICS.get(frames[0].bytes) if len(frames) >= 2 else None
+        if decode is not None:
+            topic, recs = frames[0].bytes, decode(frames[1].buffer)
+            sym, inv = np.unique(recs[["exchange", "symbol"]], return_inverse=True)  # hash each symbol once
+            owner = np.fromiter((shard_of(k, self.n_shards) for k in record_keys(sym)),
+                                dtype=np.int64, count=len(sym))[inv.reshape(-1)]
+            counts = np.bincount(owner, minlength=self.n_shards)
+            self.routed += counts
+            if len(recs) and counts[owner[0]] == len(recs):
+                self.push[owner[0]].send_multipart(frames, copy=False)
+                return
+            for i in np.flatnonzero(counts):
+                self.push[i].send_multipart([topic, recs[owner == i].tobytes()])
+            return
+        i = shard_of(message_key(frames[-1].bytes), self.n_shards)
+        self.routed[i] += 1
+        self.push[i].send_multipart(frames, copy=False)
+
+    def stop(self):
+        self._stop.set()
+
+# ----------------------- Shards -----------------------
+
+def _run_shard(shard: int, shard_addr: str, ctl_addr: str):
+    Runner(addr=shard_addr, shard=shard, ctl_addr=ctl_addr).start()
+
+
+def _book_summary(books: List[dict]) -> dict:
+    rows = [r for book in books for r in book.values()]
+    return dict(
+        symbols=len(rows),
+        long=sum(r["position"] > 0 for r in rows), short=sum(r["position"] < 0 for r in rows),
+        pnl=sum(r["pnl"] for r in rows), turnover=sum(r["turnover"] for r in rows),
+        fees=sum(r["fees"] for r in rows), trades=sum(r["trades"] for r in rows),
+        bars=sum(r["bars"] for r in rows),
+    )
+
+
+def portfolio(snaps: List[dict]) -> dict:
+    """Per-shard trader snapshots (disjoint symbols) → one portfolio view, higher timeframes under "timeframes"."""
+    out = dict(shards=len(snaps), **_book_summary([s.get("portfolio", {}) for s in snaps]))
+    labels = list(dict.fromkeys(tf for s in snaps for tf in s.get("timeframes", {})))
+    if labels:
+        out["timeframes"] = {tf: _book_summary([s["timeframes"].get(tf, {}) for s in snaps if "timeframes" in s])
+                             for tf in labels}
+    return out
+
+
+class ShardSupervisor:
+    def __init__(self, n_shards: int = SHARDS, shard_addr: str = SHARD_ADDR, ctl_addr: str = SHARD_CTL_ADDR):
+        self.n_shards = max(1, n_shards)
+        self.shard_addr = shard_addr
+        self.ctl_addr = ctl_addr
+        self.router = ShardRouter(self.n_shards, shard_addr=shard_addr)
+        self.procs: List[mp.Process] = []
+        self._ctl: Dict[int, zmq.Socket] = {}
+        self._last: Dict[int, dict] = {}  # latest reply per shard, kept when a shard misses a round
+        self._lock = threading.Lock()  # ctl sockets: main loop + metrics HTTP thread
+        self._stop = False
+
+    def _ctl_socket(self, i: int) -> zmq.Socket:
+        sock = self._ctl.get(i)
+        if sock is None:
+            sock = self._ctl[i] = zmq.Context.instance().socket(zmq.REQ)
+            sock.setsockopt(zmq.LINGER, 0)
+            sock.connect(self.ctl_addr.format(shard=i))
+        return sock
+
+    def snapshots(self) -> List[dict]:
+        """Ask every shard (in parallel) for {shard, metrics, portfolio}; a silent shard's last reply is reused."""
+        with self._lock:
+            waiting = {}
+            for i in range(self.n_shards):
+                sock = self._ctl_socket(i)
+                sock.send(b"snapshot")
+                waiting[sock] = i
+            poller = zmq.Poller()
+            for sock in waiting:
+                poller.register(sock, zmq.POLLIN)
+            deadline = time.monotonic() + CTL_TIMEOUT_MS / 1000
+            while waiting and time.monotonic() < deadline:
+                for sock, _ in poller.poll(max(1, int((deadline - time.monotonic()) * 1000))):
+                    i = waiting.pop(sock)
+                    poller.unregister(sock)
+                    self._last[i] = json.loads(sock.recv())
+            for sock, i in waiting.items():  # REQ is stuck waiting for a reply → fresh socket next round
+                sock.close()
+                del self._ctl[i]
+            return [self._last[i] for i in sorted(self._last)]
+
+    def metrics(self) -> dict:
+        snaps = self.snapshots()
+        return dict(portfolio=portfolio(snaps), route=dict(self.router.stats.summary(), per_shard=self.router.routed.tolist()),
+                    shards={s["shard"]: s["metrics"] for s in snaps})
+
+    def start(self):
+        ctx = mp.get_context("spawn")  # no forked copies of the parent's ZMQ context / threads
+        for i in range(self.n_shards):
+            p = ctx.Process(target=_run_shard, name=f"shard-{i}", daemon=False,
+                            args=(i, self.shard_addr.format(shard=i), self.ctl_addr.format(shard=i)))
+            p.start()
+            self.procs.append(p)
+        self.router.start()
+        if METRICS_PORT:
+            serve_metrics(self.metrics, METRICS_PORT)
+        signal.signal(signal.SIGINT, self._sig)
+        signal.signal(signal.SIGTERM, self._sig)
+        print(f"[shards] {self.n_shards} shards ← {ZMQ_SUB_ADDR}"
+              + (f" metrics=http://127.0.0.1:{METRICS_PORT}/metrics" if METRICS_PORT else ""))
+        next_stats = time.monotonic() + PIPE_STATS_SEC
+        while not self._stop and any(p.is_alive() for p in self.procs):
+            time.sleep(0.2)
+            if time.monotonic() >= next_stats:
+                print("[shards] portfolio", json.dumps(portfolio(self.snapshots())),
+                      "routed", self.router.routed.tolist())
+                next_stats = time.monotonic() + PIPE_STATS_SEC
+        snaps = self.snapshots()
+        self.router.stop()
+        for p in self.procs:
+            if p.is_alive():
+                p.terminate()  # SIGTERM → Runner stops cleanly (flushes bars, checkpoint, recorder)
+        for p in self.procs:
+            p.join()
+        print("[shards] final portfolio", json.dumps(portfolio(snaps)))
+
+    def _sig(self, *args):
+        self._stop = True
+        print("\n[shards] Stopping...")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Paper trader sharded over processes by symbol")
+    ap.add_argument("--shards", type=int, default=SHARDS)
+    args = ap.parse_args()
+    ShardSupervisor(args.shards).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Parallel parameter sweep over recorded events
+=============================================
+
+Runs a grid of TraderConfig values (fee_bps, ret_window, tau_sec, tg_decay, policy, ...) through
+replay.Replay on a ProcessPoolExecutor. Every task = one grid point × one symbol shard.
+
+The dataset is converted once to replay.ReplayData .npy files; workers np.load them with
+mmap_mode='r', so all processes share the same pages instead of unpickling a copy each.
+Symbols are independent in PaperTrader, so shards (key code % shards) sum up exactly.
+
+Usage:
+    python sweep.py events.jsonl --grid fee_bps=1,3,5 ret_window=3,5 tg_decay=0,1 \\
+        policy=coin_change,momentum [--workers 8] [--shards 2] [--out sweep.csv]
+    python sweep.py events.jsonl --grid ... --bench   # same sweep on 1, 2, 4, ... workers
+Inputs can also be a directory written by ReplayData.save (skips parsing).
+"""
+
+from __future__ import annotations
+import argparse, itertools, os, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from pathlib import Path
+from typing import Dict, List, Sequence
+import numpy as np
+import pandas as pd
+
+from gptShit2 import TraderConfig
+from replay import Replay, ReplayData, load_events
+
+SUM_COLS = ["bars", "trades", "turnover", "fees", "pnl"]
+
+_CASTS = {
+    "float": float,
+    "int": int,
+    "str": str,
+    "bool": lambda v: str(v).strip().lower() in ("1", "true", "yes"),
+}
+
+# ----------------------- Grid -------------------------
+
+def parse_grid(specs: Sequence[str]) -> List[Dict]:
+    """["fee_bps=1,3", "policy=momentum"] → list of TraderConfig kwargs (cartesian product)."""
+    types = {f.name: str(f.type) for f in fields(TraderConfig)}
+    axes = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in types:
+            raise ValueError(f"unknown TraderConfig field '{name}' (have: {', '.join(types)})")
+        cast = _CASTS[types[name]]
+        axes[name] = [cast(v) for v in values.split(",") if v != ""]
+    names = list(axes)
+    return [dict(zip(names, combo)) for combo in itertools.product(*axes.values())] or [{}]
+
+
+def prepare_data(inputs: Sequence[str], data_dir=None) -> Path:
+    """Event files → ReplayData directory (or reuse an existing one)."""
+    if len(inputs) == 1 and (Path(inputs[0]) / "keys.json").exists():
+        return Path(inputs[0])
+    tg, klines = load_events(inputs)
+    out = Path(data_dir) if data_dir else Path(tempfile.mkdtemp(prefix="sweep_data_"))
+    return ReplayData.from_frames(tg, klines).save(out)
+
+# ----------------------- Workers ----------------------
+
+def _run_task(task) -> Dict:
+    data_dir, params, shard, n_shards = task
+    data = ReplayData.load(data_dir, mmap=True)
+    if n_shards > 1:
+        data = data.select(np.arange(len(data.keys)) % n_shards == shard)
+    rp = Replay(config=TraderConfig(**params)).run_data(data)
+    summary = rp.summary()
+    return dict(params, shard=shard, **{c: summary[c] for c in SUM_COLS}, elapsed_sec=summary["elapsed_sec"])
+
+
+def sweep(data_dir, grid: List[Dict], workers: int = os.cpu_count() or 1, n_shards: int = 1) -> pd.DataFrame:
+    """One row per grid point: shard results summed, elapsed = slowest shard."""
+    tasks = [(str(data_dir), params, shard, n_shards) for params in grid for shard in range(n_shards)]
+    if workers <= 1:
+        results = [_run_task(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_task, tasks, chunksize=1))
+    df = pd.DataFrame(results)
+    params = [c for c in df.columns if c not in SUM_COLS + ["shard", "elapsed_sec"]]
+    if not params:
+        return df.drop(columns="shard").sum(numeric_only=True).to_frame().T
+    agg = {c: "sum" for c in SUM_COLS}
+    agg["elapsed_sec"] = "max"
+    return df.groupby(params, as_index=False, sort=False).agg(agg).sort_values("pnl", ascending=False)
+
+
+def bench(data_dir, grid: List[Dict], max_workers: int = os.cpu_count() or 1, n_shards: int = 1) -> pd.DataFrame:
+    """Wall time of the same sweep on 1, 2, 4, ... workers → speedup / efficiency table."""
+    counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+    rows = []
+    for w in counts:
+        t0 = time.perf_counter()
+        sweep(data_dir, grid, workers=w, n_shards=n_shards)
+        rows.append(dict(workers=w, wall_sec=time.perf_counter() - t0))
+    df = pd.DataFrame(rows)
+    df["speedup"] = df["wall_sec"].iloc[0] / df["wall_sec"]
+    df["efficiency"] = df["speedup"] / df["workers"]
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Parallel TraderConfig sweep over recorded events")
+    ap.add_argument("inputs", nargs="+", help="event files (JSONL/CSV/Parquet) or a ReplayData directory")
+    ap.add_argument("--grid", nargs="*", default=[], help="field=v1,v2,... (TraderConfig fields)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--shards", type=int, default=1, help="symbol shards per grid point")
+    ap.add_argument("--data-dir", help="where to write the memory-mapped dataset")
+    ap.add_argument("--out", help="write the result table as CSV")
+    ap.add_argument("--bench", action="store_true", help="measure scaling over worker counts")
+    args = ap.parse_args()
+
+    data_dir = prepare_data(args.inputs, args.data_dir)
+    grid = parse_grid(args.grid)
+    print(f"[sweep] data={data_dir} grid={len(grid)} shards={args.shards} workers={args.workers}")
+    if args.bench:
+        print(bench(data_dir, grid, args.workers, args.shards).to_string(index=False))
+        return
+    df = sweep(data_dir, grid, args.workers, args.shards)
+    with pd.option_context("display.max_rows", 100, "display.width", 160):
+        print(df.to_string(index=False))
+    if args.out:
+        df.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Trade / liquidation tick aggregation → microstructure features at kline close
+=============================================================================
+
+Ticks come from the Binance @aggTrade and !forceOrder@arr streams (node/testFeatures), either
+batched as packed records ([b"tick.bin", N × wire_format.TICK_DTYPE], the high-rate path) or as
+single JSON messages:
+
+    {"type": "trade",       "exchange", "token", "price", "qty", "side": "BUY" | "SELL", "ts"}
+    {"type": "liquidation", "exchange", "token", "price", "qty", "side": "BUY" | "SELL", "ts"}
+
+Binance field names are accepted too (p / q / T in ms / m = buyer is maker for trades;
+ap / S for force orders). Trade side is the aggressor; liquidation side is the forced order's
+(SELL = a long was liquidated, BUY = a short).
+
+Per symbol (rows shared with the trader's AssetStore) a ring of TICK_BUCKETS time buckets of
+TICK_WINDOW_SEC / TICK_BUCKETS seconds, each holding running sums (COLUMNS). A batch of ticks is
+folded in with a sort + np.bincount per column — no per-tick Python — and a bucket is reset
+when the ring wraps onto it. At a kline close, features(rows, ts_close) sums the buckets inside
+(ts_close - TICK_WINDOW_SEC, ts_close] into TICK_NAMES:
+
+    tick_imbalance    (buy - sell) / (buy + sell) quote volume
+    tick_rate         trades per minute
+    large_trades      trades with quote notional ≥ LARGE_TRADE_USD
+    large_imbalance   (large buy - large sell) / (large buy + large sell) notional
+    liq_long_log      log1p(notional of liquidated longs)
+    liq_short_log     log1p(notional of liquidated shorts)
+
+TraderConfig.tick_feats (env TICK_FEATS=1) adds the block to the observation; off by default so
+the observation size of existing models does not change. Run `python ticks.py` for a ticks/s
+micro-benchmark.
+"""
+
+from __future__ import annotations
+import os, sys, time
+from typing import List, Optional
+import numpy as np
+
+from wire_format import TICK_DTYPE, TICK_LIQUIDATION, TICK_TRADE
+
+TICK_FEATS = os.getenv("TICK_FEATS", "0").lower() in ("1", "true", "yes")
+TICK_WINDOW_SEC = float(os.getenv("TICK_WINDOW_SEC", 300.0))
+TICK_BUCKETS = int(os.getenv("TICK_BUCKETS", 30))
+LARGE_TRADE_USD = float(os.getenv("LARGE_TRADE_USD", 10000.0))  # node BinanceSpotLargeTrades minAmountUSD
+
+TICK_TYPES = ("trade", "liquidation")
+TICK_NAMES = ("tick_imbalance", "tick_rate", "large_trades", "large_imbalance", "liq_long_log", "liq_short_log")
+COLUMNS = ("buy", "sell", "trades", "large_buy", "large_sell", "large_n", "liq_long", "liq_short")
+_C = {name: i for i, name in enumerate(COLUMNS)}
+
+
+def _side(msg: dict, kind: int) -> int:
+    side = msg.get("side", msg.get("S"))
+    if side is None and kind == TICK_TRADE and "m" in msg:
+        return -1 if msg["m"] else 1  # buyer is maker → the seller hit the bid
+    return 1 if str(side).upper() == "BUY" else -1
+
+
+def tick_record(msg: dict) -> tuple:
+    """One JSON trade / liquidation → (ts, price, qty, side, kind) in TICK_DTYPE units."""
+    kind = TICK_LIQUIDATION if str(msg.get("type", "")).lower() == "liquidation" else TICK_TRADE
+    ts = msg.get("ts")
+    ts = float(ts) if ts else float(msg.get("T") or 0.0) / 1000.0
+    price = msg.get("price", msg.get("ap", msg.get("p")))
+    qty = msg.get("qty", msg.get("q"))
+    return ts, float(price), float(qty), _side(msg, kind), kind
+
+
+class TickAggregator:
+    """Rolling tick windows per AssetStore row; grows with the store it is attached to."""
+    def __init__(self, store, window_sec: float = TICK_WINDOW_SEC, buckets: int = TICK_BUCKETS,
+                 large_usd: float = LARGE_TRADE_USD):
+        self.store = store
+        self.buckets = max(1, int(buckets))
+        self.width = window_sec / self.buckets
+        self.window_min = window_sec / 60.0
+        self.large_usd = large_usd
+        self.capacity = 0
+        self.bid = np.empty((0, self.buckets), dtype=np.int64)
+        self.vals = np.empty((0, self.buckets, len(COLUMNS)), dtype=np.float64)
+        self._fills = dict(bid=-1, vals=0.0)  # empty value of each per-row array (universe.py)
+        self._pending: List[tuple] = []  # (key, record) from JSON messages, folded in as one batch
+        self.ticks = 0
+        self.late = 0  # older than the ring when they arrived
+        self.rejected = 0  # JSON ticks without a usable price / qty / ts
+        self.batches = 0
+
+    def _ensure(self):
+        cap = self.store.capacity
+        if cap <= self.capacity:
+            return
+        bid = np.full((cap, self.buckets), -1, dtype=np.int64)
+        vals = np.zeros((cap, self.buckets, len(COLUMNS)), dtype=np.float64)
+        bid[:self.capacity] = self.bid
+        vals[:self.capacity] = self.vals
+        self.bid, self.vals, self.capacity = bid, vals, cap
+
+    # ---------------- input ----------------
+    def on_message(self, msg: dict):
+        try:
+            rec = tick_record(msg)
+        except (TypeError, ValueError):  # ParseStage rejects these; direct callers may not validate
+            self.rejected += 1
+            return
+        self._pending.append((f"{msg.get('exchange')}:{msg.get('token')}", rec))
+        if len(self._pending) >= 4096:
+            self.flush()
+
+    def drop(self, keys):
+        """Universe eviction: pending JSON ticks of these keys would recreate their rows → dropped."""
+        gone = set(keys)
+        self._pending = [p for p in self._pending if p[0] not in gone]
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        keys, recs = zip(*pending)
+        ts, price, qty, side, kind = (np.array(c) for c in zip(*recs))
+        self.add(self.store.rows(list(keys)), ts, price, qty, side, kind)
+
+    def add_records(self, recs: np.ndarray):
+        """Packed ticks (wire_format.TICK_DTYPE): symbols mapped once per distinct (exchange, symbol)."""
+        if not len(recs):
+            return
+        sym, inv = np.unique(recs[["exchange", "symbol"]], return_inverse=True)
+        keys = [f"{e.decode('ascii')}:{s.decode('ascii')}" for e, s in sym.tolist()]
+        rows = self.store.rows(keys)[inv.reshape(-1)]
+        self.add(rows, recs["ts"], recs["price"], recs["qty"], recs["side"], recs["kind"])
+
+    def add(self, rows: np.ndarray, ts: np.ndarray, price: np.ndarray, qty: np.ndarray,
+            side: np.ndarray, kind: np.ndarray):
+        self._ensure()
+        self.ticks += len(rows)
+        self.batches += 1
+        bid = np.floor(np.asarray(ts, dtype=np.float64) / self.width).astype(np.int64)
+        cell = rows * self.buckets + bid % self.buckets
+        order = np.lexsort((bid, cell))
+        cell, bid = cell[order], bid[order]
+        # newest bucket id per touched cell; a newer one than stored → the ring wrapped: reset the cell
+        last = np.r_[cell[1:] != cell[:-1], True]
+        flat_bid = self.bid.reshape(-1)
+        flat_vals = self.vals.reshape(-1, len(COLUMNS))
+        cells, newest = cell[last], bid[last]
+        reset = newest > flat_bid[cells]
+        flat_bid[cells[reset]] = newest[reset]
+        flat_vals[cells[reset]] = 0.0
+        keep = bid == flat_bid[cell]
+        if not keep.all():
+            self.late += int((~keep).sum())
+        order, cell = order[keep], cell[keep]
+        if not len(cell):
+            return
+        quote = np.asarray(price, dtype=np.float64)[order] * np.asarray(qty, dtype=np.float64)[order]
+        buy = np.asarray(side)[order] > 0
+        liq = np.asarray(kind)[order] == TICK_LIQUIDATION
+        trade = ~liq
+        large = trade & (quote >= self.large_usd)
+        start = np.r_[True, cell[1:] != cell[:-1]]
+        group = np.cumsum(start) - 1
+        cells, ng = cell[start], int(group[-1]) + 1
+
+        def fold(name: str, weights: np.ndarray):
+            flat_vals[cells, _C[name]] += np.bincount(group, weights=weights, minlength=ng)
+
+        fold("buy", np.where(trade & buy, quote, 0.0))
+        fold("sell", np.where(trade & ~buy, quote, 0.0))
+        fold("trades", trade.astype(np.float64))
+        fold("large_buy", np.where(large & buy, quote, 0.0))
+        fold("large_sell", np.where(large & ~buy, quote, 0.0))
+        fold("large_n", large.astype(np.float64))
+        fold("liq_long", np.where(liq & ~buy, quote, 0.0))  # forced SELL closes a long
+        fold("liq_short", np.where(liq & buy, quote, 0.0))
+
+    # ---------------- output ----------------
+    def features(self, rows: np.ndarray, now_ts: np.ndarray) -> np.ndarray:
+        """(N × len(TICK_NAMES)) over the window ending at now_ts (per row); zeros without ticks."""
+        self.flush()
+        self._ensure()
+        now_bid = np.floor(np.asarray(now_ts, dtype=np.float64) / self.width).astype(np.int64)
+        ids = self.bid[rows]
+        live = (ids > (now_bid - self.buckets)[:, None]) & (ids <= now_bid[:, None])
+        s = np.einsum("nb,nbc->nc", live.astype(np.float64), self.vals[rows])
+        c = _C
+
+        def ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+            tot = a + b
+            return np.divide(a - b, tot, out=np.zeros_like(tot), where=tot > 0)
+
+        return np.stack([
+            ratio(s[:, c["buy"]], s[:, c["sell"]]),
+            s[:, c["trades"]] / self.window_min,
+            s[:, c["large_n"]],
+            ratio(s[:, c["large_buy"]], s[:, c["large_sell"]]),
+            np.log1p(s[:, c["liq_long"]]),
+            np.log1p(s[:, c["liq_short"]]),
+        ], axis=1)
+
+    def summary(self) -> dict:
+        return dict(ticks=self.ticks, batches=self.batches, late=self.late, rejected=self.rejected,
+                    pending=len(self._pending))
+
+
+# --------------------- Micro-benchmark ----------------
+
+def _bench(n_ticks: int = 2_000_000, batch: int = 500, n_symbols: int = 500):
+    """Packed tick batches → TickAggregator.add_records, plus features() at a 1m close."""
+    from gptShit2 import AssetStore
+    rng = np.random.default_rng(0)
+    recs = np.zeros(n_ticks, dtype=TICK_DTYPE)
+    recs["symbol"] = np.char.encode(np.char.add("SYM", (rng.integers(0, n_symbols, n_ticks)).astype(str)), "ascii")
+    recs["exchange"] = b"Binance"
+    recs["ts"] = 1724000000.0 + np.arange(n_ticks) * (3600.0 / n_ticks)
+    recs["price"] = rng.uniform(0.5, 2.0, n_ticks)
+    recs["qty"] = rng.lognormal(6, 2, n_ticks)
+    recs["side"] = np.where(rng.random(n_ticks) < 0.5, 1, -1)
+    recs["kind"] = (rng.random(n_ticks) < 0.01).astype(np.uint8)
+    frames = [recs[i:i + batch].tobytes() for i in range(0, n_ticks, batch)]
+    agg = TickAggregator(AssetStore())
+    t0 = time.perf_counter()
+    for f in frames:
+        agg.add_records(np.frombuffer(f, dtype=TICK_DTYPE))
+    dt = time.perf_counter() - t0
+    rows = np.arange(len(agg.store))
+    t1 = time.perf_counter()
+    agg.features(rows, np.full(len(rows), recs["ts"][-1]))
+    print(f"{n_ticks:,} ticks in batches of {batch}, {len(rows)} symbols: {n_ticks / dt:,.0f} ticks/s;"
+          f" features for all symbols {1e3 * (time.perf_counter() - t1):.2f} ms")
+
+
+if __name__ == "__main__":
+    _bench(batch=int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,226 @@
+"""
+Bounded symbol universe: idle-asset eviction, disk spill, memory accounting
+==========================================================================
+
+Every "Exchange:TOKEN" the OI bot or the feed ever mentions gets an AssetStore row (plus the
+FeatureEngine / TickAggregator rows and an order book); without eviction a long-running trader
+keeps them all. Universe.maybe_evict() runs from the decision loop every UNIVERSE_CHECK_SEC and
+evicts *flat* assets (no position, no quantity) only:
+- idle ones: no TG snapshot / decided bar for UNIVERSE_IDLE_MIN minutes
+- above UNIVERSE_MAX symbols: the least recently seen flat assets, down to the cap
+Assets holding a position are never evicted; if they alone exceed the cap, `over_cap` says by
+how much. The cap is enforced per check, so the universe can overshoot it between two checks.
+
+Rows stay dense: an evicted row is filled with the last live row (swap-remove), every per-row
+array (each object's `_fills`) is moved the same way and the freed tail is reset. Array capacity
+only grows by doubling, so with a cap it stays bounded at the power of two above it. Pending
+JSON ticks of evicted keys are dropped; per-symbol state kept outside the trader (the Runner's
+BarAggregator) is pruned through `on_evict` hooks, called with the evicted keys.
+
+With UNIVERSE_SPILL_DIR, an evicted asset's rows are written to {dir}/{quoted key}.npz and
+loaded back when the key reappears (AssetStore.on_new), so reactivation keeps its ledger,
+close history and rolling features. Tick windows are not spilled (they expire in minutes).
+With a checkpoint, evictions and reactivations go to its event log and a reactivated spill
+file is handed over to it instead of being deleted (checkpoint.py replays both).
+
+summary() also reports memory: bytes per asset row, bytes in use, allocated arrays, key
+index and order books.
+
+Env: UNIVERSE_MAX (0 → no cap), UNIVERSE_IDLE_MIN (0 → no idle eviction), UNIVERSE_SPILL_DIR,
+UNIVERSE_CHECK_SEC (default 30). Both limits default to off: nothing is evicted unless asked.
+"""
+
+from __future__ import annotations
+import os, sys, time
+from pathlib import Path
+from typing import Callable, List, Optional
+from urllib.parse import quote
+import numpy as np
+
+UNIVERSE_MAX = int(os.getenv("UNIVERSE_MAX", 0))
+UNIVERSE_IDLE_MIN = float(os.getenv("UNIVERSE_IDLE_MIN", 0.0))
+UNIVERSE_SPILL_DIR = os.getenv("UNIVERSE_SPILL_DIR", "")
+UNIVERSE_CHECK_SEC = float(os.getenv("UNIVERSE_CHECK_SEC", 30.0))
+
+
+def compact_rows(obj, src: np.ndarray, dst: np.ndarray, vacated: np.ndarray):
+    """Move rows src → dst in every per-row array of obj, reset `vacated` to the empty values."""
+    for name, fill in obj._fills.items():
+        arr = getattr(obj, name)
+        cap = len(arr)  # FeatureEngine / TickAggregator grow lazily: rows ≥ cap are still empty
+        inside = src < cap
+        arr[dst[inside]] = arr[src[inside]]
+        arr[dst[~inside & (dst < cap)]] = fill
+        arr[vacated[vacated < cap]] = fill
+
+
+def _row_bytes(obj) -> int:
+    return sum(getattr(obj, name)[:1].nbytes for name in obj._fills)
+
+
+def _alloc_bytes(obj) -> int:
+    return sum(getattr(obj, name).nbytes for name in obj._fills)
+
+
+class Universe:
+    def __init__(self, trader, max_symbols: int = UNIVERSE_MAX, idle_min: float = UNIVERSE_IDLE_MIN,
+                 spill_dir: str = UNIVERSE_SPILL_DIR, check_sec: float = UNIVERSE_CHECK_SEC,
+                 drop_books: bool = True):
+        self.trader = trader
+        self.drop_books = drop_books  # False when the order books are shared with another trader
+        self.max_symbols = max(0, int(max_symbols))
+        self.idle_sec = idle_min * 60.0
+        self.check_sec = check_sec
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            trader.assets.on_new = self._reactivate
+        self.on_evict: List[Callable[[List[str]], None]] = []  # hook(keys) after each eviction
+        self._next = time.monotonic() + check_sec
+        self.evicted = 0
+        self.spilled = 0
+        self.reactivated = 0
+        self.over_cap = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_symbols > 0 or self.idle_sec > 0
+
+    def _objects(self) -> dict:
+        tr = self.trader
+        objs = dict(store=tr.assets, feat=tr.features)
+        if tr.ticks is not None:
+            objs["ticks"] = tr.ticks
+        return objs
+
+    # ---------------- eviction ----------------
+    def maybe_evict(self, now: Optional[float] = None):
+        if not self.enabled or time.monotonic() < self._next:
+            return
+        self._next = time.monotonic() + self.check_sec
+        self.evict_idle(time.time() if now is None else now)
+
+    def evict_idle(self, now: float) -> int:
+        """Pick the flat assets to drop (idle, then LRU above the cap) and evict them."""
+        tr = self.trader
+        tr.flush_tg()  # pending TG snapshots count as activity
+        st = tr.assets
+        n = len(st)
+        flat = (st.position[:n] == 0) & (st.qty[:n] == 0)
+        last_seen = st.last_seen[:n]
+        victims = flat & (now - last_seen >= self.idle_sec) if self.idle_sec > 0 else np.zeros(n, dtype=bool)
+        if self.max_symbols:
+            extra = n - int(victims.sum()) - self.max_symbols
+            if extra > 0:
+                cand = np.flatnonzero(flat & ~victims)
+                lru = cand[np.argsort(last_seen[cand], kind="stable")[:extra]]
+                victims[lru] = True
+            self.over_cap = max(0, n - int(victims.sum()) - self.max_symbols)
+        rows = np.flatnonzero(victims)
+        if len(rows):
+            self.evict(rows)
+        return len(rows)
+
+    def evict(self, rows: np.ndarray, spill: bool = True):
+        """
+        Drop these rows (spilled first if configured); the last live rows move into the holes.
+        spill=False: checkpoint replay, the spill files are already on disk and nothing is logged.
+        """
+        tr, st = self.trader, self.trader.assets
+        rows = np.unique(rows)
+        n = len(st)
+        k = n - len(rows)
+        keys = [st.keys[r] for r in rows]
+        if spill:
+            if self.spill_dir is not None:
+                for key, r in zip(keys, rows.tolist()):
+                    self._spill(key, r)
+            if tr.checkpoint is not None:
+                tr.checkpoint.log_evict(rows)
+        gone = np.zeros(n, dtype=bool)
+        gone[rows] = True
+        dst = np.flatnonzero(gone[:k])
+        src = np.flatnonzero(~gone[k:]) + k
+        vacated = np.arange(k, n)
+        for obj in self._objects().values():
+            compact_rows(obj, src, dst, vacated)
+        for key in keys:
+            del st.index[key]
+            if self.drop_books:
+                tr.fills.books.pop(key, None)
+        for s, d in zip(src.tolist(), dst.tolist()):
+            st.keys[d] = st.keys[s]
+            st.index[st.keys[d]] = d
+        del st.keys[k:]
+        if tr.ticks is not None:
+            tr.ticks.drop(keys)
+        for hook in self.on_evict:
+            hook(keys)
+        self.evicted += len(rows)
+
+    # ---------------- spill ----------------
+    def spill_path(self, key: str) -> Path:
+        return self.spill_dir / f"{quote(key, safe='')}.npz"
+
+    def _spill(self, key: str, r: int):
+        state = {f"{prefix}.{name}": getattr(obj, name)[r] for prefix, obj in self._objects().items()
+                 if prefix != "ticks" for name in obj._fills if r < obj.capacity}
+        np.savez(self.spill_path(key), **state)
+        self.spilled += 1
+
+    def _reactivate(self, key: str, r: int):
+        """AssetStore.on_new: a spilled key is back → its rows are loaded into the new row r."""
+        path = self.spill_path(key)
+        if not path.exists():
+            return
+        ck = self.trader.checkpoint
+        logged = ck.log_reactivate(r, path) if ck is not None else None
+        self.load(key, r, path if logged is None else logged)
+        if logged is None:
+            path.unlink(missing_ok=True)
+        self.reactivated += 1
+
+    def load(self, key: str, r: int, path: Optional[Path]):
+        """Spilled rows of `key` → row r; a missing / unusable file leaves the row fresh."""
+        if path is None or not path.exists():
+            return
+        objs = self._objects()
+        try:
+            with np.load(path) as z:
+                for name in z.files:
+                    prefix, _, attr = name.partition(".")
+                    obj = objs[prefix]
+                    if r >= obj.capacity:
+                        cap = obj.capacity
+                        while cap <= r:
+                            cap *= 2
+                        obj._alloc(cap)
+                    getattr(obj, attr)[r] = z[name]
+        except Exception as e:  # window changed since the spill, truncated file: start the asset fresh
+            print(f"[universe] spill of {key} unusable ({e}), starting fresh")
+            for prefix, obj in objs.items():
+                if r < obj.capacity:
+                    for attr, fill in obj._fills.items():
+                        getattr(obj, attr)[r] = fill
+        self.trader.assets.last_seen[r] = time.time()
+
+    # ---------------- accounting ----------------
+    def memory(self) -> dict:
+        """Bytes per asset row, in use (rows + keys + books) and allocated (array capacity)."""
+        tr, st = self.trader, self.trader.assets
+        n = len(st)
+        objs = self._objects()
+        row_bytes = sum(_row_bytes(obj) for obj in objs.values())
+        index = sys.getsizeof(st.index) + sys.getsizeof(st.keys) + sum(sys.getsizeof(k) for k in st.keys)
+        books = sum(b.bids.key.nbytes + b.bids.qty.nbytes + b.asks.key.nbytes + b.asks.qty.nbytes
+                    for b in tr.fills.books.values())
+        allocated = sum(_alloc_bytes(obj) for obj in objs.values())
+        mb = lambda x: round(x / 2 ** 20, 3)
+        return dict(bytes_per_asset=row_bytes, used_mb=mb(row_bytes * n + index + books),
+                    allocated_mb=mb(allocated + index + books), index_kb=round(index / 1024, 1),
+                    books_mb=mb(books), capacity=st.capacity)
+
+    def summary(self) -> dict:
+        return dict(symbols=len(self.trader.assets), max=self.max_symbols, evicted=self.evicted,
+                    spilled=self.spilled, reactivated=self.reactivated, over_cap=self.over_cap,
+                    **self.memory())
@@ -0,0 +1,273 @@
+"""
+Packed binary wire format for the Node → Python ZMQ feed
+========================================================
+
+JSON stays the default. Binary klines are sent as a two-frame message:
+
+    [KLINE_BIN_TOPIC, N packed records]
+
+where each record has the fixed little-endian layout KLINE_DTYPE (see
+node/tools/wireFormat.js for the encoder). Python decodes the payload frame
+with np.frombuffer → structured array view over the ZMQ frame, no dicts, no copy.
+
+Trade / liquidation ticks use the same scheme, [TICK_BIN_TOPIC, N × TICK_DTYPE] (ticks.py).
+
+TG snapshots stay JSON on the wire; decode_tg / decode_tg_batch turn them into fixed-width
+TG_DTYPE records (values + null bitmask) in one pass.
+
+Run `python wire_format.py` for a JSON vs binary messages/s micro-benchmark,
+`python wire_format.py tg [events.jsonl]` for TG decoding (recorded bot messages or synthetic).
+"""
+
+from __future__ import annotations
+import json, sys, time
+import numpy as np
+
+# TG snapshot fields, in the order the trader stores them and the recorder writes them
+TG_FIELDS = ("openInterest", "volume", "trades8h", "oiChange4h", "coinChange24h", "notificationsCount8h")
+
+# decoded TG snapshot: bit i of `mask` set ↔ TG_FIELDS[i] present; missing values are 0.0
+TG_DTYPE = np.dtype([
+    ("ts", "<f8"),
+    ("mask", "u1"),
+    ("values", "<f8", (len(TG_FIELDS),)),
+])
+TG_FULL_MASK = (1 << len(TG_FIELDS)) - 1
+
+# leading frame (also the SUB topic) that marks a packed kline batch
+KLINE_BIN_TOPIC = b"kline.bin"
+
+# keep in sync with node/tools/wireFormat.js (KLINE_RECORD_SIZE = 104)
+KLINE_DTYPE = np.dtype([
+    ("symbol", "S16"),          # ASCII, NUL-padded
+    ("exchange", "S8"),         # ASCII, NUL-padded
+    ("ts_close", "<f8"),        # epoch seconds
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+    ("quoteVolume", "<f8"),
+    ("takerBuyQuote", "<f8"),
+    ("vwapApprox", "<f8"),
+    ("trades", "<u4"),
+    ("is_closed", "u1"),
+    ("_pad", "V3"),
+])
+
+
+# leading frame of a packed trade / liquidation tick batch
+TICK_BIN_TOPIC = b"tick.bin"
+TICK_TRADE, TICK_LIQUIDATION = 0, 1
+
+# keep in sync with node/tools/wireFormat.js (TICK_RECORD_SIZE = 56)
+TICK_DTYPE = np.dtype([
+    ("symbol", "S16"),          # ASCII, NUL-padded
+    ("exchange", "S8"),         # ASCII, NUL-padded
+    ("ts", "<f8"),              # epoch seconds (trade / order time)
+    ("price", "<f8"),           # trade price, liquidation average price
+    ("qty", "<f8"),             # base quantity
+    ("side", "i1"),             # +1 BUY, -1 SELL (trade: aggressor, liquidation: forced order side)
+    ("kind", "u1"),             # TICK_TRADE | TICK_LIQUIDATION
+    ("_pad", "V6"),
+])
+
+
+def decode_klines(buf) -> np.ndarray:
+    """Zero-copy view of a packed kline frame (bytes / memoryview / zmq.Frame.buffer)."""
+    if len(buf) % KLINE_DTYPE.itemsize:
+        raise ValueError(f"kline frame size {len(buf)} is not a multiple of {KLINE_DTYPE.itemsize}")
+    return np.frombuffer(buf, dtype=KLINE_DTYPE)
+
+
+def decode_ticks(buf) -> np.ndarray:
+    """Zero-copy view of a packed tick frame."""
+    if len(buf) % TICK_DTYPE.itemsize:
+        raise ValueError(f"tick frame size {len(buf)} is not a multiple of {TICK_DTYPE.itemsize}")
+    return np.frombuffer(buf, dtype=TICK_DTYPE)
+
+
+def encode_klines(msgs: list) -> bytes:
+    """Pack kline dicts (trader JSON format) — used by the benchmark and Python publishers."""
+    arr = np.zeros(len(msgs), dtype=KLINE_DTYPE)
+    for i, m in enumerate(msgs):
+        arr[i] = (
+            str(m.get("token") or m.get("symbol") or "").encode("ascii"),
+            str(m.get("exchange") or "Binance").encode("ascii"),
+            float(m["ts_close"]), float(m["open"]), float(m["high"]), float(m["low"]),
+            float(m["close"]), float(m.get("volume") or 0.0), float(m.get("quoteVolume") or 0.0),
+            float(m.get("takerBuyQuote") or 0.0), float(m.get("vwapApprox") or 0.0),
+            int(m.get("trades") or 0), 1 if m.get("is_closed", True) else 0, b"",
+        )
+    return arr.tobytes()
+
+
+def decode_tg(msg: dict, default_ts: float = 0.0) -> tuple:
+    """
+    One TG message → (ts, mask, values) tuple in TG_DTYPE order.
+    Bot values come as numbers, None, or strings like ' 9.632' / 'None' / '' — float() already
+    strips whitespace, so anything it rejects (or NaN) is simply a missing field.
+    """
+    values = [0.0] * len(TG_FIELDS)
+    mask = 0
+    get = msg.get
+    for i, f in enumerate(TG_FIELDS):
+        x = get(f)
+        if x is None:
+            continue
+        try:
+            v = float(x)
+        except (TypeError, ValueError):
+            continue
+        if v == v:
+            values[i] = v
+            mask |= 1 << i
+    ts = get("ts")
+    try:
+        ts = float(ts) if ts else float(default_ts)
+    except (TypeError, ValueError):
+        ts = float(default_ts)
+    return ts, mask, values
+
+
+def _num(x) -> float:
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _column(msgs: list, field: str) -> np.ndarray:
+    col = [m.get(field) for m in msgs]
+    try:
+        arr = np.array(col, dtype=np.float64)  # numbers, None → NaN and ' 9.3' all in C
+        if arr.ndim == 1:  # equal-length lists in the field would give a 2-D array
+            return arr
+    except (TypeError, ValueError):  # 'None', '', garbage somewhere in the column
+        pass
+    return np.fromiter((np.nan if x is None else _num(x) for x in col), dtype=np.float64, count=len(col))
+
+
+def decode_tg_batch(msgs: list, default_ts=0.0) -> np.ndarray:
+    """Many TG messages → TG_DTYPE structured array, parsed column by column (default_ts: scalar or per message)."""
+    out = np.zeros(len(msgs), dtype=TG_DTYPE)
+    if not msgs:
+        return out
+    values = np.stack([_column(msgs, f) for f in TG_FIELDS], axis=1)
+    present = ~np.isnan(values)
+    out["values"] = np.where(present, values, 0.0)
+    out["mask"] = (present << np.arange(len(TG_FIELDS))).sum(axis=1)
+    ts = _column(msgs, "ts")
+    missing = np.isnan(ts) | (ts == 0)
+    out["ts"] = np.where(missing, default_ts, ts)
+    return out
+
+
+def tg_nan_values(recs: np.ndarray) -> np.ndarray:
+    """TG_DTYPE records → (N × len(TG_FIELDS)) values with NaN where the mask bit is off."""
+    present = (recs["mask"][:, None] >> np.arange(len(TG_FIELDS), dtype=np.uint8)) & 1
+    return np.where(present.astype(bool), recs["values"], np.nan)
+
+
+def record_keys(recs: np.ndarray) -> list:
+    """'Exchange:TOKEN' keys for a decoded batch (same format PaperTrader uses)."""
+    return [f"{e.decode('ascii')}:{s.decode('ascii')}" for e, s in zip(recs["exchange"].tolist(), recs["symbol"].tolist())]
+
+
+# --------------------- Micro-benchmark ----------------
+
+def _bench(n_msgs: int = 200_000, batch: int = 200):
+    rng = np.random.default_rng(0)
+    msgs = []
+    for i in range(batch):
+        c = float(rng.uniform(0.5, 2.0))
+        msgs.append(dict(type="kline", exchange="Binance", token=f"SYM{i:04d}USDT", interval="1m",
+                         open=c, high=c * 1.01, low=c * 0.99, close=c, volume=12345.0,
+                         quoteVolume=23456.0, trades=321, takerBuyQuote=11111.0, vwapApprox=c,
+                         is_closed=True, ts_close=1724001300.0))
+    json_frames = [json.dumps(m).encode() for m in msgs]
+    bin_single = [encode_klines([m]) for m in msgs]
+    bin_batch = encode_klines(msgs)
+    rounds = max(1, n_msgs // batch)
+
+    def rate(fn) -> float:
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return rounds * batch / (time.perf_counter() - t0)
+
+    def run_json():
+        for f in json_frames:
+            m = json.loads(f)
+            float(m["close"])
+
+    def run_bin_single():
+        for f in bin_single:
+            decode_klines(f)["close"]
+
+    def run_bin_batch():
+        decode_klines(bin_batch)["close"]
+
+    print(f"record size: {KLINE_DTYPE.itemsize} B, json size: ~{len(json_frames[0])} B")
+    print(f"json.loads per message     : {rate(run_json):>14,.0f} msg/s")
+    print(f"binary, 1 record per frame : {rate(run_bin_single):>14,.0f} msg/s")
+    print(f"binary, {batch} records/frame : {rate(run_bin_batch):>14,.0f} msg/s")
+
+
+def _bench_tg(path: str = "", n_msgs: int = 200_000):
+    """TG decoding: legacy str().strip() path vs decode_tg vs decode_tg_batch."""
+    if path:
+        with open(path) as f:
+            msgs = [m for m in map(json.loads, f) if str(m.get("type", "")).lower() == "tg"]
+        if not msgs:
+            raise SystemExit(f"no type=tg messages in {path}")
+    else:  # shaped like the OI bot: padded strings, nulls, ints
+        rng = np.random.default_rng(0)
+        msgs = [dict(type="tg", token=f"SYM{i % 300}USDT", exchange="ByBit",
+                     openInterest=f"{rng.uniform(1, 99):.3f}", volume=f"{rng.uniform(1, 999):.3f}",
+                     trades8h=None, oiChange4h=f" {rng.normal(0, 5):.3f}",
+                     coinChange24h=f" {rng.normal(0, 5):.1f}", notificationsCount8h=str(int(rng.integers(1, 20))),
+                     ts=1724001000 + i) for i in range(2000)]
+    rounds = max(1, n_msgs // len(msgs))
+
+    def legacy_float(x):
+        if x is None:
+            return None
+        try:
+            s = str(x).strip()
+            if s.lower() == "none" or s == "":
+                return None
+            return float(s)
+        except Exception:
+            return None
+
+    def run_legacy():
+        for m in msgs:
+            [np.nan if v is None else v for v in (legacy_float(m.get(f)) for f in TG_FIELDS)]
+
+    def run_decode():
+        for m in msgs:
+            decode_tg(m)
+
+    def run_batch():
+        decode_tg_batch(msgs)
+
+    def rate(fn) -> float:
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return rounds * len(msgs) / (time.perf_counter() - t0)
+
+    print(f"{len(msgs)} TG messages ({path or 'synthetic'}) x {rounds} rounds")
+    legacy = rate(run_legacy)
+    print(f"legacy _to_float per field : {legacy:>14,.0f} msg/s")
+    for name, fn in (("decode_tg per message     ", run_decode), ("decode_tg_batch           ", run_batch)):
+        r = rate(fn)
+        print(f"{name} : {r:>14,.0f} msg/s  ({r / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["tg"]:
+        _bench_tg(sys.argv[2] if len(sys.argv) > 2 else "")
+    else:
+        _bench()
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from bars import SUM_FIELDS, BarAggregator
+
+T0 = 1_700_000_400.0  # multiple of 300: a 5m bucket starts here
+
+
+def _agg(**kw):
+    out = []
+    agg = BarAggregator(["5m"], lambda sec, keys, bar: out.append((sec, keys, bar)), **kw)
+    return agg, out
+
+
+def _minute(agg, keys, minute, close=1.0):
+    """1m closes for `keys` in minute index `minute` (ts_close = Binance closeTime ...59.999)."""
+    n = len(keys)
+    m = dict(ts_close=np.full(n, T0 + 60 * minute + 59.999), open=np.full(n, close), high=np.full(n, close + 1),
+             low=np.full(n, close - 1), close=np.full(n, float(close)), **{f: np.ones(n) for f in SUM_FIELDS})
+    agg.add(keys, m)
+
+
+def test_full_bar_emitted_on_its_last_minute():
+    agg, out = _agg()
+    for i in range(5):
+        _minute(agg, ["X:A"], i, close=10 + i)
+    assert len(out) == 1
+    sec, keys, bar = out[0]
+    assert (sec, keys) == (300, ["X:A"])
+    assert bar["ts_close"][0] == T0 + 300 and bar["minutes"][0] == 5 and bar["complete"][0]
+    assert (bar["open"][0], bar["high"][0], bar["low"][0], bar["close"][0]) == (10, 15, 9, 14)
+    assert bar["volume"][0] == 5
+    assert agg.summary()["5m"] == dict(bars=1, incomplete=0)
+
+
+def test_missing_minute_flags_the_bar_when_the_next_bucket_starts():
+    agg, out = _agg()
+    for i in (0, 1, 3):  # minutes 2 and 4 never arrive
+        _minute(agg, ["X:A", "X:B"], i)
+    _minute(agg, ["X:B"], 4)  # B completes its bucket even without minute 2
+    assert [(keys, bar["minutes"].tolist(), bar["complete"].tolist()) for _, keys, bar in out] == [
+        (["X:B"], [4], [False])]
+    _minute(agg, ["X:A"], 5)  # A rolls into the next bucket → its old bar is emitted, flagged
+    _, keys, bar = out[-1]
+    assert keys == ["X:A"] and bar["minutes"][0] == 3 and not bar["complete"][0]
+    assert agg.summary()["5m"] == dict(bars=2, incomplete=2)
+
+
+def test_stale_and_duplicate_minutes_are_dropped_and_counted():
+    agg, out = _agg()
+    _minute(agg, ["X:A"], 0)
+    _minute(agg, ["X:A"], 2, close=5)
+    _minute(agg, ["X:A"], 2, close=99)  # duplicate
+    _minute(agg, ["X:A"], 1, close=99)  # out of order
+    assert agg.stale == 2 and agg.summary()["minutes"] == 4
+    _minute(agg, ["X:A"], 4)
+    _, _, bar = out[0]
+    assert bar["minutes"][0] == 3 and bar["high"][0] == 6 and not bar["complete"][0]
+
+
+@pytest.mark.parametrize("grace", [0.0, 90.0])
+def test_flush_emits_quiet_symbols_after_grace(grace):
+    agg, out = _agg(grace_sec=grace)
+    _minute(agg, ["X:A", "X:B"], 0)
+    _minute(agg, ["X:A"], 1)
+    end = T0 + 300
+    agg.flush(end + grace - 1)
+    assert not out
+    agg.flush(end + grace)
+    sec, keys, bar = out[0]
+    assert sorted(keys) == ["X:A", "X:B"]
+    assert dict(zip(keys, bar["minutes"].tolist())) == {"X:A": 2, "X:B": 1}
+    assert not bar["complete"].any()
+    agg.flush(end + 10 * 60)  # nothing open any more
+    assert len(out) == 1
@@ -0,0 +1,137 @@
+import random
+import shutil
+
+import numpy as np
+import pytest
+
+import gptShit2 as g
+from checkpoint import Checkpointer
+from universe import Universe
+
+TOKENS = ["币安人生", "X" * 60, "BTC", "ETH"]  # non-ASCII and longer than any fixed-width field
+
+
+def _feed(traders, bar: int, rng: random.Random):
+    ts = 1_700_000_000 + 60 * bar
+    for t in TOKENS:
+        if rng.random() < 0.5:
+            m = dict(exchange="Binance", token=t, coinChange24h=str(rng.uniform(-1, 1)), openInterest="5", ts=ts - 5)
+            for tr in traders:
+                tr.on_tg(m)
+    msgs = []
+    for t in TOKENS:
+        c = rng.random() + 0.5
+        msgs.append(dict(exchange="Binance", token=t, open=c, high=c * 1.01, low=c * 0.99, close=c, volume=1,
+                         quoteVolume=c * 10, vwapApprox=c, ts_close=ts))
+    for tr in traders:
+        if bar % 2:
+            tr.on_kline_close_batch(msgs)
+        else:
+            for m in msgs:
+                tr.on_kline_close(m)
+
+
+def _assert_same(a, b):
+    assert a.assets.keys == b.assets.keys
+    n = len(a.assets)
+    for name in ("assets", "features"):
+        x, y = getattr(a, name), getattr(b, name)
+        for attr, v in vars(x).items():
+            if isinstance(v, np.ndarray) and v.ndim and len(v) == x.capacity and attr != "last_seen":  # wall clock
+                m = min(n, x.capacity)
+                np.testing.assert_allclose(v[:m], getattr(y, attr)[:m], rtol=0, atol=1e-9, err_msg=f"{name}.{attr}")
+
+
+def test_restore_non_ascii_keys(tmp_path):
+    rng = random.Random(0)
+    ref = g.PaperTrader(verbose=False)
+    live = g.PaperTrader(verbose=False)
+    ck = Checkpointer(tmp_path, live, interval_sec=1e9)
+    ck.restore()
+    live.checkpoint = ck
+    for bar in range(40):
+        _feed([ref, live], bar, rng)
+        if bar == 15:
+            ck.snapshot(wait=True)
+    ck._writer.join()
+    # crash: no final snapshot, a torn record at the end of the bar log
+    with open(ck._path("bar", ck.gen), "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    restored = g.PaperTrader(verbose=False)
+    info = Checkpointer(tmp_path, restored).restore()
+    assert info["replayed_bars"] == 24 * len(TOKENS)
+    assert "Binance:币安人生" in restored.assets.index
+    assert "Binance:" + "X" * 60 in restored.assets.index
+    _assert_same(ref, restored)
+
+
+def test_failed_log_write_leaves_ledger_untouched(tmp_path):
+    tr = g.PaperTrader(verbose=False)
+    ck = Checkpointer(tmp_path, tr, interval_sec=1e9)
+    ck.restore()
+    tr.checkpoint = ck
+    _feed([tr], 0, random.Random(1))
+    before = {k: v.copy() for k, v in vars(tr.assets).items() if isinstance(v, np.ndarray)}
+
+    def fail(f, data):
+        raise OSError("disk full")
+
+    ck._append = fail
+    with pytest.raises(OSError):
+        tr.on_kline_close(dict(exchange="Binance", token="币安人生", open=1, high=1, low=1, close=1.2, volume=1,
+                               ts_close=1_700_000_060))
+    r = tr.assets.index["Binance:币安人生"]
+    for name in ("position", "qty", "realized_pnl"):
+        np.testing.assert_array_equal(getattr(tr.assets, name)[r], before[name][r])
+
+
+def _evicting_trader(spill_dir, ckpt_dir=None):
+    tr = g.PaperTrader(verbose=False)
+    tr.universe = Universe(tr, max_symbols=4, spill_dir=str(spill_dir))
+    # mostly flat, so the cap can evict; deterministic in the observation
+    tr.policy.predict_batch = lambda obs: np.where(np.abs(obs).sum(axis=1) * 1e3 % 10 < 1, 2, 1)
+    if ckpt_dir is not None:
+        ck = Checkpointer(ckpt_dir, tr, interval_sec=1e9)
+        ck.restore()
+        tr.checkpoint = ck
+    return tr
+
+
+def _bar(rng: np.random.Generator, keys, step: int) -> dict:
+    close = rng.uniform(0.5, 1.5, len(keys))
+    return dict(close=close, ts_close=np.full(len(keys), 1_700_000_000.0 + 60 * step), high=close * 1.01,
+                low=close * 0.99, quoteVolume=np.ones(len(keys)), vwapApprox=close)
+
+
+def test_restore_replays_evictions(tmp_path):
+    rng = np.random.default_rng(0)
+    keys = [f"Binance:S{i}" for i in range(12)] + ["Binance:币安人生"]
+    live = _evicting_trader(tmp_path / "spill", tmp_path / "ckpt")
+    for step in range(60):
+        active = [keys[i] for i in rng.choice(len(keys), 5, replace=False)]
+        for k in active[:2]:
+            live.on_tg(dict(exchange="Binance", token=k.split(":")[1], openInterest=str(rng.random()),
+                            coinChange24h=str(rng.normal()), ts=1_700_000_000.0 + 60 * step))
+        live._decide_bar(active, _bar(rng, active, step))
+        live.universe.evict_idle(now=1e12)  # LRU above the cap
+        if step == 20:
+            live.checkpoint.snapshot(wait=True)
+    assert live.universe.evicted and live.universe.reactivated
+    live.checkpoint._writer.join()
+
+    # crash (no final snapshot) → restore from the step-20 snapshot + logs, spill dir as left behind
+    shutil.copytree(tmp_path / "spill", tmp_path / "spill-copy")
+    restored = _evicting_trader(tmp_path / "spill-copy")
+    info = Checkpointer(tmp_path / "ckpt", restored).restore()
+    assert info["replayed_events"] > 0
+    assert sorted(restored.assets.keys) == sorted(live.assets.keys)
+    np.testing.assert_array_equal(restored.assets.position[restored.assets.rows(live.assets.keys)],
+                                  live.assets.position[:len(live.assets)])
+    # reactivate everything: spilled and in-memory state must both match the live trader
+    for tr in (live, restored):
+        tr.checkpoint = None
+        tr.assets.rows(keys)
+    assert restored.snapshot() == live.snapshot()
+    ra, rb = live.assets.rows(keys), restored.assets.rows(keys)
+    np.testing.assert_allclose(restored.features.out[rb], live.features.out[ra], rtol=0, atol=1e-12)
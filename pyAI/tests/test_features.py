@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gptShit2 import FeatureEngine
+
+WINDOW, SPAN, PERIOD = 20, 12, 14
+
+
+def _naive(bars: pd.DataFrame) -> pd.DataFrame:
+    """FeatureEngine.NAMES for one symbol's bars, straight from pandas rolling / ewm."""
+    close, high, low = bars["close"], bars["high"], bars["low"]
+    ret = close.pct_change()
+    roll = lambda s, fn, **kw: getattr(s.rolling(WINDOW, min_periods=1), fn)(**kw)
+    c_std = close.rolling(WINDOW, min_periods=2).std(ddof=1).fillna(0.0)
+    ema = close.ewm(span=SPAN, adjust=False).mean()
+    prev = close.shift()
+    tr = pd.concat([high - low, (high - prev).abs(), (low - prev).abs()], axis=1).max(axis=1)
+    atr = tr.ewm(alpha=1.0 / PERIOD, adjust=False).mean()  # Wilder, seeded with the first TR
+    has_vwap = bars["vwap"] > 0
+    qv = roll(bars["quoteVolume"].where(has_vwap, 0.0), "sum")
+    bv = roll((bars["quoteVolume"] / bars["vwap"]).where(has_vwap, 0.0), "sum")
+    return pd.DataFrame(dict(
+        ret_mean=roll(ret, "mean").fillna(0.0),
+        ret_std=ret.rolling(WINDOW, min_periods=2).std(ddof=1).fillna(0.0),
+        zscore=((close - roll(close, "mean")) / c_std).where(c_std > 0, 0.0),
+        ema_dev=close / ema - 1.0,
+        atr_pct=atr / close,
+        vwap_dev=(close / (qv / bv) - 1.0).where(bv > 0, 0.0),
+    ))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_features_match_pandas(seed):
+    rng = np.random.default_rng(seed)
+    n_sym, steps = 7, 150
+    eng = FeatureEngine(capacity=2, window=WINDOW, ema_span=SPAN, atr_period=PERIOD)  # grows while running
+    price = rng.uniform(1, 100, n_sym)
+    history = {s: [] for s in range(n_sym)}
+    got = {s: [] for s in range(n_sym)}
+    for _ in range(steps):
+        rows = np.sort(rng.choice(n_sym, rng.integers(1, n_sym + 1), replace=False))
+        price[rows] *= np.exp(rng.normal(0, 0.02, len(rows)))
+        close = price[rows].copy()
+        high = close * (1 + rng.uniform(0, 0.03, len(rows)))
+        low = close * (1 - rng.uniform(0, 0.03, len(rows)))
+        qv = rng.lognormal(8, 1, len(rows))
+        vwap = np.where(rng.random(len(rows)) < 0.1, 0.0, rng.uniform(low, high))  # no VWAP on some bars
+        feats = eng.update(rows, high, low, close, qv, vwap)
+        for i, s in enumerate(rows.tolist()):
+            history[s].append(dict(close=close[i], high=high[i], low=low[i], quoteVolume=qv[i], vwap=vwap[i]))
+            got[s].append(feats[i])
+    for s in range(n_sym):
+        want = _naive(pd.DataFrame(history[s]))[list(FeatureEngine.NAMES)].to_numpy()
+        np.testing.assert_allclose(np.array(got[s]), want, rtol=1e-7, atol=1e-10, err_msg=f"symbol {s}")
+        np.testing.assert_array_equal(eng.out[s], got[s][-1])
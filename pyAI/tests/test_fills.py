@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from fills import FillSimulator, OrderBook
+
+NOW = 1_000.0
+BIDS = [["99.0", "1.0"], ["98.0", "2.0"], ["97.0", "4.0"]]
+ASKS = [["101.0", "1.0"], ["102.0", "2.0"], ["103.0", "4.0"]]
+
+
+def _sim(**book) -> FillSimulator:
+    sim = FillSimulator(levels=8, max_age_sec=30.0)
+    sim.on_message(dict(type="depth", exchange="X", token="A", lastUpdateId=10,
+                        bids=book.get("bids", BIDS), asks=book.get("asks", ASKS)), now=NOW)
+    return sim
+
+
+@pytest.mark.parametrize("size, want, exhausted", [
+    (0.5, 101.0, False),                              # inside the best level
+    (1.0, 101.0, False),                              # exactly the best level
+    (2.0, (101.0 + 102.0) / 2, False),                # crosses into the second
+    (5.0, (101.0 + 2 * 102.0 + 2 * 103.0) / 5, False),
+    (9.0, (101.0 + 2 * 102.0 + 6 * 103.0) / 9, True),  # beyond the book: rest at the worst level
+    (-3.0, (99.0 + 2 * 98.0) / 3, False),             # sells walk the bids down
+])
+def test_fill_walks_levels_at_vwap(size, want, exhausted):
+    book = _sim().books["X:A"]
+    price, ex = book.fill(size)
+    assert price == pytest.approx(want)
+    assert ex is exhausted
+
+
+def test_exec_prices_falls_back_without_a_usable_book():
+    sim = _sim()
+    ref = np.array([100.0, 100.0, 100.0])
+    got = sim.exec_prices(["X:A", "X:B", "X:A"], np.array([2.0, 1.0, -1.0]), ref, now=NOW + 1)
+    np.testing.assert_allclose(got, [101.5, 100.0, 99.0])
+    assert (sim.fills, sim.fallback) == (2, 1)
+    stale = sim.exec_prices(["X:A"], np.array([1.0]), ref[:1], now=NOW + 31)  # older than max_age_sec
+    np.testing.assert_allclose(stale, [100.0])
+    assert sim.fallback == 2
+
+
+def test_diffs_update_levels_in_place():
+    sim = _sim()
+    sim.on_message(dict(type="depth_diff", exchange="X", token="A", U=11, u=12,
+                        b=[["99.0", "0"], ["98.5", "3"]], a=[["100.5", "0.5"], ["102.0", "0"]]), now=NOW)
+    book = sim.books["X:A"]
+    np.testing.assert_array_equal(book.bids.prices, [98.5, 98.0, 97.0])
+    np.testing.assert_array_equal(book.asks.prices, [100.5, 101.0, 103.0])
+    np.testing.assert_array_equal(book.asks.qty[:book.asks.n], [0.5, 1.0, 4.0])
+    assert book.last_update_id == 12 and sim.gaps == 0
+
+
+def test_diff_gap_unsyncs_until_next_snapshot():
+    sim = _sim()
+    book = sim.books["X:A"]
+    sim.on_message(dict(type="depth_diff", exchange="X", token="A", U=5, u=9, b=[["1", "1"]]), now=NOW)
+    assert book.synced and len(book.bids) == 3  # already covered by the snapshot → skipped
+    sim.on_message(dict(type="depth_diff", exchange="X", token="A", U=13, u=14, a=[["100", "1"]]), now=NOW)
+    assert not book.synced and sim.gaps == 1  # 11..12 missing
+    assert len(book.asks) == 3  # the diff after the gap is not applied
+    got = sim.exec_prices(["X:A"], np.array([1.0]), np.array([100.0]), now=NOW)
+    assert got[0] == 100.0 and sim.fallback == 1
+    sim.on_message(dict(type="depth", exchange="X", token="A", lastUpdateId=20, bids=BIDS, asks=ASKS), now=NOW)
+    assert book.synced
+
+
+def test_malformed_messages_are_rejected_without_touching_the_book():
+    sim = _sim()
+    book = sim.books["X:A"]
+    bad = [
+        dict(type="depth_diff", exchange="X", token="A", u=12, b=[["98", "1"]]),           # no U
+        dict(type="depth_diff", exchange="X", token="A", U=11, u=12, b=[["98", "x"]]),     # garbage qty
+        dict(type="depth", exchange="X", token="A", lastUpdateId=30, bids=BIDS, asks=[["1", "2", "3"]]),
+        dict(type="depth", exchange="X", token="A", lastUpdateId=30, bids=BIDS),           # no asks
+        dict(type="book_ticker", exchange="X", token="A", bidPrice="99", bidQty="1", askPrice="nan", askQty="1"),
+        dict(type="book_ticker", exchange="X", token="A", bidPrice=None, bidQty="1", askPrice="101", askQty="1"),
+    ]
+    for msg in bad:
+        sim.on_message(msg, now=NOW)
+    assert sim.rejected == len(bad) and sim.summary()["rejected"] == len(bad)
+    np.testing.assert_array_equal(book.bids.prices, [99.0, 98.0, 97.0])
+    np.testing.assert_array_equal(book.asks.prices, [101.0, 102.0, 103.0])
+    assert book.last_update_id == 10 and book.synced
+
+
+def test_book_ticker_only_book_is_usable():
+    book = OrderBook(levels=4)
+    book.set_top(99.0, 1.0, 101.0, 2.0, now=NOW)
+    assert book.synced
+    assert book.fill(1.0) == (101.0, False)
@@ -0,0 +1,23 @@
+import io
+import json
+
+import numpy as np
+
+from logsink import LogSink
+
+
+def test_journal_rows_survive_a_full_console_ring(tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    out = io.StringIO()
+    sink = LogSink(stream=out, journal_path=str(journal), level="info", ring_size=4, flush_sec=60)
+    for i in range(50):
+        sink.emit_rows("decision", key=["X:A", "X:B"], close=np.array([1.0, 2.0]),
+                       action=np.array([1, 2]), pos=np.array([0, 1]), pnl=np.array([0.0, i]))
+        sink.emit("note", i=i)
+    sink.close()
+    rows = [json.loads(line) for line in journal.read_text().splitlines()]
+    assert len(rows) == 100 and sink.journaled == 100
+    assert [r["pnl"] for r in rows[1::2]] == list(range(50))  # in order, none missing
+    summary = sink.summary()
+    assert summary["dropped"] > 0 and sink.written < 150  # the console ring did overflow
+    assert summary["pending"] == summary["journal_pending"] == 0
@@ -0,0 +1,79 @@
+import queue
+
+import pytest
+
+from pipeline import StageQueue, event_key, validate
+
+
+def _drain(q: StageQueue) -> list:
+    out = []
+    while True:
+        try:
+            out.append(q.get(timeout=0))
+        except queue.Empty:
+            return out
+
+
+def _kline(token: str, close: float) -> dict:
+    return dict(type="kline", exchange="X", token=token, open=1, high=2, low=0.5, close=close,
+                volume=3, ts_close=60)
+
+
+def test_drop_oldest_keeps_newest_in_order():
+    q = StageQueue("t", maxsize=3, overflow="drop_oldest")
+    for i in range(5):
+        q.put(i)
+    assert _drain(q) == [2, 3, 4]
+    assert (q.puts, q.gets, q.dropped) == (5, 3, 2)
+
+
+def test_coalesce_replaces_payload_in_its_slot():
+    q = StageQueue("t", maxsize=10, overflow="coalesce")
+    for msg in (_kline("A", 1), _kline("B", 1), _kline("A", 2), dict(type="trade", token="A"), _kline("B", 3)):
+        q.put(msg, event_key(msg))
+    got = _drain(q)
+    # A keeps the first slot with the newest close, the keyless trade is never merged
+    assert [(m["type"], m.get("token"), m.get("close")) for m in got] == [
+        ("kline", "A", 2), ("kline", "B", 3), ("trade", "A", None)]
+    assert q.coalesced == 2 and q.dropped == 0
+
+
+def test_coalesce_after_get_queues_a_new_slot():
+    q = StageQueue("t", maxsize=10, overflow="coalesce")
+    q.put("a1", key="A")
+    assert q.get(timeout=0) == "a1"
+    q.put("a2", key="A")  # the old entry is gone, so this must not replace anything
+    q.put("b1", key="B")
+    assert _drain(q) == ["a2", "b1"] and q.coalesced == 0
+
+
+def test_coalesce_full_queue_drops_oldest_and_forgets_its_key():
+    q = StageQueue("t", maxsize=2, overflow="coalesce")
+    q.put("a1", key="A")
+    q.put("b1", key="B")
+    q.put("c1", key="C")  # full → a1 dropped
+    q.put("a2", key="A")  # must queue fresh, not write into the dropped entry
+    assert _drain(q) == ["c1", "a2"]
+    assert q.dropped == 2 and q.coalesced == 0
+
+
+@pytest.mark.parametrize("field", ["open", "high", "low", "volume", "close", "ts_close"])
+def test_validate_rejects_kline_missing_a_decision_field(field):
+    msg = _kline("A", 1)
+    assert validate(msg)
+    del msg[field]
+    assert not validate(msg)
+    assert not validate(dict(_kline("A", 1), **{field: "nan"}))
+
+
+@pytest.mark.parametrize("msg, ok", [
+    (dict(type="depth", token="A", lastUpdateId=1, bids=[["1", "2"]], asks=[]), True),
+    (dict(type="depth", token="A", lastUpdateId=1, bids=[["1", "2"]]), False),
+    (dict(type="depth_diff", token="A", U=1, u=2, b=[]), True),
+    (dict(type="depth_diff", token="A", u=2, b=[]), False),
+    (dict(type="book_ticker", token="A", bidPrice="1", bidQty="2", askPrice="3", askQty="4"), True),
+    (dict(type="book_ticker", token="A", bidPrice="1", bidQty="2", askPrice="nan", askQty="4"), False),
+    (dict(type="book_ticker", bidPrice="1", bidQty="2", askPrice="3", askQty="4"), False),
+])
+def test_validate_book_messages(msg, ok):
+    assert validate(msg) is ok
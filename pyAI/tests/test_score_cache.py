@@ -0,0 +1,74 @@
+import pytest
+
+import ai_server_zmq
+from ai_server_zmq import ScoreCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(ai_server_zmq.time, "monotonic", c)
+    return c
+
+
+def _msg(symbol, *features):
+    return dict(type="bnn_market", symbol=symbol, features=list(features))
+
+
+def _counting(calls):
+    def handler(msg):
+        calls.append(msg["symbol"])
+        return {"score": len(calls)}
+    return handler
+
+
+def test_rounded_features_share_an_entry_until_ttl(clock):
+    cache, calls = ScoreCache(ttl_sec=10, max_size=8, digits=3, enabled=True), []
+    handler = _counting(calls)
+    first = cache.call("bnn_market", _msg("A", 1.2341, 5), handler)
+    assert cache.call("bnn_market", _msg("A", 1.2339, 5.0001), handler) == first  # same key at 3 digits
+    clock.now += 9.9
+    assert cache.call("bnn_market", _msg("A", 1.234, 5), handler) == first
+    clock.now += 0.2  # expired
+    assert cache.call("bnn_market", _msg("A", 1.234, 5), handler) != first
+    assert calls == ["A", "A"]
+    s = cache.summary()
+    assert (s["hits"], s["misses"], s["expired"], s["size"]) == (2, 2, 1, 1)
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache, calls = ScoreCache(ttl_sec=60, max_size=2, digits=4, enabled=True), []
+    handler = _counting(calls)
+    for sym in ("A", "B"):
+        cache.call("bnn_market", _msg(sym, 1), handler)
+    cache.call("bnn_market", _msg("A", 1), handler)  # hit → A is now the most recent
+    cache.call("bnn_market", _msg("C", 1), handler)  # full → B goes
+    assert cache.evictions == 1
+    cache.call("bnn_market", _msg("A", 1), handler)
+    cache.call("bnn_market", _msg("B", 1), handler)
+    assert calls == ["A", "B", "C", "B"]
+
+
+def test_batch_computes_misses_once_and_skips_errors(clock):
+    cache = ScoreCache(ttl_sec=60, max_size=8, digits=4, enabled=True)
+    seen = []
+
+    def handler(msgs):
+        seen.append([m["symbol"] for m in msgs])
+        return [{"error": "bad"} if m["symbol"] == "E" else {"score": m["symbol"]} for m in msgs]
+
+    msgs = [_msg("A", 1), _msg("A", 1), _msg("E", 1), dict(_msg("N", 1), no_cache=True)]
+    replies = cache.call_batch("bnn_market", msgs, handler)
+    assert replies == [{"score": "A"}, {"score": "A"}, {"error": "bad"}, {"score": "N"}]
+    assert seen == [["A", "E", "N"]]
+    cache.call_batch("bnn_market", msgs, handler)
+    assert seen[-1] == ["E", "N"]  # A cached; errors and no_cache requests are not
+    assert cache.bypassed == 2
@@ -0,0 +1,50 @@
+import numpy as np
+
+from gptShit2 import PaperTrader
+
+
+def _tg(token, ts, **fields):
+    return dict(type="tg", exchange="Binance", token=token, ts=ts, **fields)
+
+
+BURST = [
+    _tg("A", 1.0, openInterest="100", volume=5, coinChange24h=" 1.5"),
+    _tg("B", 1.5, openInterest=7, trades8h="None"),
+    _tg("A", 2.0, openInterest="101", volume=None, oiChange4h="0.2"),
+    _tg("C", 2.5, notificationsCount8h=3),
+    _tg("A", 3.0, openInterest="102", coinChange24h=""),  # latest A: fields absent now stay absent
+    _tg("B", 3.5, openInterest=8, trades8h=12),
+]
+
+
+def _store(trader, keys):
+    st = trader.assets
+    rows = st.rows(keys)
+    return st.tg[rows].copy(), st.tg_mask[rows].copy(), st.tg_ts[rows].copy()
+
+
+def test_burst_coalesces_to_the_latest_snapshot_per_symbol():
+    coalesced = PaperTrader(verbose=False)
+    every = PaperTrader(verbose=False)
+    every.policy.wants_tg_obs = True  # the per-message path: every TG written as it arrives
+    for msg in BURST:
+        coalesced.on_tg(msg)
+        every.on_tg(msg)
+    assert coalesced.tg_received == 6 and coalesced.tg_coalesced == 3
+    assert not len(coalesced.assets.index)  # nothing written before the next decision
+    coalesced.flush_tg()
+    keys = ["Binance:A", "Binance:B", "Binance:C"]
+    for got, want in zip(_store(coalesced, keys), _store(every, keys)):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_pending_snapshots_are_applied_before_a_decision():
+    trader = PaperTrader(verbose=False)
+    trader.on_tg(_tg("A", 59.0, openInterest=1))
+    trader.on_tg(_tg("A", 59.5, openInterest=2))
+    trader.on_kline_close(dict(type="kline", exchange="Binance", token="A", open=1, high=1, low=1,
+                               close=1, volume=1, ts_close=60))
+    st = trader.assets
+    r = st.row("Binance:A")
+    assert st.tg[r][0] == 2 and st.tg_ts[r] == 59.5
+    assert not trader._tg_pending
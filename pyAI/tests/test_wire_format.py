@@ -0,0 +1,14 @@
+import numpy as np
+
+from wire_format import TG_FIELDS, decode_tg, decode_tg_batch
+
+
+def test_tg_batch_matches_single_decoder_on_bad_fields():
+    field = TG_FIELDS[0]
+    msgs = [{field: [1, 2]}, {field: [3, 4]}, {field: " 9.5"}, {field: None}, {field: "None"}, {}]
+    for bad in (msgs[:2], msgs):  # only lists (2-D column) / lists mixed with the rest
+        recs = decode_tg_batch(bad, default_ts=7.0)
+        for m, rec in zip(bad, recs):
+            ts, mask, values = decode_tg(m, 7.0)
+            assert rec["mask"] == mask and rec["ts"] == ts
+            np.testing.assert_array_equal(rec["values"], values)